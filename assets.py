@@ -0,0 +1,54 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Downloads every asset of the manifest into a local directory, used as an
+offline source by SimpleGUIBackend(asset_dir) and HeadlessBackend(asset_dir = ...).
+
+Usage:
+    python assets.py assets/
+
+"""
+
+# import modules
+import os, sys, time
+from urllib.request import urlopen
+import game
+
+def download(asset_dir, force = False):
+    """
+    Downloads the missing assets, returns the (url, bytes, seconds) of each download
+    """
+    if not os.path.isdir(asset_dir):
+        os.makedirs(asset_dir)
+    downloads = []
+    for kind, url, size in game.ASSET_MANIFEST:
+        path = os.path.join(asset_dir, game.get_asset_filename(url))
+        if os.path.exists(path) and not force:
+            continue
+        start_time = time.time()
+        response = urlopen(url)
+        data = response.read()
+        response.close()
+        # writes to a temporary file first so an interrupted download isn't used
+        with open(path + '.part', 'wb') as asset_file:
+            asset_file.write(data)
+        os.rename(path + '.part', path)
+        downloads.append((url, len(data), time.time() - start_time))
+    return downloads
+
+def main(argv = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) != 1:
+        print('usage: python assets.py asset_dir')
+        return 2
+    downloads = download(argv[0])
+    for url, size, seconds in downloads:
+        print('%-40s %8d bytes in %0.2fs' % (game.get_asset_filename(url), size, seconds))
+    print('%d assets downloaded, %d up to date' % (len(downloads), len(game.ASSET_MANIFEST) - len(downloads)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
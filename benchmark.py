@@ -0,0 +1,307 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Benchmarks the simulation core by driving AsteroidsGame headlessly
+through scripted scenarios.
+
+Reports ticks/sec, per-tick latency percentiles and their growth over the
+run (next to the growth of live entities), the spawn and cull rates of
+the rocks, the render cost of the last frame (its command buffer replayed
+into a headless canvas) and peak traced memory per scenario, and compares
+them against a stored baseline.
+
+Usage:
+    python benchmark.py                             runs every scenario
+    python benchmark.py idle rapid_fire             runs the given scenarios
+    python benchmark.py --save-baseline             stores the results as the baseline
+    python benchmark.py --threshold 0.05            fails on a 5% regression
+
+"""
+
+# import modules
+import argparse, json, random, sys, time, tracemalloc
+import game
+try:
+    import entity_store
+except ImportError:
+    # NumPy isn't installed, the store-backed scenarios are skipped
+    entity_store = None
+
+# default baseline file
+BASELINE_FILE = 'benchmark_baseline.json'
+# allowed slowdown (or memory growth) before a scenario is a regression
+REGRESSION_THRESHOLD = 0.1
+# unmeasured ticks ran before timing
+WARMUP_TICKS = 20
+# lives given to the player so the game never resets mid-run
+BENCHMARK_LIVES = 10 ** 9
+# submissions of the last frame averaged to measure its render cost
+RENDER_REPLAYS = 100
+# rocks per second spawned by the director to fill the stress scenarios
+STRESS_SPAWN_RATE = 6000.0
+
+class Scenario:
+    def __init__(self, name, ticks, max_rock_count = game.MAX_ROCK_COUNT):
+        """
+        Creates a new scenario
+
+        <str> name              The name of the scenario
+        <int> ticks             The number of timer ticks (25ms) to run
+        <int> max_rock_count    The maximum number of rocks
+        """
+        self.name = name
+        self.ticks = ticks
+        self.max_rock_count = max_rock_count
+        # unmeasured ticks ran first
+        self.warmup_ticks = WARMUP_TICKS
+    def setup(self, asteroids):
+        """
+        Prepares the game before the first tick
+        """
+        pass
+    def tick(self, asteroids, tick):
+        """
+        Feeds the scripted input before each tick
+        """
+        pass
+    def fill_rocks(self, asteroids, count):
+        for i in range(count):
+            asteroids.rocks.add(asteroids.create_rock())
+
+class IdleScenario(Scenario):
+    pass
+
+class MaxRocksScenario(Scenario):
+    def __init__(self, name, ticks, rock_count):
+        Scenario.__init__(self, name, ticks, rock_count)
+        self.rock_count = rock_count
+    def setup(self, asteroids):
+        self.fill_rocks(asteroids, self.rock_count)
+    def tick(self, asteroids, tick):
+        # puts back the rocks that crashed into the player, so the run stays at the maximum
+        self.fill_rocks(asteroids, self.rock_count - asteroids.rocks.count())
+
+class RapidFireScenario(Scenario):
+    def setup(self, asteroids):
+        self.fill_rocks(asteroids, self.max_rock_count)
+        asteroids.player.rotate('left')
+    def tick(self, asteroids, tick):
+        # shoots on every tick
+        asteroids.player.shoot_start()
+
+class MassExplosionsScenario(Scenario):
+    def __init__(self, name, ticks, explosions_per_tick):
+        Scenario.__init__(self, name, ticks)
+        self.explosions_per_tick = explosions_per_tick
+    def tick(self, asteroids, tick):
+        for i in range(self.explosions_per_tick):
+            position = (random.randrange(0, asteroids.get_window_width()), random.randrange(0, asteroids.get_window_height()))
+            asteroids.create_explosion(position)
+
+class StressScenario(RapidFireScenario):
+    def __init__(self, name, ticks, entity_count, warmup_ticks, store = False):
+        RapidFireScenario.__init__(self, name, ticks, None)
+        self.entity_count = entity_count
+        # the director fills the field (within ENTITY_BUDGET) before measuring
+        self.warmup_ticks = warmup_ticks
+        self.store = store
+    def setup(self, asteroids):
+        if self.store:
+            entity_store.attach_rocks(asteroids, entity_store.EntityStore(self.entity_count))
+        asteroids.director.set_curves([(0, self.entity_count)], [(0, STRESS_SPAWN_RATE)])
+        asteroids.player.rotate('left')
+
+class WaveScenario(Scenario):
+    def __init__(self, name, ticks, budget_curve, rate_curve):
+        Scenario.__init__(self, name, ticks, None)
+        self.budget_curve = budget_curve
+        self.rate_curve = rate_curve
+    def setup(self, asteroids):
+        asteroids.director.set_curves(self.budget_curve, self.rate_curve)
+
+class SplittingScenario(WaveScenario):
+    def __init__(self, name, ticks, warmup_ticks, budget_curve, rate_curve, ship_count):
+        WaveScenario.__init__(self, name, ticks, budget_curve, rate_curve)
+        self.warmup_ticks = warmup_ticks
+        self.ship_count = ship_count
+    def setup(self, asteroids):
+        WaveScenario.setup(self, asteroids)
+        # a smaller safe zone, so the gunners don't keep most of the screen clear of new rocks
+        asteroids.director.safe_zone_radius = 50
+        # more gunners spread over the screen, spinning the other way every other one
+        width, height = asteroids.get_size()
+        for i in range(1, self.ship_count):
+            ship = asteroids.add_ship((width * (i + 0.5) / self.ship_count, height * (i % 2 + 0.5) / 2))
+            ship.rotate('right' if i % 2 else 'left')
+        asteroids.player.rotate('left')
+    def tick(self, asteroids, tick):
+        # every ship shoots on every tick, its hits split the rocks
+        for ship in asteroids.ships:
+            ship.shoot_start()
+
+SCENARIOS = [
+    IdleScenario('idle', 2000),
+    MaxRocksScenario('max_rocks', 1000, 500),
+    RapidFireScenario('rapid_fire', 2000),
+    MassExplosionsScenario('mass_explosions', 1000, 10),
+    # asks for 10000 rocks, capped by the entity budget
+    StressScenario('stress_10k', 100, 10000, 150),
+    # ramps up to 5000 live rocks in 5 seconds
+    WaveScenario('waves_5k', 300, [(0, 1000), (5000, 5000)], [(0, 500.0), (5000, 2000.0)]),
+    # rocks stream in past the entity budget while 4 ships split them, measured once capped
+    SplittingScenario('splitting', 100, 120, [(0, 20000)], [(0, STRESS_SPAWN_RATE)], 4)
+]
+if entity_store is not None:
+    # the same field stepped by an EntityStore
+    SCENARIOS.append(StressScenario('stress_10k_store', 100, 10000, 150, True))
+
+def create_game(render):
+    """
+    Creates a started AsteroidsGame on a fresh headless backend
+    """
+    if render:
+        backend = game.HeadlessBackend()
+    else:
+        backend = game.HeadlessBackend(None)
+    game.set_backend(backend)
+    return backend
+
+def run_ticks(scenario, render, seed, measure):
+    """
+    Runs the scenario, returns the latency (in ms) and live entities of each measured tick, and the game
+    """
+    backend = create_game(render)
+    random.seed(seed)
+    asteroids = game.AsteroidsGame(game.WINDOW_SIZE, BENCHMARK_LIVES, scenario.max_rock_count, seed)
+    asteroids.start()
+    asteroids.onclick(asteroids.get_center())
+    scenario.setup(asteroids)
+    latencies = []
+    entities = []
+    for tick in range(scenario.warmup_ticks + scenario.ticks):
+        scenario.tick(asteroids, tick)
+        start_time = time.perf_counter()
+        backend.step()
+        if measure and tick >= scenario.warmup_ticks:
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            entities.append(asteroids.count_entities())
+    return latencies, entities, asteroids
+
+def get_growth(samples):
+    """
+    Returns the mean of the last quarter of the samples over the mean of the first quarter
+    """
+    quarter = max(1, len(samples) // 4)
+    return float(sum(samples[-quarter:])) / max(sum(samples[:quarter]), 1e-9)
+
+def run_scenario(scenario, render = True, seed = 0, memory = True):
+    """
+    Runs the scenario and returns its results
+    """
+    latencies, entities, asteroids = run_ticks(scenario, render, seed, True)
+    histogram = game.Histogram(len(latencies))
+    for latency in latencies:
+        histogram.add(latency)
+    summary = histogram.get_summary()
+    result = {
+        'ticks': len(latencies),
+        'ticks_per_sec': len(latencies) / (sum(latencies) / 1000.0),
+        'p50': summary['p50'],
+        'p95': summary['p95'],
+        'p99': summary['p99'],
+        'max': summary['max'],
+        # tick latency and live entities of the last quarter of the run against the first
+        'growth': get_growth(latencies),
+        'entity_growth': get_growth(entities),
+        'entities': entities[-1]
+    }
+    director_stats = asteroids.director.get_stats()
+    result['dropped'] = director_stats['dropped']
+    result['spawn_rate'] = director_stats['spawn_rate']
+    result['cull_rate'] = director_stats['cull_rate']
+    if render:
+        render_buffer = asteroids.get_render_buffer()
+        result['render_ms'] = render_buffer.replay(game.HeadlessCanvas(), RENDER_REPLAYS)
+        result['draw_commands'] = render_buffer.count()
+        result['draw_batches'] = render_buffer.batches
+    # replays the scenario with allocation tracing (too slow to time)
+    if memory:
+        tracemalloc.start()
+        run_ticks(scenario, render, seed, False)
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def compare(results, baseline, threshold):
+    """
+    Returns the regressions against the baseline (as readable strings)
+    """
+    regressions = []
+    for name in results:
+        if name not in baseline:
+            continue
+        current = results[name]
+        previous = baseline[name]
+        if current['ticks_per_sec'] < previous['ticks_per_sec'] * (1 - threshold):
+            regressions.append('%s: %0.0f ticks/sec (baseline %0.0f)' % (name, current['ticks_per_sec'], previous['ticks_per_sec']))
+        if 'peak_memory' in current and 'peak_memory' in previous:
+            if current['peak_memory'] > previous['peak_memory'] * (1 + threshold):
+                regressions.append('%s: %d bytes peak (baseline %d)' % (name, current['peak_memory'], previous['peak_memory']))
+    return regressions
+
+def format_result(name, result):
+    text = '%-16s %10.0f ticks/sec  p50 %7.3f  p95 %7.3f  p99 %7.3f ms' % (name, result['ticks_per_sec'], result['p50'], result['p95'], result['p99'])
+    if 'growth' in result:
+        text += '  growth x%0.2f for x%0.2f entities (%d)' % (result['growth'], result['entity_growth'], result['entities'])
+    if result.get('dropped', 0) > 0:
+        text += '  dropped %d' % result['dropped']
+    if result.get('spawn_rate', 0) > 0:
+        text += '  spawn %0.1f/s  cull %0.1f/s' % (result['spawn_rate'], result['cull_rate'])
+    if 'render_ms' in result:
+        text += '  render %7.3f ms (%d commands, %d batches)' % (result['render_ms'], result['draw_commands'], result['draw_batches'])
+    if 'peak_memory' in result:
+        text += '  peak %8.1f KiB' % (result['peak_memory'] / 1024.0)
+    return text
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmarks the Asteroids simulation core')
+    parser.add_argument('scenarios', nargs = '*', help = 'scenarios to run (default: all)')
+    parser.add_argument('--baseline', default = BASELINE_FILE, help = 'baseline file')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'store the results as the baseline')
+    parser.add_argument('--threshold', type = float, default = REGRESSION_THRESHOLD, help = 'allowed regression (0.1 = 10%%)')
+    parser.add_argument('--no-render', action = 'store_true', help = 'skip the draw handlers')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the peak memory pass')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+    names = [scenario.name for scenario in SCENARIOS]
+    for name in args.scenarios:
+        if name not in names:
+            parser.error('unknown scenario %s (choose from %s)' % (name, ', '.join(names)))
+    results = {}
+    for scenario in SCENARIOS:
+        if len(args.scenarios) > 0 and scenario.name not in args.scenarios:
+            continue
+        results[scenario.name] = run_scenario(scenario, not args.no_render, args.seed, not args.no_memory)
+        print(format_result(scenario.name, results[scenario.name]))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent = 2, sort_keys = True)
+        print('baseline saved to %s' % args.baseline)
+        return 0
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except IOError:
+        print('no baseline at %s (use --save-baseline)' % args.baseline)
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    if len(regressions) > 0:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,526 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Shards AsteroidsGame sessions across worker processes (one per core).
+
+Each worker runs a server.Scheduler for its sessions. The supervisor talks
+to a worker through two shared-memory rings (input and commands in, state
+deltas, checkpoints and stats out) carrying struct-packed messages, so no
+objects are pickled. Sessions move between workers as snapshots: when a
+worker's tick p99 climbs over the budget, the supervisor migrates a session
+to the least loaded worker. A worker that dies is restarted and its sessions
+are restored from their last checkpoint; other workers are not affected.
+
+Usage:
+    python cluster.py --workers 4 --sessions 400 --seconds 10
+
+"""
+
+# import modules
+import argparse, multiprocessing, struct, sys, time
+from multiprocessing import shared_memory
+import game, server, snapshot
+
+# bytes of each shared-memory ring
+RING_CAPACITY = 4 * 1024 * 1024
+# ticks between session checkpoints sent to the supervisor
+CHECKPOINT_TICKS = 200
+# ticks between worker stats messages
+STATS_TICKS = 40
+# worker tick p99 (in ms) over which sessions are moved away
+P99_BUDGET = 10.0
+# time between rebalancing decisions (in ms)
+REBALANCE_INTERVAL = 1000
+# time (in ms) after which a migration that didn't complete is given up
+MIGRATION_TIMEOUT = 5000
+
+# messages (type, session id) followed by the payload
+MESSAGE_HEADER = struct.Struct('<BI')
+# supervisor -> worker
+CREATE = 1
+IMPORT = 2
+INPUT = 3
+CLOSE = 4
+EXPORT = 5
+STOP = 6
+# worker -> supervisor
+STATE = 10
+CHECKPOINT = 11
+EXPORTED = 12
+STATS = 13
+FAILED = 14
+
+# payloads
+PARAMS_FORMAT = struct.Struct('<IIi')
+INPUT_FORMAT = struct.Struct('<Bhh')
+STATE_FORMAT = struct.Struct('<QiiBdddII')
+STATS_FORMAT = struct.Struct('<IQddd')
+
+INPUT_NAMES = ['keydown', 'keyup', 'click']
+
+class SharedRing:
+    # capacity, head (bytes written), tail (bytes read)
+    HEADER = struct.Struct('<QQQ')
+    LENGTH = struct.Struct('<I')
+    def __init__(self, name = None, capacity = RING_CAPACITY):
+        """
+        Creates (or attaches to, when a name is given) a single producer,
+        single consumer ring of length-prefixed messages in shared memory
+        """
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create = True, size = self.HEADER.size + capacity)
+            self.HEADER.pack_into(self.memory.buf, 0, capacity, 0, 0)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name = name)
+            self.owner = False
+        self.name = self.memory.name
+        self.capacity = self.HEADER.unpack_from(self.memory.buf, 0)[0]
+        self.dropped = 0
+    def get_head(self):
+        return struct.unpack_from('<Q', self.memory.buf, 8)[0]
+    def get_tail(self):
+        return struct.unpack_from('<Q', self.memory.buf, 16)[0]
+    def copy_in(self, position, data):
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        start = self.HEADER.size
+        self.memory.buf[start + offset:start + offset + first] = data[:first]
+        if first < len(data):
+            self.memory.buf[start:start + len(data) - first] = data[first:]
+    def copy_out(self, position, length):
+        offset = position % self.capacity
+        first = min(length, self.capacity - offset)
+        start = self.HEADER.size
+        data = bytes(self.memory.buf[start + offset:start + offset + first])
+        if first < length:
+            data += bytes(self.memory.buf[start:start + length - first])
+        return data
+    def write(self, data):
+        """
+        Appends a message, returns False (and counts a drop) when the ring is full
+        """
+        head = self.get_head()
+        needed = self.LENGTH.size + len(data)
+        if needed > self.capacity - (head - self.get_tail()):
+            self.dropped += 1
+            return False
+        self.copy_in(head, self.LENGTH.pack(len(data)) + data)
+        # publishes the message once it's fully written
+        struct.pack_into('<Q', self.memory.buf, 8, head + needed)
+        return True
+    def read(self):
+        """
+        Returns the next message (None when empty)
+        """
+        tail = self.get_tail()
+        if tail == self.get_head():
+            return None
+        length = self.LENGTH.unpack(self.copy_out(tail, self.LENGTH.size))[0]
+        data = self.copy_out(tail + self.LENGTH.size, length)
+        struct.pack_into('<Q', self.memory.buf, 16, tail + self.LENGTH.size + length)
+        return data
+    def read_all(self):
+        messages = []
+        message = self.read()
+        while message is not None:
+            messages.append(message)
+            message = self.read()
+        return messages
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+def pack_message(type, session_id, payload = b''):
+    return MESSAGE_HEADER.pack(type, session_id) + payload
+
+def unpack_message(data):
+    type, session_id = MESSAGE_HEADER.unpack_from(data, 0)
+    return type, session_id, data[MESSAGE_HEADER.size:]
+
+def pack_params(params):
+    seed, lives, max_rock_count = params
+    return PARAMS_FORMAT.pack(seed, lives, max_rock_count if max_rock_count is not None else -1)
+
+def unpack_params(payload):
+    seed, lives, max_rock_count = PARAMS_FORMAT.unpack_from(payload, 0)
+    return (seed, lives, max_rock_count if max_rock_count >= 0 else None)
+
+def get_state(asteroids):
+    player = asteroids.player
+    position = player.get_position()
+    return STATE_FORMAT.pack(asteroids.get_steps(), asteroids.score.get_score(), asteroids.score.get_lives(), 1 if asteroids.started else 0, position[0], position[1], player.get_rotation(), asteroids.rocks.count(), player.get_missles().count())
+
+class Worker:
+    def __init__(self, inbox, outbox, tick_interval = server.TICK_INTERVAL):
+        """
+        Runs the sessions of one process
+
+        <SharedRing> inbox      Messages from the supervisor
+        <SharedRing> outbox     Messages to the supervisor
+        """
+        self.inbox = inbox
+        self.outbox = outbox
+        self.scheduler = server.Scheduler(tick_interval)
+        # session id (supervisor's) -> Session, and its game parameters
+        self.sessions = {}
+        self.params = {}
+        # last state sent per session (only changes are sent)
+        self.states = {}
+        # sessions whose export didn't fit in the outbox, retried every tick
+        self.exports = set()
+        self.running = True
+    def add_session(self, session_id, params, data = None):
+        seed, lives, max_rock_count = params
+        session = self.scheduler.create_session(seed, lives, max_rock_count, data is None)
+        if data is not None:
+            snapshot.restore(session.asteroids, data)
+        self.sessions[session_id] = session
+        self.params[session_id] = params
+    def remove_session(self, session_id):
+        session = self.sessions.pop(session_id)
+        self.params.pop(session_id)
+        self.states.pop(session_id, None)
+        self.exports.discard(session_id)
+        self.scheduler.close_session(session.id)
+        return session
+    def pack_snapshot(self, session_id):
+        return pack_params(self.params[session_id]) + snapshot.take(self.sessions[session_id].asteroids)
+    def export_session(self, session_id):
+        """
+        Sends the session's snapshot to the supervisor and removes it, keeps
+        it (and retries on the next tick) when the outbox is full
+        """
+        # input queued before the export moves with the session
+        self.sessions[session_id].apply_inputs()
+        if not self.send(EXPORTED, session_id, self.pack_snapshot(session_id)):
+            self.exports.add(session_id)
+            return False
+        self.remove_session(session_id)
+        return True
+    def handle(self, data):
+        type, session_id, payload = unpack_message(data)
+        if type == CREATE:
+            self.add_session(session_id, unpack_params(payload))
+        elif type == IMPORT:
+            self.add_session(session_id, unpack_params(payload), payload[PARAMS_FORMAT.size:])
+        elif type == INPUT and session_id in self.sessions:
+            kind, a, b = INPUT_FORMAT.unpack(payload)
+            if INPUT_NAMES[kind] == 'click':
+                self.sessions[session_id].send('click', (a, b))
+            else:
+                self.sessions[session_id].send(INPUT_NAMES[kind], a)
+        elif type == CLOSE and session_id in self.sessions:
+            self.remove_session(session_id)
+        elif type == EXPORT and session_id in self.sessions:
+            self.export_session(session_id)
+        elif type == STOP:
+            self.running = False
+    def send(self, type, session_id, payload = b''):
+        # the supervisor keeps up with the ring, a full ring drops the message
+        return self.outbox.write(pack_message(type, session_id, payload))
+    def tick(self, elapsed):
+        for session_id in list(self.exports):
+            self.export_session(session_id)
+        start_time = time.perf_counter()
+        for session_id in list(self.sessions.keys()):
+            session = self.sessions[session_id]
+            try:
+                session.tick(elapsed)
+            except Exception:
+                # a broken session doesn't take the others down
+                self.remove_session(session_id)
+                self.send(FAILED, session_id)
+                continue
+            state = get_state(session.asteroids)
+            if self.states.get(session_id) != state:
+                self.states[session_id] = state
+                self.send(STATE, session_id, state)
+        self.scheduler.tick_latency.add((time.perf_counter() - start_time) * 1000)
+        self.scheduler.ticks += 1
+        if self.scheduler.ticks % CHECKPOINT_TICKS == 0:
+            for session_id in self.sessions:
+                self.send(CHECKPOINT, session_id, self.pack_snapshot(session_id))
+        if self.scheduler.ticks % STATS_TICKS == 0:
+            summary = self.scheduler.tick_latency.get_summary()
+            self.send(STATS, 0, STATS_FORMAT.pack(len(self.sessions), self.scheduler.ticks, summary['p50'], summary['p95'], summary['p99']))
+    def run(self):
+        """
+        Ticks the sessions in real time until stopped
+        """
+        interval = self.scheduler.tick_interval
+        last_time = server.get_clock_time()
+        next_time = last_time + interval
+        while self.running:
+            for data in self.inbox.read_all():
+                self.handle(data)
+            delay = next_time - server.get_clock_time()
+            if delay > 0:
+                time.sleep(delay / 1000.0)
+            now = server.get_clock_time()
+            self.tick(now - last_time)
+            last_time = now
+            next_time += interval
+            if next_time < now:
+                next_time = now + interval
+
+def run_worker(inbox_name, outbox_name):
+    """
+    Worker process entry point
+    """
+    inbox = SharedRing(inbox_name)
+    outbox = SharedRing(outbox_name)
+    try:
+        Worker(inbox, outbox).run()
+    finally:
+        inbox.close()
+        outbox.close()
+
+class WorkerHandle:
+    def __init__(self, index):
+        """
+        Starts a worker process with its rings
+        """
+        self.index = index
+        self.inbox = SharedRing()
+        self.outbox = SharedRing()
+        # messages waiting for room in the inbox
+        self.pending = []
+        self.sessions = set()
+        self.p99 = 0
+        self.restarts = 0
+        self.process = None
+        self.start()
+    def start(self):
+        self.process = multiprocessing.Process(target = run_worker, args = (self.inbox.name, self.outbox.name))
+        self.process.daemon = True
+        self.process.start()
+    def restart(self):
+        """
+        Replaces a dead worker with a new process on fresh rings
+        """
+        self.inbox.close()
+        self.outbox.close()
+        self.inbox = SharedRing()
+        self.outbox = SharedRing()
+        self.pending = []
+        self.p99 = 0
+        self.restarts += 1
+        self.start()
+    def send(self, data):
+        self.pending.append(data)
+        self.flush()
+    def flush(self):
+        while len(self.pending) > 0 and self.inbox.write(self.pending[0]):
+            self.pending.pop(0)
+    def is_alive(self):
+        return self.process.is_alive()
+    def stop(self):
+        self.send(pack_message(STOP, 0))
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.inbox.close()
+        self.outbox.close()
+
+class Supervisor:
+    def __init__(self, workers = None, p99_budget = P99_BUDGET):
+        """
+        Starts the worker processes (one per core by default)
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = [WorkerHandle(i) for i in range(workers)]
+        self.p99_budget = p99_budget
+        self.next_id = 1
+        # session id -> worker index, game parameters, last checkpoint and state
+        self.placement = {}
+        self.params = {}
+        self.checkpoints = {}
+        self.states = {}
+        # sessions being moved: session id -> target worker index, input held meanwhile and start time
+        self.migrations = {}
+        self.held = {}
+        self.migration_times = {}
+        self.migrated = 0
+        self.timed_out_migrations = 0
+        self.failed = []
+        self.last_rebalance_time = server.get_clock_time()
+    def create_session(self, seed = None, lives = game.NUM_LIVES, max_rock_count = game.MAX_ROCK_COUNT):
+        """
+        Creates a session on the least loaded worker, returns its id
+        """
+        if seed is None:
+            seed = self.next_id
+        session_id = self.next_id
+        self.next_id += 1
+        worker = min(self.workers, key = lambda w: len(w.sessions))
+        self.params[session_id] = (seed, lives, max_rock_count)
+        self.placement[session_id] = worker.index
+        worker.sessions.add(session_id)
+        worker.send(pack_message(CREATE, session_id, pack_params(self.params[session_id])))
+        return session_id
+    def close_session(self, session_id):
+        worker = self.workers[self.placement.pop(session_id)]
+        worker.sessions.discard(session_id)
+        worker.send(pack_message(CLOSE, session_id))
+        for store in (self.params, self.checkpoints, self.states, self.migrations, self.held, self.migration_times):
+            store.pop(session_id, None)
+    def send_input(self, session_id, name, value):
+        """
+        Forwards a 'keydown'/'keyup' (key) or 'click' (position) input to the session
+        """
+        if name == 'click':
+            payload = INPUT_FORMAT.pack(INPUT_NAMES.index(name), int(value[0]), int(value[1]))
+        else:
+            payload = INPUT_FORMAT.pack(INPUT_NAMES.index(name), value, 0)
+        if session_id in self.migrations:
+            self.held[session_id].append(pack_message(INPUT, session_id, payload))
+            return
+        self.workers[self.placement[session_id]].send(pack_message(INPUT, session_id, payload))
+    def get_state(self, session_id):
+        """
+        Returns the last reported (steps, score, lives, started, x, y, rotation, rocks, missles)
+        """
+        return self.states.get(session_id)
+    def handle(self, worker, data):
+        type, session_id, payload = unpack_message(data)
+        if type == STATE:
+            self.states[session_id] = STATE_FORMAT.unpack(payload)
+        elif type == CHECKPOINT:
+            self.checkpoints[session_id] = payload
+        elif type == STATS:
+            worker.p99 = STATS_FORMAT.unpack(payload)[4]
+        elif type == EXPORTED and session_id in self.placement:
+            # hands the session over to its new worker (back to the same one when the migration timed out)
+            target = self.workers[self.migrations.pop(session_id, worker.index)]
+            self.migration_times.pop(session_id, None)
+            worker.sessions.discard(session_id)
+            target.sessions.add(session_id)
+            self.placement[session_id] = target.index
+            self.checkpoints[session_id] = payload
+            target.send(pack_message(IMPORT, session_id, payload))
+            for message in self.held.pop(session_id, []):
+                target.send(message)
+            if target is not worker:
+                self.migrated += 1
+        elif type == FAILED:
+            worker.sessions.discard(session_id)
+            self.placement.pop(session_id, None)
+            self.failed.append(session_id)
+    def recover(self, worker):
+        """
+        Restarts a dead worker and restores its sessions from their last checkpoint
+        """
+        worker.restart()
+        for session_id in worker.sessions:
+            if session_id in self.checkpoints:
+                worker.send(pack_message(IMPORT, session_id, self.checkpoints[session_id]))
+            else:
+                worker.send(pack_message(CREATE, session_id, pack_params(self.params[session_id])))
+            if session_id in self.migrations:
+                self.migrations.pop(session_id)
+                self.migration_times.pop(session_id)
+                for message in self.held.pop(session_id):
+                    worker.send(message)
+    def expire_migrations(self, now):
+        """
+        Gives up the migrations older than MIGRATION_TIMEOUT: the session stays
+        on its worker, and its held input is forwarded there
+        """
+        for session_id in list(self.migrations.keys()):
+            if now - self.migration_times[session_id] < MIGRATION_TIMEOUT:
+                continue
+            self.migrations.pop(session_id)
+            self.migration_times.pop(session_id)
+            worker = self.workers[self.placement[session_id]]
+            for message in self.held.pop(session_id):
+                worker.send(message)
+            self.timed_out_migrations += 1
+    def rebalance(self):
+        """
+        Moves one session from the slowest worker (over the p99 budget) to the fastest
+        """
+        if len(self.migrations) > 0 or len(self.workers) < 2:
+            return
+        slowest = max(self.workers, key = lambda w: w.p99)
+        fastest = min(self.workers, key = lambda w: (w.p99, len(w.sessions)))
+        if slowest.p99 <= self.p99_budget or slowest is fastest or len(slowest.sessions) < 2:
+            return
+        session_id = next(iter(slowest.sessions))
+        self.migrations[session_id] = fastest.index
+        self.held[session_id] = []
+        self.migration_times[session_id] = server.get_clock_time()
+        slowest.send(pack_message(EXPORT, session_id))
+    def poll(self):
+        """
+        Drains the worker rings, recovers dead workers and rebalances when due
+        """
+        for worker in self.workers:
+            if not worker.is_alive():
+                self.recover(worker)
+                continue
+            worker.flush()
+            for data in worker.outbox.read_all():
+                self.handle(worker, data)
+        now = server.get_clock_time()
+        if now - self.last_rebalance_time >= REBALANCE_INTERVAL:
+            self.last_rebalance_time = now
+            self.expire_migrations(now)
+            self.rebalance()
+    def run(self, duration, interval = 5):
+        """
+        Polls the workers for the given duration (in ms)
+        """
+        end_time = server.get_clock_time() + duration
+        while server.get_clock_time() < end_time:
+            self.poll()
+            time.sleep(interval / 1000.0)
+    def get_stats(self):
+        workers = []
+        for worker in self.workers:
+            workers.append({
+                'sessions': len(worker.sessions),
+                'p99': worker.p99,
+                'restarts': worker.restarts,
+                'dropped': worker.outbox.dropped
+            })
+        return {
+            'workers': workers,
+            'migrated': self.migrated,
+            'timed_out_migrations': self.timed_out_migrations,
+            'failed': len(self.failed)
+        }
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Shards Asteroids sessions across worker processes')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--sessions', type = int, default = 100)
+    parser.add_argument('--seconds', type = float, default = 10)
+    args = parser.parse_args(argv)
+    supervisor = Supervisor(args.workers)
+    try:
+        key_map = game.KEY_MAP
+        for i in range(args.sessions):
+            session_id = supervisor.create_session()
+            supervisor.send_input(session_id, 'keydown', key_map['left'])
+            supervisor.send_input(session_id, 'keydown', key_map['space'])
+        supervisor.run(args.seconds * 1000)
+        stats = supervisor.get_stats()
+        for i in range(len(stats['workers'])):
+            worker = stats['workers'][i]
+            print('worker %d: %d sessions, p99 %0.3f ms, %d restarts' % (i, worker['sessions'], worker['p99'], worker['restarts']))
+        print('%d sessions migrated (%d timed out), %d failed' % (stats['migrated'], stats['timed_out_migrations'], stats['failed']))
+    finally:
+        supervisor.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Array-backed entity store (opt-in, requires NumPy).
+
+Keeps the sprite state in contiguous columns and steps every entity in a
+single NumPy pass, using the same rotate -> wrap -> thrust -> friction
+pipeline as Sprite.update. SpriteView exposes a slot with the Sprite API
+so the existing draw and collision code can use it unchanged.
+
+This module runs on the host only (CodeSkulptor has no NumPy).
+
+"""
+
+# import modules
+import numpy
+import game
+
+class EntityStore:
+    def __init__(self, capacity = 1024):
+        """
+        Creates a new entity store
+
+        <int> capacity      The initial number of slots (grows as needed)
+        """
+        self.capacity = 0
+        # number of slots ever used (everything past it is untouched)
+        self.high_water = 0
+        # released slots, reused before growing
+        self.free = []
+        self.views = {}
+        self.allocate(capacity)
+    def allocate(self, capacity):
+        """
+        Grows every column to the given capacity, keeping the existing values
+        """
+        columns = {
+            'position': (2, numpy.float64),
+            'previous_position': (2, numpy.float64),
+            'velocity': (2, numpy.float64),
+            'rotation': (None, numpy.float64),
+            'previous_rotation': (None, numpy.float64),
+            'rotation_velocity': (None, numpy.float64),
+            'acceleration': (None, numpy.float64),
+            'friction': (None, numpy.float64),
+            'accelerating': (None, numpy.float64),
+            'radius': (None, numpy.float64),
+            'age': (None, numpy.int64),
+            'lifetime': (None, numpy.int64),
+            'alive': (None, numpy.bool_)
+        }
+        for name in columns:
+            width, dtype = columns[name]
+            shape = (capacity, width) if width is not None else (capacity,)
+            column = numpy.zeros(shape, dtype)
+            if self.capacity > 0:
+                column[:self.capacity] = getattr(self, name)
+            setattr(self, name, column)
+        self.capacity = capacity
+    def add(self, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = 0, radius = 0, acceleration = 0.1, friction = 0.02):
+        """
+        Adds a new entity and returns its slot index
+        """
+        if len(self.free) > 0:
+            index = self.free.pop()
+        else:
+            if self.high_water >= self.capacity:
+                self.allocate(self.capacity * 2)
+            index = self.high_water
+            self.high_water += 1
+        self.position[index] = position
+        self.previous_position[index] = position
+        self.velocity[index] = velocity
+        self.rotation[index] = rotation
+        self.previous_rotation[index] = rotation
+        self.rotation_velocity[index] = rotation_velocity
+        self.acceleration[index] = acceleration
+        self.friction[index] = friction
+        self.accelerating[index] = 0
+        self.radius[index] = radius
+        self.age[index] = 0
+        self.lifetime[index] = lifetime
+        self.alive[index] = True
+        return index
+    def add_sprite(self, sprite, view_class = None):
+        """
+        Copies a Sprite's state into a new slot and returns a view of it
+        (a SpriteView, or the given SpriteView subclass)
+        """
+        index = self.add(sprite.get_position(), sprite.get_velocity(), sprite.get_rotation(), sprite.get_rotation_velocity(), sprite.lifetime, sprite.get_radius(), sprite.get_acceleration(), sprite.get_friction())
+        self.accelerating[index] = 1 if sprite.is_accelerating() else 0
+        self.age[index] = sprite.age
+        return self.get_view(index, sprite.get_size(), sprite.definition, sprite.animated, sprite.clip, view_class)
+    def remove(self, index):
+        """
+        Releases the slot for reuse
+        """
+        if self.alive[index]:
+            self.alive[index] = False
+            # parks the slot so the batched update leaves it in place
+            self.velocity[index] = 0
+            self.rotation_velocity[index] = 0
+            self.accelerating[index] = 0
+            self.free.append(index)
+            self.views.pop(index, None)
+    def release(self, view):
+        """
+        Releases the slot of a view, so the store can be the pool of a Group
+        """
+        self.remove(view.index)
+    def count(self):
+        return self.high_water - len(self.free)
+    def get_view(self, index, size, definition = None, animated = False, clip = None, view_class = None):
+        """
+        Returns the SpriteView of the slot (one view per slot)
+        """
+        if view_class is None:
+            view_class = SpriteView
+        if index not in self.views:
+            self.views[index] = view_class(self, index, size, definition, animated, clip)
+        return self.views[index]
+    def get_expired(self):
+        """
+        Returns the indices of live entities that outlived their lifetime
+        """
+        count = self.high_water
+        expired = self.alive[:count] & (self.lifetime[:count] > 0) & (self.age[:count] > self.lifetime[:count])
+        return numpy.nonzero(expired)[0]
+    def update(self, update_event):
+        """
+        Steps every entity once (same pipeline as Sprite.update)
+        """
+        count = self.high_water
+        if count == 0:
+            return
+        position = self.position[:count]
+        velocity = self.velocity[:count]
+        rotation = self.rotation[:count]
+        # increment age
+        self.age[:count] += 1
+        # keeps the previous state for interpolation
+        self.previous_position[:count] = position
+        self.previous_rotation[:count] = rotation
+        # applies the rotation velocity to the rotation
+        rotation += self.rotation_velocity[:count]
+        # applies the current velocity vector, wrapping around the screen
+        position += velocity
+        numpy.mod(position, numpy.asarray(update_event.size, numpy.float64), out = position)
+        # applies the forward vector, and acceleration to the accelerating entities
+        thrust = self.acceleration[:count] * self.accelerating[:count]
+        velocity[:, 0] += numpy.cos(rotation) * thrust
+        velocity[:, 1] += numpy.sin(rotation) * thrust
+        # applies the friction constant
+        velocity *= (1 - self.friction[:count])[:, numpy.newaxis]
+
+def column_property(name):
+    """
+    Maps a Sprite attribute to the view's slot in a store column
+    """
+    def get(self):
+        value = getattr(self.store, name)[self.index]
+        if value.shape:
+            return (float(value[0]), float(value[1]))
+        return value.item()
+    def set(self, value):
+        getattr(self.store, name)[self.index] = value
+    return property(get, set)
+
+class SpriteView(game.Sprite, object):
+    position = column_property('position')
+    previous_position = column_property('previous_position')
+    velocity = column_property('velocity')
+    rotation = column_property('rotation')
+    previous_rotation = column_property('previous_rotation')
+    rotation_velocity = column_property('rotation_velocity')
+    acceleration = column_property('acceleration')
+    friction = column_property('friction')
+    age = column_property('age')
+    lifetime = column_property('lifetime')
+    def __init__(self, store, index, size, definition = None, animated = False, clip = None):
+        """
+        Creates a Sprite-compatible view over a store slot. The view only
+        holds the rendering state, everything else lives in the store.
+        """
+        self.store = store
+        self.index = index
+        self.size = size
+        self.center = (size[0] / 2, size[1] / 2)
+        self.initial_position = self.position
+        self.rotation_dir = None
+        self.definition = definition
+        self.animated = animated
+        self.clip = clip
+    @property
+    def accelerating(self):
+        return bool(self.store.accelerating[self.index])
+    @accelerating.setter
+    def accelerating(self, accelerating):
+        self.store.accelerating[self.index] = 1 if accelerating else 0
+    def get_radius(self):
+        return float(self.store.radius[self.index])
+    def is_alive(self):
+        return bool(self.store.alive[self.index])
+    def remove(self):
+        self.store.remove(self.index)
+
+class RockView(SpriteView, game.Rock):
+    def __init__(self, store, index, size, definition = None, animated = False, clip = None):
+        """
+        A store-backed rock: the Rock API (levels, fragments) over a store slot
+        """
+        SpriteView.__init__(self, store, index, size, definition, animated, clip)
+        self.set_size(size)
+
+def attach_rocks(asteroids, store):
+    """
+    Moves the rocks of an AsteroidsGame into the store: new rocks and
+    fragments are created in it, removed ones release their slot, and the
+    whole field is stepped in one batched update
+    """
+    rocks = list(asteroids.rocks.get_all())
+    asteroids.rocks.clear()
+    asteroids.rocks.pool = store
+    for rock in rocks:
+        asteroids.rocks.add(store.add_sprite(rock, RockView))
+    asteroids.rock_factory = lambda *args: store.add_sprite(game.Rock(*args), RockView)
+    asteroids.rock_stepper = store
@@ -3,31 +3,622 @@ Project: Asteroids
 Author: Vu Tran
 Website: http://vu-tran.com/
 
+Backends:
+ - SimpleGUIBackend (CodeSkulptor / SimpleGUICS2Pygame)
+ - HeadlessBackend (no window, manual clock, stub assets)
+
 Events:
  - draw (DrawEvent)
  - click (ClickEvent)
  - keydown (KeyEvent)
  - keyup (KeyEvent)
  - count (TimerEvent)
+ - update (UpdateEvent)
 
 """
 
 # import modules
-import simplegui, math, random
+import math, random
+
+# loads a high resolution clock for instrumentation
+try:
+    from time import perf_counter as perf_clock
+except ImportError:
+    from time import time as perf_clock
+
+# loads the allocated memory block counter (CPython only)
+try:
+    from sys import getallocatedblocks as get_allocated_blocks
+except ImportError:
+    get_allocated_blocks = None
+
+# loads SimpleGUI when available, otherwise falls back to the headless backend
+try:
+    import simplegui
+except ImportError:
+    simplegui = None
 
 # configurations
 WINDOW_SIZE = (800, 600)
 NUM_LIVES = 3
 MAX_ROCK_COUNT = 6
+# fixed simulation steps per second (sprite speeds are tuned per 60fps frame)
+STEP_RATE = 60
+# maximum simulation steps to catch up on within a single tick
+MAX_CATCH_UP_STEPS = 5
+# size of the collision grid cells (about a rock's diameter)
+COLLISION_CELL_SIZE = 100
+# number of samples kept by each profiler histogram
+PROFILER_WINDOW = 300
+# number of released missles/explosions kept for reuse
+MISSLE_POOL_SIZE = 64
+EXPLOSION_POOL_SIZE = 32
+# draw layers, submitted bottom to top (commands of a layer are grouped by texture)
+LAYER_SPACE = 0
+LAYER_DEBRIS = 1
+LAYER_SPRITES = 2
+LAYER_HUD = 3
+LAYER_SPLASH = 4
+# number of measured text widths memoized
+TEXT_WIDTH_CACHE_SIZE = 256
+
+# memory budget of the asset cache (in bytes, decoded images are 4 bytes per pixel)
+ASSET_CACHE_BUDGET = 64 * 1024 * 1024
+# size counted for a sound (SimpleGUI doesn't expose it)
+SOUND_SIZE_ESTIMATE = 512 * 1024
+
+# asset urls
+SPLASH_IMAGE = 'https://www.dropbox.com/s/6qfewgjyf8k3gag/splash.png?dl=1'
+SOUNDTRACK_SOUND = 'https://www.dropbox.com/s/7jjgyyz16gubjl4/soundtrack.mp3?dl=1'
+NEBULA_IMAGE = 'https://www.dropbox.com/s/gkz1ng5b5f911tk/nebula_blue.f2014.png?dl=1'
+DEBRIS_IMAGE = 'https://www.dropbox.com/s/xcygcu51maw8bam/debris2_blue.png?dl=1'
+ROCK_IMAGE = 'https://www.dropbox.com/s/ackzcnknlaz56f0/asteroid_blue.png?dl=1'
+MISSLE_IMAGE = 'https://www.dropbox.com/s/9fbouyq1q1j2gcj/shot2.png?dl=1'
+MISSLE_SOUND = 'https://www.dropbox.com/s/h0s1tbm70nd8gc1/missile.mp3?dl=1'
+EXPLOSION_IMAGE = 'https://www.dropbox.com/s/v3m6oa9u31pbujb/explosion_alpha.png?dl=1'
+EXPLOSION_SOUND = 'https://www.dropbox.com/s/um0ef23cormfr0w/explosion.mp3?dl=1'
+SPACESHIP_IMAGE = 'https://www.dropbox.com/s/y2oopsybnllxl3c/double_ship.png?dl=1'
+THRUST_SOUND = 'https://www.dropbox.com/s/mmk6t1kzsbz4pju/thrust.mp3?dl=1'
+
+# every asset used by the game: (kind, url, image size), loaded up front during the splash screen
+ASSET_MANIFEST = [
+    ('image', SPLASH_IMAGE, (400, 300)),
+    ('sound', SOUNDTRACK_SOUND, None),
+    ('image', NEBULA_IMAGE, (800, 600)),
+    ('image', DEBRIS_IMAGE, (640, 480)),
+    ('image', ROCK_IMAGE, (90, 90)),
+    ('image', MISSLE_IMAGE, (10, 10)),
+    ('sound', MISSLE_SOUND, None),
+    ('image', EXPLOSION_IMAGE, (128 * 24, 128)),
+    ('sound', EXPLOSION_SOUND, None),
+    ('image', SPACESHIP_IMAGE, (180, 90)),
+    ('sound', THRUST_SOUND, None)
+]
+
+# sprite types: image, frame size, frame count (laid out left to right), sound
+SPRITE_TYPES = {
+    'rock': (ROCK_IMAGE, (90, 90), 1, None),
+    'missle': (MISSLE_IMAGE, (10, 10), 1, MISSLE_SOUND),
+    'explosion': (EXPLOSION_IMAGE, (128, 128), 24, EXPLOSION_SOUND),
+    # resting and thrusting frames
+    'spaceship': (SPACESHIP_IMAGE, (90, 90), 2, THRUST_SOUND)
+}
+
+# animation loop modes: hold the last frame, start over, or play back and forth
+ANIMATION_ONCE = 'once'
+ANIMATION_LOOP = 'loop'
+ANIMATION_PING_PONG = 'ping_pong'
+# animation clips: sprite type, first frame, frame count, frame duration (ms), loop mode
+ANIMATION_CLIPS = {
+    'explosion': ('explosion', 0, 24, 1000.0 / STEP_RATE, ANIMATION_ONCE)
+}
+# scrolling speed of the debris (in px per ms of simulation time)
+DEBRIS_SPEED = 1 / 50.0
+
+# rock sizes, largest first: size, collision radius, fragments a shot rock splits into
+ROCK_TYPES = [
+    ((90, 90), 45, 2),
+    ((60, 60), 30, 2),
+    ((30, 30), 15, 0)
+]
+# speed (px per step) a fragment moves away from the others, on top of the velocity it inherits
+FRAGMENT_SPEED = 1.0
+# maximum rocks, missles and explosions alive together, spawns past it are dropped (None for no limit)
+ENTITY_BUDGET = 8192
+# rock spawning: rocks spawned per second over the time played (in ms), as
+# (time, value) points interpolated linearly and held after the last one
+SPAWN_RATE_CURVE = [(0, 1.0)]
+# radius around every spaceship kept clear of new rocks
+SAFE_ZONE_RADIUS = 150
+# random positions tried for a rock before its spawn is put off to the next step
+SPAWN_ATTEMPTS = 8
+# maximum rocks spawned in a single step
+MAX_SPAWNS_PER_STEP = 100
+# period (in ms) over which the spawn and cull rates are measured
+SPAWN_RATE_WINDOW = 5000
+
+# time budget of a frame (in ms): the draw and the timer ticks since the previous one
+FRAME_BUDGET = 1000.0 / 60
+# weight of the latest frame in the smoothed frame cost
+QUALITY_SMOOTHING = 0.1
+# frames the smoothed cost stays over budget before the quality is lowered
+QUALITY_DEGRADE_FRAMES = 15
+# frames the smoothed cost stays under RESTORE_RATIO of the budget before it's raised
+QUALITY_RESTORE_FRAMES = 120
+QUALITY_RESTORE_RATIO = 0.5
+# quality tiers, from full quality down: draw the debris, maximum explosions
+# drawn (None for all), frames between HUD refreshes. Tiers only change the
+# rendering, the simulation (and so replays) doesn't depend on frame costs.
+QUALITY_TIERS = [
+    {'debris': True, 'max_explosions': None, 'hud_interval': 1},
+    {'debris': False, 'max_explosions': 16, 'hud_interval': 2},
+    {'debris': False, 'max_explosions': 8, 'hud_interval': 6},
+    {'debris': False, 'max_explosions': 4, 'hud_interval': 15}
+]
+
+# key codes used by SimpleGUI
+KEY_MAP = {
+    'space': 32,
+    'left': 37,
+    'up': 38,
+    'right': 39,
+    'down': 40
+}
+
+# define Backend objects
+class SimpleGUIBackend:
+    def __init__(self, asset_dir = None):
+        """
+        <str> asset_dir     A local directory of downloaded assets used instead
+                            of the urls (offline play, not on CodeSkulptor)
+        """
+        # loads the time module for the wall clock
+        import time
+        self.clock = time
+        self.asset_dir = asset_dir
+    def create_frame(self, title, width, height):
+        return simplegui.create_frame(title, width, height)
+    def create_timer(self, delay, handler):
+        return simplegui.create_timer(delay, handler)
+    def load_image(self, url):
+        return simplegui.load_image(get_asset_source(self.asset_dir, url))
+    def load_sound(self, url):
+        return simplegui.load_sound(get_asset_source(self.asset_dir, url))
+    def is_loaded(self, asset):
+        """
+        Returns True once the asset finished loading (images have no size until then)
+        """
+        if hasattr(asset, 'get_width'):
+            return asset.get_width() > 0
+        return True
+    def get_key_map(self):
+        return simplegui.KEY_MAP
+    def get_time(self):
+        """
+        Returns the wall clock time (in ms)
+        """
+        return self.clock.time() * 1000
+
+class HeadlessCanvas:
+    def __init__(self):
+        """
+        Creates a canvas that records draw calls instead of rendering them
+        """
+        self.calls = []
+    def clear(self):
+        self.calls = []
+    def get_calls(self):
+        return self.calls
+    def draw_image(self, image, center_source, width_height_source, center_dest, width_height_dest, rotation = 0):
+        self.calls.append(('draw_image', image, center_source, width_height_source, center_dest, width_height_dest, rotation))
+    def draw_text(self, text, point, font_size, font_color, font_face = 'serif'):
+        self.calls.append(('draw_text', text, point, font_size, font_color, font_face))
+    def draw_line(self, point1, point2, line_width, line_color):
+        self.calls.append(('draw_line', point1, point2, line_width, line_color))
+    def draw_polyline(self, point_list, line_width, line_color):
+        self.calls.append(('draw_polyline', point_list, line_width, line_color))
+    def draw_polygon(self, point_list, line_width, line_color, fill_color = None):
+        self.calls.append(('draw_polygon', point_list, line_width, line_color, fill_color))
+    def draw_circle(self, center_point, radius, line_width, line_color, fill_color = None):
+        self.calls.append(('draw_circle', center_point, radius, line_width, line_color, fill_color))
+    def draw_point(self, point, color):
+        self.calls.append(('draw_point', point, color))
+
+class CommandBuffer:
+    def __init__(self, size):
+        """
+        Collects the draw calls of a frame instead of rendering them (it has
+        the canvas API). Commands are tagged with the current layer, images
+        entirely off-screen are culled, and submit() renders the rest sorted
+        by layer then texture, one batch per texture. The last frame is kept,
+        so replay() can render it again, e.g. into a HeadlessCanvas to
+        measure the render cost of a frame.
+
+        <tuple> size        The size of the screen (used for culling)
+        """
+        self.size = size
+        self.layer = LAYER_HUD
+        # (layer, texture rank, order, method name, args)
+        self.commands = []
+        # texture ranks, in order of first use within the frame
+        self.textures = {}
+        self.sorted = True
+        # stats of the last frame
+        self.culled = 0
+        self.batches = 0
+    def begin(self):
+        """
+        Starts a new frame (drops the previous frame's commands)
+        """
+        self.layer = LAYER_HUD
+        self.commands = []
+        self.textures = {}
+        self.sorted = True
+        self.culled = 0
+        self.batches = 0
+    def set_layer(self, layer):
+        """
+        Sets the layer of the following commands (drawables set it before drawing)
+        """
+        self.layer = layer
+    def get_layer(self):
+        return self.layer
+    def add(self, name, texture, args):
+        """
+        Queues a draw call, texture is the image (or anything that groups commands of the same call)
+        """
+        rank = self.textures.get(texture)
+        if rank is None:
+            rank = len(self.textures)
+            self.textures[texture] = rank
+        commands = self.commands
+        layer = self.layer
+        # commands mostly arrive in order, the sort is skipped then
+        if self.sorted and len(commands) > 0:
+            last = commands[-1]
+            if last[0] > layer or (last[0] == layer and last[1] > rank):
+                self.sorted = False
+        commands.append((layer, rank, len(commands), name, args))
+    def is_visible(self, center, size, rotation):
+        """
+        Returns whether a destination rectangle overlaps the screen
+        """
+        # a rotated rectangle stays within half the sum of its sides
+        if rotation == 0:
+            half_width = size[0] / 2.0
+            half_height = size[1] / 2.0
+        else:
+            half_width = (size[0] + size[1]) / 2.0
+            half_height = half_width
+        x = center[0]
+        y = center[1]
+        return x + half_width > 0 and x - half_width < self.size[0] and y + half_height > 0 and y - half_height < self.size[1]
+    def draw_image(self, image, center_source, width_height_source, center_dest, width_height_dest, rotation = 0):
+        if not self.is_visible(center_dest, width_height_dest, rotation):
+            self.culled += 1
+            return
+        self.add('draw_image', image, (image, center_source, width_height_source, center_dest, width_height_dest, rotation))
+    def draw_text(self, text, point, font_size, font_color, font_face = 'serif'):
+        self.add('draw_text', 'draw_text:' + font_face, (text, point, font_size, font_color, font_face))
+    def draw_line(self, point1, point2, line_width, line_color):
+        self.add('draw_line', 'draw_line', (point1, point2, line_width, line_color))
+    def draw_polyline(self, point_list, line_width, line_color):
+        self.add('draw_polyline', 'draw_polyline', (point_list, line_width, line_color))
+    def draw_polygon(self, point_list, line_width, line_color, fill_color = None):
+        self.add('draw_polygon', 'draw_polygon', (point_list, line_width, line_color, fill_color))
+    def draw_circle(self, center_point, radius, line_width, line_color, fill_color = None):
+        self.add('draw_circle', 'draw_circle', (center_point, radius, line_width, line_color, fill_color))
+    def draw_point(self, point, color):
+        self.add('draw_point', 'draw_point', (point, color))
+    def count(self):
+        return len(self.commands)
+    def get_commands(self):
+        """
+        Returns the commands of the frame, in submission order
+        """
+        if not self.sorted:
+            # the order breaks ties, so the arguments are never compared
+            self.commands.sort()
+            self.sorted = True
+        return self.commands
+    def submit(self, canvas):
+        """
+        Renders the frame's commands into the canvas, returns the number of batches
+        """
+        batches = 0
+        batch_layer = None
+        batch_rank = None
+        draw = None
+        for command in self.get_commands():
+            # looks the draw call up once per batch
+            if command[0] != batch_layer or command[1] != batch_rank:
+                batch_layer = command[0]
+                batch_rank = command[1]
+                draw = getattr(canvas, command[3])
+                batches += 1
+            draw(*command[4])
+        self.batches = batches
+        return batches
+    def replay(self, canvas, count = 1):
+        """
+        Renders the last frame into the canvas count times, returns the
+        average time (in ms) of a submission
+        """
+        start_time = perf_clock()
+        for i in range(count):
+            self.submit(canvas)
+        return (perf_clock() - start_time) * 1000 / count
+    def get_stats(self):
+        return {
+            'commands': len(self.commands),
+            'culled': self.culled,
+            'batches': self.batches,
+            'textures': len(self.textures)
+        }
+
+class HeadlessFrame:
+    def __init__(self, title, width, height):
+        """
+        Creates a frame with no window. Input is injected through
+        click(), keydown() and keyup(), and draw() renders into a HeadlessCanvas
+        """
+        self.title = title
+        self.width = width
+        self.height = height
+        self.canvas = HeadlessCanvas()
+        self.buttons = []
+        self.running = False
+        self.draw_count = 0
+        self.draw_handler = None
+        self.mouseclick_handler = None
+        self.keydown_handler = None
+        self.keyup_handler = None
+    def start(self):
+        self.running = True
+    def stop(self):
+        self.running = False
+    def add_button(self, label, handler, width = None):
+        self.buttons.append((label, handler))
+    def set_draw_handler(self, handler):
+        self.draw_handler = handler
+    def set_mouseclick_handler(self, handler):
+        self.mouseclick_handler = handler
+    def set_keydown_handler(self, handler):
+        self.keydown_handler = handler
+    def set_keyup_handler(self, handler):
+        self.keyup_handler = handler
+    def get_canvas_textwidth(self, text, size, face = 'serif'):
+        """
+        Approximates the text width (half the font size per character)
+        """
+        return len(text) * size / 2
+    def draw(self):
+        """
+        Renders a single frame into the recording canvas
+        """
+        self.canvas.clear()
+        self.draw_count += 1
+        if self.draw_handler is not None:
+            self.draw_handler(self.canvas)
+    def click(self, position):
+        if self.mouseclick_handler is not None:
+            self.mouseclick_handler(position)
+    def keydown(self, key):
+        if self.keydown_handler is not None:
+            self.keydown_handler(key)
+    def keyup(self, key):
+        if self.keyup_handler is not None:
+            self.keyup_handler(key)
+
+class HeadlessTimer:
+    def __init__(self, delay, handler):
+        self.delay = delay
+        self.handler = handler
+        self.running = False
+        # time (ms) of the next callback on the manual clock
+        self.next_time = None
+    def start(self):
+        self.running = True
+    def stop(self):
+        self.running = False
+        self.next_time = None
+    def is_running(self):
+        return self.running
+
+class HeadlessImage:
+    def __init__(self, url):
+        # the url or the local file
+        self.url = url
+    def get_width(self):
+        return 0
+    def get_height(self):
+        return 0
+
+class HeadlessSound:
+    def __init__(self, url):
+        self.url = url
+        self.playing = False
+    def play(self):
+        self.playing = True
+    def pause(self):
+        self.playing = False
+    def rewind(self):
+        self.playing = False
+    def set_volume(self, volume):
+        pass
+
+class HeadlessBackend:
+    def __init__(self, draw_interval = 1000.0 / 60, asset_dir = None):
+        """
+        Creates a backend with no window, no real clock and stub assets.
+        Time only moves when advance() or step() is called, so the simulation
+        runs as fast as the CPU allows.
+
+        <float> draw_interval       Time between rendered frames (in ms), None disables rendering
+        <str> asset_dir             A local directory of downloaded assets used instead of the urls
+        """
+        self.asset_dir = asset_dir
+        self.time = 0
+        self.draw_interval = draw_interval
+        self.next_draw_time = 0
+        self.frames = []
+        self.timers = []
+    def create_frame(self, title, width, height):
+        frame = HeadlessFrame(title, width, height)
+        self.frames.append(frame)
+        return frame
+    def create_timer(self, delay, handler):
+        timer = HeadlessTimer(delay, handler)
+        self.timers.append(timer)
+        return timer
+    def load_image(self, url):
+        return HeadlessImage(get_asset_source(self.asset_dir, url))
+    def load_sound(self, url):
+        return HeadlessSound(get_asset_source(self.asset_dir, url))
+    def is_loaded(self, asset):
+        return True
+    def get_key_map(self):
+        return KEY_MAP
+    def get_time(self):
+        """
+        Returns the manual clock time (in ms)
+        """
+        return self.time
+    def get_frames(self):
+        return self.frames
+    def release(self, object):
+        """
+        Forgets a frame or timer that is no longer used
+        """
+        if object in self.frames:
+            self.frames.remove(object)
+        if object in self.timers:
+            self.timers.remove(object)
+    def advance(self, duration):
+        """
+        Moves the manual clock forward, firing every timer callback
+        and draw handler that falls due within the given duration (in ms)
+        """
+        end_time = self.time + duration
+        while True:
+            # finds the earliest pending timer callback
+            next_timer = None
+            for timer in self.timers:
+                if timer.is_running():
+                    if timer.next_time is None:
+                        timer.next_time = self.time + timer.delay
+                    if next_timer is None or timer.next_time < next_timer.next_time:
+                        next_timer = timer
+            # timers fire before a draw scheduled at the same time
+            if next_timer is not None and next_timer.next_time <= end_time and (self.draw_interval is None or next_timer.next_time <= self.next_draw_time):
+                self.time = next_timer.next_time
+                next_timer.next_time += next_timer.delay
+                next_timer.handler()
+            elif self.draw_interval is not None and self.next_draw_time <= end_time:
+                self.time = self.next_draw_time
+                self.next_draw_time += self.draw_interval
+                for frame in self.frames:
+                    if frame.running:
+                        frame.draw()
+            else:
+                break
+        self.time = end_time
+    def step(self, count = 1):
+        """
+        Advances the manual clock by the shortest running timer delay, count times
+        """
+        delays = [timer.delay for timer in self.timers if timer.is_running()]
+        if len(delays) > 0:
+            for i in range(count):
+                self.advance(min(delays))
+
+# creates the backend (headless when SimpleGUI is unavailable)
+if simplegui is not None:
+    backend = SimpleGUIBackend()
+else:
+    backend = HeadlessBackend()
+
+def set_backend(new_backend):
+    """
+    Replaces the backend used to create frames, timers, and load assets
+    """
+    global backend
+    backend = new_backend
+
+def get_backend():
+    return backend
+
+def get_asset_filename(url):
+    """
+    Returns the file name of an asset url (without the query string)
+    """
+    return url.split('?')[0].split('/')[-1]
+
+def get_asset_source(asset_dir, url):
+    """
+    Returns the local file of the url when it's in the asset directory, otherwise the url
+    """
+    if asset_dir is None:
+        return url
+    import os
+    path = os.path.join(asset_dir, get_asset_filename(url))
+    if os.path.exists(path):
+        return path
+    return url
+
+def create_random(seed):
+    """
+    Creates a random generator seeded with the given seed
+    """
+    # CodeSkulptor's random module has no Random class, it reseeds the module instead
+    if hasattr(random, 'Random'):
+        return random.Random(seed)
+    random.seed(seed)
+    return random
 
-# create cache stores for static assets
-CACHE_STORE = {}
+def wrap_delta(delta, length):
+    """
+    Returns the shortest signed distance along a wrapping axis
+    """
+    if delta > length / 2.0:
+        return delta - length
+    if delta < -length / 2.0:
+        return delta + length
+    return delta
+
+def get_rock_level(size):
+    """
+    Returns the index in ROCK_TYPES of a rock size (None if it isn't listed)
+    """
+    for level in range(len(ROCK_TYPES)):
+        if ROCK_TYPES[level][0] == size:
+            return level
+    return None
+
+def sample_curve(points, time):
+    """
+    Returns the value of a curve of (time, value) points at the given time,
+    interpolated linearly between points and held before the first and after the last
+    """
+    if time <= points[0][0]:
+        return points[0][1]
+    for i in range(1, len(points)):
+        if time < points[i][0]:
+            start_time, start_value = points[i - 1]
+            end_time, end_value = points[i]
+            return start_value + (end_value - start_value) * (time - start_time) / float(end_time - start_time)
+    return points[-1][1]
 
 # define Event objects
 class DrawEvent:
-    def __init__(self, canvas, frame):
+    def __init__(self, canvas, frame, alpha = 1.0, time = 0, step_size = 1000.0 / STEP_RATE):
         self.canvas = canvas
         self.frame = frame
+        # interpolation factor between the previous and current simulation step
+        self.alpha = alpha
+        # simulation time shown by the frame (in ms), the clock of every animation
+        self.time = time
+        self.step_size = step_size
 
 class KeyEvent:
     def __init__(self, key):
@@ -41,32 +632,119 @@ class TimerEvent:
     def __init__(self, time):
         self.time = time
 
+class UpdateEvent:
+    def __init__(self, step, time, delta, size):
+        self.step = step
+        self.time = time
+        self.delta = delta
+        self.size = size
+
 class GameEvent:
     def __init__(self, score):
         self.score = score
 
+class QualityEvent:
+    def __init__(self, tier, settings):
+        self.tier = tier
+        self.settings = settings
+
 class Dispatcher:
     def __init__(self):
-        self.events = []
-    def add(self, event_name, handler):
+        # registered handlers by event name: [(priority, order, handler)]
+        self.events = {}
+        # handlers by event name, in call order (rebuilt on add/remove)
+        self.compiled = {}
+        # registration counter (keeps the order of equal priorities)
+        self.order = 0
+        # times each event has been ran
+        self.counts = {}
+        # cumulative handler time (in ms) by event name and by (event name, handler)
+        self.timed = False
+        self.times = {}
+        self.handler_times = {}
+        # profiler receiving the handler times (see Profiler.attach)
+        self.profiler = None
+        # handler names by (event name, handler)
+        self.handler_names = {}
+    def add(self, event_name, handler, priority = 0):
+        """
+        Registers a new event handler. Handlers run by ascending priority,
+        then in registration order.
+        """
+        if event_name not in self.events:
+            self.events[event_name] = []
+        self.events[event_name].append((priority, self.order, handler))
+        self.order += 1
+        # names the handler for the profiler (e.g. "draw:Score.draw")
+        handler_name = getattr(handler, '__name__', 'handler')
+        handler_owner = getattr(handler, '__self__', None)
+        if handler_owner is not None:
+            handler_name = handler_owner.__class__.__name__ + '.' + handler_name
+        self.handler_names[(event_name, handler)] = event_name + ':' + handler_name
+        self.compile(event_name)
+    def remove(self, event_name, handler):
+        """
+        Unregisters an event handler, returns False if it wasn't registered
+        """
+        if event_name in self.events:
+            for e in self.events[event_name]:
+                if e[2] == handler:
+                    self.events[event_name].remove(e)
+                    self.compile(event_name)
+                    # forgets the handler unless it was added more than once
+                    if handler not in self.compiled[event_name]:
+                        self.handler_names.pop((event_name, handler), None)
+                        self.handler_times.pop((event_name, handler), None)
+                    return True
+        return False
+    def compile(self, event_name):
         """
-        Registers a new event handler
+        Rebuilds the call list of the event (run() only reads this tuple)
         """
-        data = {
-            "name": event_name,
-            "handler": handler
-        }
-        self.events.append(data)
+        entries = sorted(self.events[event_name], key = lambda e: (e[0], e[1]))
+        self.compiled[event_name] = tuple([e[2] for e in entries])
+    def set_timed(self, timed):
+        """
+        Enables measuring the time spent in each handler
+        """
+        self.timed = timed
     def run(self, name, args):
         """
         Runs all events that matches the given name
         """
-        # iterate through all events
-        for e in self.events:
-            # if it's of the draw type
-            if e['name'] == name:
-                # call the given handler
-                e['handler'](args)
+        self.counts[name] = self.counts.get(name, 0) + 1
+        handlers = self.compiled.get(name, ())
+        if not self.timed:
+            # fast path
+            for handler in handlers:
+                handler(args)
+            return
+        start_time = perf_clock()
+        for handler in handlers:
+            handler_start_time = perf_clock()
+            handler(args)
+            handler_time = (perf_clock() - handler_start_time) * 1000
+            key = (name, handler)
+            self.handler_times[key] = self.handler_times.get(key, 0) + handler_time
+            if self.profiler is not None:
+                self.profiler.record(self.handler_names.get(key, name), handler_time)
+        self.times[name] = self.times.get(name, 0) + (perf_clock() - start_time) * 1000
+    def get_count(self, name):
+        return self.counts.get(name, 0)
+    def get_time(self, name):
+        return self.times.get(name, 0)
+    def get_stats(self):
+        """
+        Returns the dispatch count, handler count and cumulative time (ms) of each event
+        """
+        stats = {}
+        for name in self.compiled:
+            stats[name] = {
+                'count': self.get_count(name),
+                'handlers': len(self.compiled[name]),
+                'time': self.get_time(name)
+            }
+        return stats
 
 class Frame:
     def __init__(self, frame, size):
@@ -112,34 +790,206 @@ class Frame:
         self.get().set_keyup_handler(handler)
 
 class Timer:
-    def __init__(self, delay):
+    def __init__(self, delay, dispatcher, profiler = None, backend = None):
         # sets the initial time to 0
         self.time = 0
         # sets the delay
         self.delay = delay
-        # creates a timer
-        self.timer = simplegui.create_timer(delay, self.count)
+        # sets the dispatcher receiving the count events
+        self.dispatcher = dispatcher
+        # times each tick when given (the game's profiler)
+        self.profiler = profiler
+        # creates a timer (on the current backend by default)
+        if backend is None:
+            backend = get_backend()
+        self.timer = backend.create_timer(delay, self.count)
     def get_timer(self):
         return self.timer
     def get_time(self):
         return self.time
     def count(self):
+        start_time = None
+        if self.profiler is not None:
+            start_time = self.profiler.start()
         self.time += self.delay
         timer_event = TimerEvent(self.get_time())
-        dispatcher.run('count', timer_event)
+        self.dispatcher.run('count', timer_event)
+        if self.profiler is not None:
+            self.profiler.stop('count', start_time)
     def start(self):
         self.get_timer().start()
+    def stop(self):
+        self.get_timer().stop()
+
+class AssetCache:
+    def __init__(self, budget = ASSET_CACHE_BUDGET):
+        """
+        Caches the loaded images and sounds by url (shared by every game).
+        Past the byte budget, the least recently used assets are evicted
+        (the objects already using them keep them).
+
+        <int> budget        The memory budget (in bytes)
+        """
+        self.budget = budget
+        # assets, their size and their last use by url
+        self.assets = {}
+        self.sizes = {}
+        self.last_used = {}
+        self.uses = 0
+        self.bytes = 0
+        # image sizes of the manifest (used until an image knows its own)
+        self.image_sizes = {}
+        for kind, url, size in ASSET_MANIFEST:
+            if size is not None:
+                self.image_sizes[url] = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # time spent in the backend's load calls (in ms)
+        self.load_time = 0
+    def has(self, url):
+        return url in self.assets
+    def get_size(self, kind, url, asset):
+        """
+        Returns the memory counted for an asset (in bytes)
+        """
+        if kind == 'sound':
+            return SOUND_SIZE_ESTIMATE
+        if hasattr(asset, 'get_width') and asset.get_width() > 0:
+            return asset.get_width() * asset.get_height() * 4
+        if url in self.image_sizes:
+            return self.image_sizes[url][0] * self.image_sizes[url][1] * 4
+        return 0
+    def load(self, kind, url, backend = None):
+        """
+        Returns the cached 'image' or 'sound', loading it on a miss
+        (from the given backend, the current one by default)
+        """
+        self.uses += 1
+        if url in self.assets:
+            self.hits += 1
+            self.last_used[url] = self.uses
+            return self.assets[url]
+        self.misses += 1
+        start_time = perf_clock()
+        if backend is None:
+            backend = get_backend()
+        if kind == 'image':
+            asset = backend.load_image(url)
+        else:
+            asset = backend.load_sound(url)
+        self.load_time += (perf_clock() - start_time) * 1000
+        self.put(kind, url, asset)
+        return asset
+    def put(self, kind, url, asset):
+        self.assets[url] = asset
+        self.sizes[url] = self.get_size(kind, url, asset)
+        self.last_used[url] = self.uses
+        self.bytes += self.sizes[url]
+        self.trim(url)
+    def trim(self, keep = None):
+        """
+        Evicts the least recently used assets (except keep) until within the budget
+        """
+        while self.bytes > self.budget and len(self.assets) > 0:
+            oldest = None
+            for cached_url in self.assets:
+                if cached_url != keep and (oldest is None or self.last_used[cached_url] < self.last_used[oldest]):
+                    oldest = cached_url
+            if oldest is None:
+                break
+            self.evict(oldest)
+    def evict(self, url):
+        self.bytes -= self.sizes[url]
+        del self.assets[url]
+        del self.sizes[url]
+        del self.last_used[url]
+        self.evictions += 1
+    def set_budget(self, budget):
+        self.budget = budget
+        self.trim()
+    def clear(self):
+        self.assets = {}
+        self.sizes = {}
+        self.last_used = {}
+        self.bytes = 0
+    def get_stats(self):
+        return {
+            'assets': len(self.assets),
+            'bytes': self.bytes,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'load_time': self.load_time
+        }
+
+# create the cache store for static assets (shared by every game)
+CACHE_STORE = AssetCache()
+
+class AssetLoader:
+    def __init__(self, manifest, cache, backend = None):
+        """
+        Loads every asset of a manifest at once (the browser fetches them in
+        parallel) and tracks when they are ready
+
+        <list> manifest         The (kind, url, image size) of each asset
+        <AssetCache> cache      The cache the assets are loaded into
+        <Backend> backend       The backend loading them (the current one by default)
+        """
+        if backend is None:
+            backend = get_backend()
+        self.manifest = manifest
+        self.cache = cache
+        self.backend = backend
+        # assets still loading: (url, asset, load start time)
+        self.pending = []
+        self.loaded = 0
+        self.started = False
+        # time from the start until every asset was ready (in ms)
+        self.ready_time = None
+        self.start_time = None
+    def start(self):
+        """
+        Issues the load of every asset
+        """
+        self.started = True
+        self.start_time = perf_clock()
+        for kind, url, size in self.manifest:
+            self.pending.append((url, self.cache.load(kind, url, self.backend)))
+        self.poll()
+    def poll(self):
+        """
+        Checks the assets still loading, returns True once every asset is ready
+        """
+        if len(self.pending) > 0:
+            backend = self.backend
+            pending = []
+            for url, asset in self.pending:
+                if backend.is_loaded(asset):
+                    self.loaded += 1
+                else:
+                    pending.append((url, asset))
+            self.pending = pending
+            if len(self.pending) == 0:
+                self.ready_time = (perf_clock() - self.start_time) * 1000
+        return self.is_ready()
+    def is_ready(self):
+        return self.started and len(self.pending) == 0
+    def get_progress(self):
+        """
+        Returns the loaded fraction (0 to 1)
+        """
+        if len(self.manifest) == 0:
+            return 1.0
+        return self.loaded / float(len(self.manifest))
 
 class Image:
     def __init__(self, url, size, center = None):
         # sets the url
         self.url = url
         # loads the image
-        if CACHE_STORE.has_key(url):
-            self.image = CACHE_STORE[url]
-        else:
-            self.image = simplegui.load_image(url)
-            CACHE_STORE[url] = self.image
+        self.image = CACHE_STORE.load('image', url)
         # sets the dimensions of the image
         self.set_size(size)
         # if the center is not set
@@ -163,20 +1013,11 @@ class Image:
         center destination and size
         """
         canvas.draw_image(self.get_image(), self.get_center(), self.get_size(), center_dest, size_dest, rotation)
-    def draw_animated_at(self, canvas, center_dest, size_dest, rotation = 0, age = 0):
-        center = self.get_center()
-        size = self.get_size()
-        anim_center = (center[0] + (age * size[0]), center[1])
-        canvas.draw_image(self.get_image(), anim_center, size, center_dest, size_dest, rotation)
 
 class Sound:
     def __init__(self, url):
         self.url = url
-        if CACHE_STORE.has_key(url):
-            self.sound = CACHE_STORE[url]
-        else:
-            self.sound = simplegui.load_sound(url)
-            CACHE_STORE[url] = self.sound
+        self.sound = CACHE_STORE.load('sound', url)
     def get_sound(self):
         return self.sound
     def play(self):
@@ -186,50 +1027,541 @@ class Sound:
     def rewind(self):
         self.sound.rewind()
 
+class SpriteDefinition:
+    def __init__(self, name, image_url, size, frame_count, sound_url = None):
+        """
+        The resources shared by every sprite of a type (read-only): the image,
+        the size of a frame, the frame table (source center of each frame)
+        and the sound. Sprites only keep a reference to their definition.
+
+        <str> name              The sprite type
+        <str> image_url         The image (frames laid out left to right)
+        <tuple> size            The size of a frame
+        <int> frame_count       The number of frames
+        <str> sound_url         The sound (None for no sound)
+        """
+        self.name = name
+        self.image = CACHE_STORE.load('image', image_url)
+        self.size = size
+        frames = []
+        for i in range(frame_count):
+            frames.append((size[0] / 2 + i * size[0], size[1] / 2))
+        self.frames = tuple(frames)
+        if sound_url is None:
+            self.sound = None
+        else:
+            self.sound = Sound(sound_url)
+    def get_frame_count(self):
+        return len(self.frames)
+    def draw(self, canvas, frame, center_dest, size_dest, rotation = 0):
+        """
+        Draws a frame of the image into the canvas at the given center destination and size
+        """
+        # holds the last frame
+        if frame >= len(self.frames):
+            frame = len(self.frames) - 1
+        canvas.draw_image(self.image, self.frames[frame], self.size, center_dest, size_dest, rotation)
+
+# sprite definitions by type (created on first use)
+SPRITE_DEFINITIONS = {}
+
+def get_sprite_definition(name):
+    """
+    Returns the shared SpriteDefinition of a sprite type
+    """
+    if name not in SPRITE_DEFINITIONS:
+        image_url, size, frame_count, sound_url = SPRITE_TYPES[name]
+        SPRITE_DEFINITIONS[name] = SpriteDefinition(name, image_url, size, frame_count, sound_url)
+    return SPRITE_DEFINITIONS[name]
+
+class AnimationClip:
+    def __init__(self, name, definition, first_frame, frame_count, frame_duration, loop_mode = ANIMATION_ONCE):
+        """
+        A sequence of frames of a sprite definition played over simulation
+        time, so it looks the same whatever frames are rendered or skipped
+
+        <str> name                  The clip name
+        <SpriteDefinition> definition
+        <int> first_frame           The first frame of the definition played
+        <int> frame_count           The number of frames played
+        <float> frame_duration      The time each frame is shown (in ms)
+        <str> loop_mode             ANIMATION_ONCE, ANIMATION_LOOP or ANIMATION_PING_PONG
+        """
+        if loop_mode not in (ANIMATION_ONCE, ANIMATION_LOOP, ANIMATION_PING_PONG):
+            raise ValueError('unknown loop mode %s' % loop_mode)
+        self.name = name
+        self.definition = definition
+        self.frame_duration = frame_duration
+        self.loop_mode = loop_mode
+        # frame table, the frame shown in each slot of the clip
+        frames = list(range(first_frame, first_frame + frame_count))
+        if loop_mode == ANIMATION_PING_PONG:
+            # plays back without repeating either end
+            frames = frames + frames[-2:0:-1]
+        self.frames = tuple(frames)
+        self.duration = len(self.frames) * frame_duration
+    def get_duration(self):
+        return self.duration
+    def get_lifetime(self, step_size = 1000.0 / STEP_RATE):
+        """
+        Returns the steps a sprite lives to play the clip once (its Sprite lifetime)
+        """
+        return int(math.ceil(self.duration / step_size - 1e-6))
+    def get_frame(self, elapsed):
+        """
+        Returns the frame of the definition shown after the elapsed time (in ms)
+        """
+        # the small bias keeps exact multiples of the frame duration on their frame
+        index = int(elapsed / self.frame_duration + 1e-6)
+        if index < 0:
+            return self.frames[0]
+        if index >= len(self.frames):
+            if self.loop_mode == ANIMATION_ONCE:
+                return self.frames[-1]
+            index = index % len(self.frames)
+        return self.frames[index]
+
+# animation clips by name (created on first use)
+ANIMATIONS = {}
+
+def get_animation_clip(name):
+    """
+    Returns the shared AnimationClip of the given name
+    """
+    if name not in ANIMATIONS:
+        sprite_type, first_frame, frame_count, frame_duration, loop_mode = ANIMATION_CLIPS[name]
+        ANIMATIONS[name] = AnimationClip(name, get_sprite_definition(sprite_type), first_frame, frame_count, frame_duration, loop_mode)
+    return ANIMATIONS[name]
+
+class TextWidthCache:
+    def __init__(self, size):
+        """
+        Memoizes measured text widths by (text, font size, font face). Once
+        full, the oldest width is dropped for each new one.
+
+        <int> size      The number of widths kept
+        """
+        self.size = size
+        self.widths = {}
+        # keys in insertion order (a ring, next is the oldest)
+        self.keys = []
+        self.next = 0
+        self.hits = 0
+        self.misses = 0
+    def get_width(self, frame, text, font_size, font_face = 'serif'):
+        """
+        Returns the width of the text, measured with the (SimpleGUI) frame on a miss
+        """
+        key = (text, font_size, font_face)
+        width = self.widths.get(key)
+        if width is not None:
+            self.hits += 1
+            return width
+        self.misses += 1
+        width = frame.get_canvas_textwidth(text, font_size, font_face)
+        if len(self.keys) < self.size:
+            self.keys.append(key)
+        else:
+            del self.widths[self.keys[self.next]]
+            self.keys[self.next] = key
+            self.next = (self.next + 1) % self.size
+        self.widths[key] = width
+        return width
+    def clear(self):
+        self.widths = {}
+        self.keys = []
+        self.next = 0
+    def get_stats(self):
+        return {
+            'widths': len(self.widths),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+# memoized text widths (shared by every frame)
+TEXT_WIDTHS = TextWidthCache(TEXT_WIDTH_CACHE_SIZE)
+
+class HudLabel:
+    def __init__(self, prefix, value_format = '%s', font_size = 24, font_color = 'white'):
+        """
+        A retained text label: its text and width are only rebuilt (by layout)
+        after set_value() changed the value
+
+        <str> prefix            The static part of the text
+        <str> value_format      The format of the value
+        <int> font_size
+        <str> font_color
+        """
+        self.prefix = prefix
+        self.value_format = value_format
+        self.font_size = font_size
+        self.font_color = font_color
+        self.value = None
+        self.text = prefix
+        self.width = 0
+        self.dirty = True
+    def set_value(self, value):
+        if value != self.value:
+            self.value = value
+            self.dirty = True
+    def get_width(self):
+        return self.width
+    def layout(self, frame):
+        """
+        Rebuilds and measures the text if dirty, returns whether it changed
+        """
+        if not self.dirty:
+            return False
+        self.text = self.prefix + self.value_format % self.value
+        self.width = TEXT_WIDTHS.get_width(frame, self.text, self.font_size)
+        self.dirty = False
+        return True
+    def draw(self, canvas, position):
+        canvas.draw_text(self.text, position, self.font_size, self.font_color)
+
 class Score:
     def __init__(self, lives):
         self.initial_lives = lives
         self.lives = lives
         self.score = 0
+        # set the gutter size
+        self.gutter_size = 24
+        # retained labels, laid out again when dirty
+        self.lives_label = HudLabel('Lives: ', '%d')
+        self.score_label = HudLabel('Score: ', '%d')
+        self.dirty = True
+        self.lives_position = None
+        self.score_position = None
+        self.layout_width = None
+        # frames between layouts (a changed value shows up to interval - 1 frames late)
+        self.refresh_interval = 1
+        self.frames_since_layout = 0
     def reset(self):
         self.lives = self.initial_lives
         self.score = 0
+        self.dirty = True
     def decrease_lives(self):
         self.lives -= 1
+        self.dirty = True
+    def set_lives(self, lives):
+        self.lives = lives
+        self.dirty = True
     def get_lives(self):
         return self.lives
     def increment_score(self):
         self.score += 1
+        self.dirty = True
+    def set_score(self, score):
+        self.score = score
+        self.dirty = True
     def get_score(self):
         return self.score
+    def set_refresh_interval(self, interval):
+        self.refresh_interval = interval
+    def layout(self, frame):
+        """
+        Rebuilds the texts and positions of the labels
+        """
+        self.lives_label.set_value(self.lives)
+        self.score_label.set_value(self.score)
+        self.lives_label.layout(frame.get())
+        self.score_label.layout(frame.get())
+        gutter_size = self.gutter_size
+        top = gutter_size + (self.score_label.font_size / 2)
+        self.lives_position = (gutter_size, top)
+        self.score_position = (frame.get_width() - self.score_label.get_width() - gutter_size, top)
+        self.layout_width = frame.get_width()
+        self.dirty = False
+        self.frames_since_layout = 0
     def draw(self, draw_event):
-        # set the gutter size
-        gutter_size = 24
-        # set the font style
-        font_size = 24
-        font_color = 'white'
-        # create the text
-        lives_text = 'Lives: ' + str(self.get_lives())
-        score_text = 'Score: ' + str(self.get_score())
-        # calculate text width
-        lives_text_width = draw_event.frame.get().get_canvas_textwidth(lives_text, font_size)
-        score_text_width = draw_event.frame.get().get_canvas_textwidth(score_text, font_size)
-        draw_event.canvas.draw_text(lives_text, (gutter_size, gutter_size + (font_size / 2)), font_size, font_color)
-        draw_event.canvas.draw_text(score_text, (draw_event.frame.get_width() - score_text_width - gutter_size, gutter_size + (font_size / 2)), font_size, font_color)
+        self.frames_since_layout += 1
+        if self.layout_width != draw_event.frame.get_width():
+            self.layout(draw_event.frame)
+        elif self.dirty and self.frames_since_layout >= self.refresh_interval:
+            self.layout(draw_event.frame)
+        draw_event.canvas.set_layer(LAYER_HUD)
+        self.lives_label.draw(draw_event.canvas, self.lives_position)
+        self.score_label.draw(draw_event.canvas, self.score_position)
 
-class Game:
+class Histogram:
     def __init__(self, size):
         """
-        Creates a new game window
+        Keeps the latest samples in a ring buffer
 
-        <tuple> size
+        <int> size      The number of samples kept
         """
+        self.size = size
+        self.samples = []
+        self.index = 0
+        self.count = 0
+    def add(self, value):
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            self.samples[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count += 1
+    def percentile(self, percent, ordered = None):
+        """
+        Returns the nearest-rank percentile of the kept samples
+        (ordered can pass the samples already sorted)
+        """
+        if len(self.samples) == 0:
+            return 0
+        if ordered is None:
+            ordered = sorted(self.samples)
+        rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+        return ordered[max(0, rank)]
+    def get_summary(self):
+        if len(self.samples) == 0:
+            return {'count': self.count, 'mean': 0, 'p50': 0, 'p95': 0, 'p99': 0, 'max': 0}
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'mean': sum(ordered) / float(len(ordered)),
+            'p50': self.percentile(50, ordered),
+            'p95': self.percentile(95, ordered),
+            'p99': self.percentile(99, ordered),
+            'max': ordered[-1]
+        }
+
+class Profiler:
+    def __init__(self, window = PROFILER_WINDOW):
+        """
+        Collects rolling timings (in ms) per stage, gauges (e.g. entity counts
+        per group) and allocations per frame. Disabled by default, start()
+        returns None and stop() does nothing until enable() is called.
+
+        <int> window        The number of samples kept per stage
+        """
+        self.enabled = False
+        self.window = window
+        self.histograms = {}
+        self.gauges = {}
+        self.frames = 0
+        self.last_allocated_blocks = None
+        # JSON lines output (see set_output)
+        self.output = None
+        self.output_interval = 0
+    def enable(self, dispatcher = None):
+        """
+        Starts profiling, timing each handler of the dispatcher when given
+        """
+        self.enabled = True
+        if dispatcher is not None:
+            self.attach(dispatcher)
+    def disable(self):
+        self.enabled = False
+    def attach(self, dispatcher):
+        dispatcher.profiler = self
+        dispatcher.set_timed(True)
+    def start(self):
+        if self.enabled:
+            return perf_clock()
+        return None
+    def stop(self, name, start_time):
+        if start_time is not None:
+            self.record(name, (perf_clock() - start_time) * 1000)
+    def record(self, name, value):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(self.window)
+        self.histograms[name].add(value)
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+    def get_histogram(self, name):
+        return self.histograms.get(name)
+    def end_frame(self):
+        """
+        Closes the current frame: samples the allocations since the previous
+        frame and writes the JSON line when due
+        """
+        if not self.enabled:
+            return
+        self.frames += 1
+        if get_allocated_blocks is not None:
+            allocated_blocks = get_allocated_blocks()
+            if self.last_allocated_blocks is not None:
+                self.record('allocations', allocated_blocks - self.last_allocated_blocks)
+            self.last_allocated_blocks = allocated_blocks
+        if self.output is not None and self.frames % self.output_interval == 0:
+            self.export(self.output)
+    def get_summary(self):
+        stages = {}
+        for name in self.histograms:
+            stages[name] = self.histograms[name].get_summary()
+        return {
+            'frame': self.frames,
+            'stages': stages,
+            'gauges': dict(self.gauges)
+        }
+    def set_output(self, output, interval = 60):
+        """
+        Writes a JSON line summary into the file object every interval frames
+        """
+        self.output = output
+        self.output_interval = interval
+    def export(self, output):
+        """
+        Writes the summary as a single JSON line
+        """
+        import json
+        output.write(json.dumps(self.get_summary(), sort_keys = True) + '\n')
+
+def combine_profilers(profilers):
+    """
+    Returns a profiler holding the kept samples of all the given profilers
+    (e.g. one per game), their gauges and frames are added up
+    """
+    window = 0
+    for profiler in profilers:
+        window += profiler.window
+    combined = Profiler(max(window, 1))
+    for profiler in profilers:
+        combined.frames += profiler.frames
+        for name in profiler.histograms:
+            histogram = profiler.histograms[name]
+            for value in histogram.samples:
+                combined.record(name, value)
+            # counts every sample taken, not only the kept ones
+            combined.histograms[name].count += histogram.count - len(histogram.samples)
+        for name in profiler.gauges:
+            combined.gauges[name] = combined.gauges.get(name, 0) + profiler.gauges[name]
+    return combined
+
+class QualityController:
+    def __init__(self, budget = FRAME_BUDGET, tiers = QUALITY_TIERS):
+        """
+        Watches the cost of each frame and steps through the quality tiers:
+        down one tier once the smoothed cost stays over budget, back up once
+        it stays well under it for longer (so it doesn't flip back and forth).
+        Disabled by default, the tier then stays at full quality.
+
+        <float> budget      The frame budget (in ms)
+        <list> tiers        The settings of each tier, from full quality down
+        """
+        self.enabled = False
+        self.budget = budget
+        self.tiers = tiers
+        self.tier = 0
+        # cost of the current frame and smoothed cost of the previous ones (in ms)
+        self.frame_cost = 0
+        self.average_cost = 0
+        # frames in a row over budget and with headroom
+        self.over_frames = 0
+        self.under_frames = 0
+        self.frames = 0
+        self.downgrades = 0
+        self.upgrades = 0
+    def enable(self):
+        self.enabled = True
+    def disable(self):
+        self.enabled = False
+        self.set_tier(0)
+    def start(self):
+        if self.enabled:
+            return perf_clock()
+        return None
+    def stop(self, start_time):
+        """
+        Adds the time since start_time to the current frame's cost
+        """
+        if start_time is not None:
+            self.frame_cost += (perf_clock() - start_time) * 1000
+    def get_tier(self):
+        return self.tier
+    def get_settings(self):
+        return self.tiers[self.tier]
+    def get_setting(self, name):
+        return self.tiers[self.tier][name]
+    def set_tier(self, tier):
+        self.tier = tier
+        self.over_frames = 0
+        self.under_frames = 0
+    def end_frame(self):
+        """
+        Closes the current frame, returns True when the tier changed
+        """
+        if not self.enabled:
+            return False
+        cost = self.frame_cost
+        self.frame_cost = 0
+        self.frames += 1
+        if self.frames == 1:
+            self.average_cost = cost
+        else:
+            self.average_cost += (cost - self.average_cost) * QUALITY_SMOOTHING
+        if self.average_cost > self.budget:
+            self.over_frames += 1
+            self.under_frames = 0
+        elif self.average_cost < self.budget * QUALITY_RESTORE_RATIO:
+            self.under_frames += 1
+            self.over_frames = 0
+        else:
+            self.over_frames = 0
+            self.under_frames = 0
+        if self.over_frames >= QUALITY_DEGRADE_FRAMES and self.tier < len(self.tiers) - 1:
+            self.set_tier(self.tier + 1)
+            self.downgrades += 1
+            return True
+        if self.under_frames >= QUALITY_RESTORE_FRAMES and self.tier > 0:
+            self.set_tier(self.tier - 1)
+            self.upgrades += 1
+            return True
+        return False
+    def get_stats(self):
+        return {
+            'tier': self.tier,
+            'frames': self.frames,
+            'average_cost': self.average_cost,
+            'downgrades': self.downgrades,
+            'upgrades': self.upgrades
+        }
+
+class Game:
+    def __init__(self, size, dispatcher = None, backend = None):
+        """
+        Creates a new game window. Every game has its own Dispatcher, so
+        several games can run in the same process.
+
+        <tuple> size
+        <Dispatcher> dispatcher     The event dispatcher (a new one by default)
+        <Backend> backend           The backend of the frame, timer and clock (the current one by default)
+        """
+        if dispatcher is None:
+            dispatcher = Dispatcher()
+        if backend is None:
+            backend = get_backend()
+        self.dispatcher = dispatcher
+        self.backend = backend
+        # collects this game's timings (disabled until self.profiler.enable())
+        self.profiler = Profiler()
         # sets the window's size
         self.set_window_size(size)
         # creates the Frame
         self.frame = self.create_frame()
         # creates a Timer
         self.timer = self.create_timer()
+        # sets up the fixed timestep simulation
+        self.step_rate = STEP_RATE
+        self.step_size = 1000.0 / self.step_rate
+        self.max_catch_up_steps = MAX_CATCH_UP_STEPS
+        self.steps = 0
+        self.dropped_steps = 0
+        # unsimulated time, in ms multiplied by the step rate (exact for integer clocks)
+        self.accumulator = 0
+        self.last_tick_time = None
+        # clock read on each timer tick (in ms), the backend clock by default
+        self.clock = None
+        # interpolates sprites between simulation steps when drawing
+        self.interpolate = True
+        # collects each frame's draw calls, submitted sorted by layer and texture
+        self.render_buffer = CommandBuffer(size)
+        # lowers the quality when frames go over budget (see QualityController.enable)
+        self.quality = QualityController()
+        # groups reaped and flushed at the end of each step
+        self.groups = []
+        # advances the simulation on each timer tick
+        self.dispatcher.add('count', self.tick)
     def set_window_size(self, size):
         """
         Sets the game window's size
@@ -259,7 +1591,7 @@ class Game:
         """
         Creates and returns a new Frame instance and set's the draw handler
         """
-        sg_frame = simplegui.create_frame("Game", self.get_window_width(), self.get_window_height())
+        sg_frame = self.backend.create_frame("Game", self.get_window_width(), self.get_window_height())
         # create a new Frame instance
         frame = Frame(sg_frame, self.get_window_size())
         # sets the draw handler
@@ -282,13 +1614,112 @@ class Game:
         Creates and returns a new Timer instance
         """
         # creates a timer (calls each 25ms)
-        timer = Timer(25)
+        timer = Timer(25, self.dispatcher, self.profiler, self.backend)
         return timer
     def get_timer(self):
         """
         Returns the Timer instance
         """
         return self.timer
+    def get_steps(self):
+        """
+        Returns the number of simulation steps ran so far
+        """
+        return self.steps
+    def get_time(self):
+        """
+        Returns the simulation time (in ms)
+        """
+        return self.steps * 1000 // self.step_rate
+    def get_alpha(self):
+        """
+        Returns how far (0 to 1) the clock is between the last simulation step and the next
+        """
+        if self.interpolate:
+            return self.accumulator / 1000.0
+        return 1.0
+    def get_render_time(self):
+        """
+        Returns the simulation time (in ms) a frame drawn now shows, sprites
+        are drawn between the previous step and the last one
+        """
+        return max(self.steps - 1 + self.get_alpha(), 0) * self.step_size
+    def set_clock(self, clock):
+        """
+        Sets the function returning the clock time (in ms) read on each
+        timer tick, None for the backend clock
+        """
+        self.clock = clock
+        self.last_tick_time = None
+    def get_clock_time(self):
+        if self.clock is not None:
+            return self.clock()
+        return self.backend.get_time()
+    def tick(self, timer_event):
+        """
+        Timer handler, feeds the elapsed clock time into the simulation
+        """
+        quality_start_time = self.quality.start()
+        now = self.get_clock_time()
+        if self.last_tick_time is None:
+            elapsed = self.get_timer().delay
+        else:
+            elapsed = now - self.last_tick_time
+        self.last_tick_time = now
+        self.advance(elapsed)
+        self.quality.stop(quality_start_time)
+    def advance(self, elapsed):
+        """
+        Runs as many fixed simulation steps as fit in the elapsed time (in ms),
+        up to max_catch_up_steps. Time beyond the cap is dropped.
+        """
+        self.accumulator += elapsed * self.step_rate
+        steps = 0
+        while self.accumulator >= 1000:
+            # drop the backlog once the catch up cap is reached
+            if steps >= self.max_catch_up_steps:
+                dropped = int(self.accumulator // 1000)
+                self.dropped_steps += dropped
+                self.accumulator -= dropped * 1000
+                break
+            self.step()
+            self.accumulator -= 1000
+            steps += 1
+        return steps
+    def step(self):
+        """
+        Runs a single fixed simulation step
+        """
+        start_time = self.profiler.start()
+        self.steps += 1
+        update_event = UpdateEvent(self.steps, self.get_time(), self.step_size, self.get_size())
+        self.update(update_event)
+        self.dispatcher.run('update', update_event)
+        self.flush()
+        self.profiler.stop('step', start_time)
+    def update(self, update_event):
+        """
+        Simulation handler
+        """
+        pass
+    def add_group(self, group, name = None):
+        """
+        Registers a group for end of step reaping (expired sprites are retired)
+        """
+        group.set_name(name)
+        self.groups.append(group)
+        return group
+    def flush(self):
+        """
+        End of step handler, retires the expired sprites and applies
+        the removals deferred during the step
+        """
+        for group in self.groups:
+            group.reap()
+            group.flush()
+            # tracks the entity counts
+            if self.profiler.enabled and group.name is not None:
+                self.profiler.set_gauge(group.name, group.count())
     def start(self):
         """
         Starts the game (opens the game frame)
@@ -297,36 +1728,245 @@ class Game:
         self.get_timer().start()
         # starts frame
         self.get_frame().get().start()
+    def stop(self):
+        """
+        Stops the game (stops the timer and closes the game frame)
+        """
+        self.get_timer().stop()
+        self.get_frame().get().stop()
     def draw(self, canvas):
         """
         Draw handler
         """
+        # closes the previous frame
+        self.profiler.end_frame()
+        quality_start_time = self.quality.start()
+        start_time = self.profiler.start()
+        # handlers draw into the command buffer
+        self.render_buffer.begin()
         # create a DrawEvent
-        draw_event = DrawEvent(canvas, self.get_frame())
-        dispatcher.run('draw', draw_event)
+        draw_event = DrawEvent(self.render_buffer, self.get_frame(), self.get_alpha(), self.get_render_time(), self.step_size)
+        self.dispatcher.run('draw', draw_event)
+        self.render(draw_event)
+        self.profiler.stop('draw', start_time)
+        # renders the frame into the canvas
+        start_time = self.profiler.start()
+        self.render_buffer.submit(canvas)
+        self.profiler.stop('submit', start_time)
+        if self.profiler.enabled:
+            self.profiler.set_gauge('draw_commands', self.render_buffer.count())
+            self.profiler.set_gauge('draw_batches', self.render_buffer.batches)
+            self.profiler.set_gauge('draw_culled', self.render_buffer.culled)
+            self.profiler.set_gauge('quality_tier', self.quality.get_tier())
+        # changes the quality tier for the next frames
+        self.quality.stop(quality_start_time)
+        if self.quality.end_frame():
+            quality_event = QualityEvent(self.quality.get_tier(), self.quality.get_settings())
+            self.dispatcher.run('quality', quality_event)
+    def render(self, draw_event):
+        """
+        Draws the game's own layers after the draw handlers (into draw_event.canvas)
+        """
+        pass
+    def get_render_buffer(self):
+        """
+        Returns the command buffer holding the last frame (see CommandBuffer.replay)
+        """
+        return self.render_buffer
     def onclick(self, position):
         """
         Mouseclick handler
         """
         click_event = ClickEvent(position)
-        dispatcher.run('click', click_event)
+        self.dispatcher.run('click', click_event)
     def onkeydown(self, key):
         """
         Keydown handler
         """
         key_event = KeyEvent(key)
-        dispatcher.run('keydown', key_event)
+        self.dispatcher.run('keydown', key_event)
     def onkeyup(self, key):
         """
         Keyup handler
         """
         key_event = KeyEvent(key)
-        dispatcher.run('keyup', key_event)
+        self.dispatcher.run('keyup', key_event)
+
+class WaveDirector:
+    def __init__(self, game, budget_curve, rate_curve = SPAWN_RATE_CURVE, safe_zone_radius = SAFE_ZONE_RADIUS):
+        """
+        Spawns the rocks of a game while it's played. Spawns accrue at the
+        rate of the rate curve and are placed while the rocks are under the
+        budget of the budget curve (both over the time played). Rocks never
+        appear within the safe zone of a spaceship, a spawn without a safe
+        position is put off to the next step.
+
+        <AsteroidsGame> game
+        <list> budget_curve         The maximum live rocks, as (time, count) points (None for no maximum)
+        <list> rate_curve           The rocks spawned per second, as (time, rate) points
+        <int> safe_zone_radius      The radius kept clear around every spaceship
+        """
+        self.game = game
+        self.budget_curve = budget_curve
+        self.rate_curve = rate_curve
+        self.safe_zone_radius = safe_zone_radius
+        # spaceships by grid cell, to test spawn positions against the safe zones
+        self.safe_zones = SpatialHash(game.get_size(), safe_zone_radius)
+        self.spawned = 0
+        self.culled = 0
+        self.deferred = 0
+        # fragments of shot rocks, and spawns (of any entity) dropped by the entity budget
+        self.fragments = 0
+        self.dropped = 0
+        # spawn and cull rates (per second) over the last SPAWN_RATE_WINDOW
+        self.spawn_rate = 0
+        self.cull_rate = 0
+        self.reset()
+    def reset(self):
+        """
+        Starts over from the beginning of the curves
+        """
+        # time played (in ms)
+        self.elapsed = 0
+        # spawns accrued and not placed yet (fractional)
+        self.credit = 0
+        self.reset_rates()
+    def reset_rates(self):
+        """
+        Starts the rate samples over from the current time (after a rewind)
+        """
+        self.samples = [(self.elapsed, self.spawned, self.culled)]
+        self.spawn_rate = 0
+        self.cull_rate = 0
+    def set_curves(self, budget_curve, rate_curve):
+        self.budget_curve = budget_curve
+        self.rate_curve = rate_curve
+    def get_budget(self):
+        """
+        Returns the maximum live rocks at the current time (None for no maximum)
+        """
+        if self.budget_curve is None:
+            return None
+        return int(sample_curve(self.budget_curve, self.elapsed))
+    def get_rate(self):
+        """
+        Returns the rocks spawned per second at the current time
+        """
+        return sample_curve(self.rate_curve, self.elapsed)
+    def is_safe(self, position, radius):
+        """
+        Returns whether a rock of the given radius at the position stays out of every safe zone
+        """
+        size = self.game.get_size()
+        reach = radius + self.safe_zone_radius
+        for ship in self.safe_zones.query(position, reach):
+            ship_position = ship.get_position()
+            dx = wrap_delta(ship_position[0] - position[0], size[0])
+            dy = wrap_delta(ship_position[1] - position[1], size[1])
+            distance = reach + ship.get_radius()
+            if dx * dx + dy * dy < distance * distance:
+                return False
+        return True
+    def find_position(self, radius):
+        """
+        Returns a random position out of the safe zones (None if none was found)
+        """
+        game = self.game
+        for i in range(SPAWN_ATTEMPTS):
+            position = (game.random.randrange(0, game.get_window_width()), game.random.randrange(0, game.get_window_height()))
+            if self.is_safe(position, radius):
+                return position
+        return None
+    def update(self, update_event):
+        """
+        Advances the time played by a step and spawns the rocks due
+        """
+        game = self.game
+        rocks = game.rocks
+        self.elapsed += update_event.delta
+        self.credit += self.get_rate() * update_event.delta / 1000.0
+        room = MAX_SPAWNS_PER_STEP
+        budget = self.get_budget()
+        if budget is not None:
+            # fragments queued during the step count as live rocks
+            room = min(room, budget - rocks.count() - game.get_queued_count(rocks))
+        if room <= 0:
+            # a full field doesn't bank spawns, only the next one waits
+            self.credit = min(self.credit, 1)
+        elif self.credit >= 1:
+            # spaceships only move between steps, the grid is built once per spawning step
+            self.safe_zones.clear()
+            for ship in self.game.ships:
+                self.safe_zones.insert(ship)
+            radius = ROCK_TYPES[0][1]
+            while self.credit >= 1 and room > 0:
+                if not game.can_spawn():
+                    self.record_drop()
+                    self.credit = min(self.credit, 1)
+                    break
+                position = self.find_position(radius)
+                if position is None:
+                    self.deferred += 1
+                    break
+                game.queue_spawn(rocks, game.create_rock(position))
+                self.credit -= 1
+                self.spawned += 1
+                room -= 1
+        self.sample_rates()
+    def record_cull(self):
+        """
+        Counts a rock gone from the field (shot or crashed)
+        """
+        self.culled += 1
+    def record_drop(self, count = 1):
+        """
+        Counts spawns refused by the entity budget (rocks, fragments, missles or explosions)
+        """
+        self.dropped += count
+    def sample_rates(self):
+        """
+        Updates the spawn and cull rates about every second
+        """
+        last_time = self.samples[-1][0]
+        if self.elapsed - last_time < 1000:
+            return
+        self.samples.append((self.elapsed, self.spawned, self.culled))
+        while len(self.samples) > 2 and self.elapsed - self.samples[1][0] >= SPAWN_RATE_WINDOW:
+            self.samples.pop(0)
+        first = self.samples[0]
+        seconds = (self.elapsed - first[0]) / 1000.0
+        self.spawn_rate = (self.spawned - first[1]) / seconds
+        self.cull_rate = (self.culled - first[2]) / seconds
+        if self.game.profiler.enabled:
+            self.game.profiler.set_gauge('spawn_rate', self.spawn_rate)
+            self.game.profiler.set_gauge('cull_rate', self.cull_rate)
+    def get_stats(self):
+        return {
+            'elapsed': self.elapsed,
+            'rocks': self.game.rocks.count(),
+            'budget': self.get_budget(),
+            'rate': self.get_rate(),
+            'spawned': self.spawned,
+            'culled': self.culled,
+            'deferred': self.deferred,
+            'fragments': self.fragments,
+            'dropped': self.dropped,
+            'spawn_rate': self.spawn_rate,
+            'cull_rate': self.cull_rate
+        }
 
 class AsteroidsGame(Game):
-    def __init__(self, size, lives, max_rock_count):
+    def __init__(self, size, lives, max_rock_count, seed = None, dispatcher = None, backend = None):
         # calls the parent constructor
-        Game.__init__(self, size)
+        Game.__init__(self, size, dispatcher, backend)
+        # creates the game's own random generator (the seed reproduces the game)
+        if seed is None:
+            seed = random.randrange(0, 2 ** 31)
+        self.seed = seed
+        self.random = create_random(seed)
+        # loads every asset up front (the game starts once they're ready)
+        self.assets = AssetLoader(ASSET_MANIFEST, CACHE_STORE, self.backend)
+        self.assets.start()
         # set the initial game flag
         self.started = False
         # set the initial lives
@@ -335,55 +1975,108 @@ class AsteroidsGame(Game):
         self.create_background()
         # creates the Player layer
         self.create_player()
-        # spawn rocks every second (1000ms)
-        self.spawn_rocks_delay = 1000
-        # create a new set to hold rocks
-        self.rocks = Group(set(), max_rock_count)
+        # maximum explosions drawn (set by the quality tier)
+        self.max_explosions = None
+        # create a new set to hold rocks (the director keeps them within budget)
+        self.rocks = self.add_group(Group(), 'rocks')
+        # creates the rocks (called like Rock), and steps them all at once when
+        # set instead of calling their update() (see entity_store.attach_rocks)
+        self.rock_factory = Rock
+        self.rock_stepper = None
+        # spawns a rock every second up to max_rock_count by default
+        self.max_rock_count = max_rock_count
+        if max_rock_count is None:
+            self.director = WaveDirector(self, None)
+        else:
+            self.director = WaveDirector(self, [(0, max_rock_count)])
         # creates a new Score layer
         self.score = self.create_score(lives)
         # creates the splash screen
         self.create_splash()
-        # create a new group to hold explosions
-        self.explosions = Group(set())
+        # create a new group to hold explosions (finished ones are recycled)
+        self.explosion_pool = Pool(Explosion, EXPLOSION_POOL_SIZE)
+        self.explosions = self.add_group(Group(None, None, self.explosion_pool), 'explosions')
+        # create the broad-phase collision grid
+        self.collision_grid = SpatialHash(self.get_size(), COLLISION_CELL_SIZE)
+        # spawns queued during a step, (group, sprite) added at the end of the step
+        self.spawn_queue = []
+        self.entity_budget = ENTITY_BUDGET
         # register events
-        dispatcher.add('count', self.check_collisions)
-        dispatcher.add('count', self.spawn_rocks)
-        dispatcher.add('game_event', self.check_game)
+        self.dispatcher.add('update', self.check_collisions)
+        self.dispatcher.add('update', self.spawn_rocks)
+        self.dispatcher.add('game_event', self.check_game)
+        self.dispatcher.add('quality', self.apply_quality)
     def create_splash(self):
         size = (400, 300)
         screen_size = self.get_size()
         center_position = (screen_size[0] / 2, screen_size[1] / 2)
         self.splash = SplashScreen(size, center_position)
-        dispatcher.add('click', self.start_game)
+        self.splash.set_loader(self.assets)
+        self.dispatcher.add('draw', self.splash.draw)
+        self.dispatcher.add('click', self.start_game)
     def create_background(self):
         # creates the Space layer
         self.space = Space(self.get_size())
+        self.dispatcher.add('draw', self.space.draw)
         # creates the Debris layer
-        self.debris = Debris(self.get_size(), self.get_timer())
+        self.debris = Debris(self.get_size())
+        self.dispatcher.add('draw', self.debris.draw)
     def create_player(self):
+        # every ship in the world (the local player's is the first)
+        self.ships = []
         # creates the player spaceship
-        self.player = PlayerSpaceship((90, 90), self.get_center())
-        dispatcher.add('keyup', self.handle_keyup)
-        dispatcher.add('keydown', self.handle_keydown)
-    def spawn_rocks(self, timer_event):
+        self.player = self.add_ship(self.get_center())
+        self.dispatcher.add('keyup', self.handle_keyup)
+        self.dispatcher.add('keydown', self.handle_keydown)
+    def add_ship(self, position = None):
+        """
+        Adds a spaceship to the world (e.g. a remote player's), its input
+        is fed through its onkeydown() and onkeyup()
+        """
+        if position is None:
+            position = self.get_center()
+        ship = PlayerSpaceship((90, 90), position)
+        # its missles count against the entity budget
+        ship.world = self
+        if len(self.ships) == 0:
+            self.add_group(ship.get_missles(), 'missles')
+        else:
+            self.add_group(ship.get_missles(), 'missles_%d' % len(self.ships))
+        self.ships.append(ship)
+        self.dispatcher.add('draw', ship.draw)
+        return ship
+    def remove_ship(self, ship):
+        """
+        Removes a spaceship added with add_ship()
+        """
+        self.ships.remove(ship)
+        ship.get_missles().clear()
+        self.groups.remove(ship.get_missles())
+        self.dispatcher.remove('draw', ship.draw)
+    def spawn_rocks(self, update_event):
         # continue if the game has started
         if self.started is True:
-            if timer_event.time % self.spawn_rocks_delay is 0:
-                # create a rock
-                rock = self.create_rock()
-                # add a new rock to the rock group
-                self.rocks.add(rock)
-    def create_rock(self):
+            self.director.update(update_event)
+    def apply_quality(self, quality_event):
+        """
+        Applies the settings of a new quality tier
+        """
+        settings = quality_event.settings
+        self.debris.hidden = not settings['debris']
+        self.max_explosions = settings['max_explosions']
+        self.score.set_refresh_interval(settings['hud_interval'])
+    def create_rock(self, position = None):
         # generate a random position
-        position = (random.randrange(0, self.get_window_width()), random.randrange(0, self.get_window_height()))
+        if position is None:
+            position = (self.random.randrange(0, self.get_window_width()), self.random.randrange(0, self.get_window_height()))
         # generate a random velocity
-        velocity = (random.choice([-1, 1]) * random.randint(1, 3), random.choice([-1, 1]) * random.randint(1, 3))
+        velocity = (self.random.choice([-1, 1]) * self.random.randint(1, 3), self.random.choice([-1, 1]) * self.random.randint(1, 3))
         # generate a random rotation velocity
-        rotation_velocity = random.choice([-1, 1]) * random.random() * 0.05
+        rotation_velocity = self.random.choice([-1, 1]) * self.random.random() * 0.05
         # generate a random acceleration
-        acceleration = random.random() / 5
+        acceleration = self.random.random() / 5
         # create a new rock
-        rock = Rock((90, 90), position, velocity, 0, rotation_velocity)
+        rock = self.rock_factory(ROCK_TYPES[0][0], position, velocity, 0, rotation_velocity)
         rock.set_acceleration(acceleration)
         return rock
     def handle_keyup(self, key_event):
@@ -394,47 +2087,136 @@ class AsteroidsGame(Game):
         # continue if the game has started
         if self.started is True:
             self.player.onkeydown(key_event)
-    def check_collisions(self, timer_event):
+    def check_collisions(self, update_event):
         # continue if the game has started
         if self.started is True:
+            start_time = self.profiler.start()
             # iterates through all rocks and checks if
             # it collides with other objects
             if self.rocks.exists():
+                bounds = self.get_size()
+                # rebuild the broad-phase grid with the spaceships and the missles of every ship
+                self.collision_grid.clear()
+                for ship in self.ships:
+                    self.collision_grid.insert(ship)
+                    for missle in ship.get_missles().get_all():
+                        # expired missles are retired at the end of the step
+                        if not missle.is_expired():
+                            self.collision_grid.insert(missle)
                 for rock in self.rocks.get_all():
-                    # if collides with the player's spaceship
-                    if rock.collide(self.player):
+                    # checks the objects sharing a grid cell (spaceships before missles)
+                    collided_ship = False
+                    collided_missle = False
+                    for object in self.collision_grid.query(rock.get_position(), rock.get_radius()):
+                        if rock.collide(object, bounds):
+                            if isinstance(object, Missle):
+                                if collided_missle is False:
+                                    collided_missle = object
+                            else:
+                                collided_ship = object
+                                break
+                    if collided_ship is not False:
                         # removes the rock from the rock group
                         self.rocks.remove(rock)
+                        self.director.record_cull()
                         # create an explosion
                         self.create_explosion(rock.get_position())
                         # lose a life
                         self.score.decrease_lives()
                         # create a game event
                         game_event = GameEvent(self.score)
-                        dispatcher.run('game_event', game_event)
-                    # if collides with any missles
-                    collided_missle = rock.collide_group(self.player.get_missles())
+                        self.dispatcher.run('game_event', game_event)
+                        # the rock is gone
+                        continue
                     if collided_missle is not False:
                         # removes the rock from the rock group
                         self.rocks.remove(rock)
+                        self.director.record_cull()
                         # create an explosion
                         self.create_explosion(rock.get_position())
-                        # removes the missle
-                        self.player.get_missles().remove(collided_missle)
+                        # splits the rock into smaller ones
+                        self.split_rock(rock)
+                        # removes the missle from its ship's group
+                        collided_missle.owner.get_missles().remove(collided_missle)
+                        self.collision_grid.remove(collided_missle)
                         # increment the score
                         self.score.increment_score()
                         # create a game event
                         game_event = GameEvent(self.score)
-                        dispatcher.run('game_event', game_event)
+                        self.dispatcher.run('game_event', game_event)
+            self.profiler.stop('check_collisions', start_time)
+    def split_rock(self, rock):
+        """
+        Queues the fragments of a shot rock: they inherit its velocity and
+        move apart at FRAGMENT_SPEED in evenly spread directions
+        """
+        count = rock.get_fragment_count()
+        if count == 0:
+            return
+        size = ROCK_TYPES[rock.get_level() + 1][0]
+        position = rock.get_position()
+        velocity = rock.get_velocity()
+        angle = self.random.random() * 2 * math.pi
+        for i in range(count):
+            if not self.can_spawn():
+                self.director.record_drop(count - i)
+                return
+            direction = angle + i * 2 * math.pi / count
+            fragment_velocity = (velocity[0] + math.cos(direction) * FRAGMENT_SPEED, velocity[1] + math.sin(direction) * FRAGMENT_SPEED)
+            rotation_velocity = self.random.choice([-1, 1]) * self.random.random() * 0.05
+            self.queue_spawn(self.rocks, self.rock_factory(size, position, fragment_velocity, rock.get_rotation(), rotation_velocity))
+            self.director.fragments += 1
+    def count_entities(self):
+        """
+        Returns the number of rocks, missles and explosions alive or queued
+        """
+        count = self.rocks.count() + self.explosions.count() + len(self.spawn_queue)
+        for ship in self.ships:
+            count += ship.get_missles().count()
+        return count
+    def can_spawn(self):
+        """
+        Returns whether another entity fits in the entity budget
+        """
+        return self.entity_budget is None or self.count_entities() < self.entity_budget
+    def set_entity_budget(self, entity_budget):
+        self.entity_budget = entity_budget
+    def queue_spawn(self, group, sprite):
+        """
+        Adds the sprite to the group at the end of the step (not during the group's iteration)
+        """
+        self.spawn_queue.append((group, sprite))
+    def get_queued_count(self, group):
+        count = 0
+        for queued_group, sprite in self.spawn_queue:
+            if queued_group is group:
+                count += 1
+        return count
+    def flush(self):
+        Game.flush(self)
+        # spawns the queued sprites, into the slots freed during the step
+        if len(self.spawn_queue) > 0:
+            spawn_queue = self.spawn_queue
+            self.spawn_queue = []
+            for group, sprite in spawn_queue:
+                group.add(sprite)
     def create_explosion(self, position):
-        # create a new explosion
-        explosion = Explosion((128, 128), position)
-        self.explosions.add(explosion)
+        # explosions past the entity budget are skipped
+        if not self.can_spawn():
+            self.director.record_drop()
+            return
+        # create a new explosion (or reuse a finished one), shown from the end of the step
+        explosion = self.explosion_pool.acquire((128, 128), position)
+        explosion.on_spawn()
+        self.queue_spawn(self.explosions, explosion)
     def create_score(self, lives):
         score = Score(lives)
-        dispatcher.add('draw', score.draw)
+        self.dispatcher.add('draw', score.draw)
         return score
     def start_game(self, click_event):
+        # waits for the assets
+        if not self.assets.poll():
+            return
         # if not yet started
         if self.started is False:
             # reset the lives
@@ -449,42 +2231,74 @@ class AsteroidsGame(Game):
             # resets the game
             self.reset()
     def reset(self):
+        # drops the queued spawns
+        for group, sprite in self.spawn_queue:
+            if group.pool is not None:
+                group.pool.release(sprite)
+        self.spawn_queue = []
         # clears all existing rocks
         self.rocks.clear()
         # clears all missles
-        self.player.get_missles().clear()
-        # reset the player's position
-        self.player.reset()
+        for ship in self.ships:
+            ship.get_missles().clear()
+        # clears all explosions
+        self.explosions.clear()
+        # reset the spaceships' positions
+        for ship in self.ships:
+            ship.reset()
         # recreate the score board
         self.score.reset()
+        # starts the waves over
+        self.director.reset()
         # display the splash
         self.splash.show()
         # ends the game
         self.started = False
-    def draw(self, canvas):
-        # calls parent method
-        Game.draw(self, canvas)
+    def update(self, update_event):
+        # continue updating if started
+        if self.started is True:
+            start_time = self.profiler.start()
+            # update the spaceships
+            for ship in self.ships:
+                ship.update(update_event)
+            # update rocks
+            if self.rock_stepper is not None:
+                self.rock_stepper.update(update_event)
+            elif self.rocks.exists():
+                for rock in self.rocks.get_all():
+                    rock.update(update_event)
+            # update missles
+            for ship in self.ships:
+                if ship.get_missles().exists():
+                    for missle in ship.get_missles().get_all():
+                        missle.update(update_event)
+            # update explosions
+            if self.explosions.exists():
+                for explosion in self.explosions.get_all():
+                    explosion.update(update_event)
+            self.profiler.stop('sprite_update', start_time)
+    def render(self, draw_event):
         # continue drawing if started
         if self.started is True:
-            # create a draw event
-            draw_event = DrawEvent(canvas, self.get_frame())
+            start_time = self.profiler.start()
+            draw_event.canvas.set_layer(LAYER_SPRITES)
             # draw rocks
             if self.rocks.exists():
                 for rock in self.rocks.get_all():
                     rock.draw(draw_event)
             # draw missles
-            if self.player.get_missles().exists():
-                for missle in self.player.get_missles().get_all():
-                    # if missle is expired
-                    if missle.is_expired():
-                        # remove from the missle gorup
-                        self.player.get_missles().remove(missle)
-                    else:
+            for ship in self.ships:
+                if ship.get_missles().exists():
+                    for missle in ship.get_missles().get_all():
                         missle.draw(draw_event)
-            # draw explosions
+            # draw explosions (the youngest ones when capped, slots don't follow spawn order)
             if self.explosions.exists():
-                for explosion in self.explosions.get_all():
+                explosions = self.explosions.get_all()
+                if self.max_explosions is not None and self.explosions.count() > self.max_explosions:
+                    explosions = sorted(explosions, key = lambda explosion: explosion.age)[:self.max_explosions]
+                for explosion in explosions:
                     explosion.draw(draw_event)
+            self.profiler.stop('draw_sprites', start_time)
 
 class SplashScreen:
     def __init__(self, size, position):
@@ -493,13 +2307,13 @@ class SplashScreen:
         self.size = size
         # sets the position of the splash screen
         self.position = position
+        # the asset loader whose progress is shown
+        self.loader = None
         # loads the image
-        self.image = Image('https://www.dropbox.com/s/6qfewgjyf8k3gag/splash.png?dl=1', (400, 300))
+        self.image = Image(SPLASH_IMAGE, (400, 300))
         # loads the sound
-        self.sound = Sound('https://www.dropbox.com/s/7jjgyyz16gubjl4/soundtrack.mp3?dl=1')
+        self.sound = Sound(SOUNDTRACK_SOUND)
         self.sound.play()
-        # registers the draw handler
-        dispatcher.add('draw', self.draw)
     def set_size(self, size):
         self.size = size
     def get_size(self):
@@ -508,6 +2322,8 @@ class SplashScreen:
         self.position = position
     def get_position(self):
         return self.position
+    def set_loader(self, loader):
+        self.loader = loader
     def show(self):
         self.sound.rewind()
         self.sound.play()
@@ -517,8 +2333,14 @@ class SplashScreen:
     def draw(self, draw_event):
         # draw only if not hidden
         if self.hidden is False:
+            draw_event.canvas.set_layer(LAYER_SPLASH)
             # draws the background into the canvas
             self.image.draw_at(draw_event.canvas, self.get_position(), self.get_size())
+            # shows the loading progress
+            if self.loader is not None and not self.loader.poll():
+                text = 'Loading ' + str(int(self.loader.get_progress() * 100)) + '%'
+                position = self.get_position()
+                draw_event.canvas.draw_text(text, (position[0] - 50, position[1] + self.size[1] / 2 + 30), 24, 'white')
 
 class Space:
     def __init__(self, size):
@@ -530,46 +2352,56 @@ class Space:
         # sets the size of the background
         self.size = size
         # loads the image
-        self.image = Image('https://www.dropbox.com/s/gkz1ng5b5f911tk/nebula_blue.f2014.png?dl=1', (800, 600))
-        # registers the draw handler
-        dispatcher.add('draw', self.draw)
+        self.image = Image(NEBULA_IMAGE, (800, 600))
     def set_size(self, size):
         self.size = size
     def get_size(self):
         return self.size
     def draw(self, draw_event):
         size = self.get_size()
+        draw_event.canvas.set_layer(LAYER_SPACE)
         # calculate the center destination
         center_dest = (size[0] / 2, size[1] / 2)
         # draws the background into the canvas
         self.image.draw_at(draw_event.canvas, center_dest, self.size)
 
 class Debris:
-    def __init__(self, size, timer):
+    def __init__(self, size, speed = DEBRIS_SPEED):
         """
-        Creates the debris animation
+        Creates the debris animation, scrolling with the simulation time
 
         <tuple> size        The size of the window
-        <Timer> timer       The timer instance
+        <float> speed       The scrolling speed (in px per ms)
         """
         self.size = size
-        self.timer = timer
+        self.speed = speed
+        self.hidden = False
         # loads the image
-        self.image = Image('https://www.dropbox.com/s/xcygcu51maw8bam/debris2_blue.png?dl=1', (640, 480))
-        dispatcher.add('draw', self.draw)
+        self.image = Image(DEBRIS_IMAGE, (640, 480))
     def set_size(self, size):
         self.size = size
     def get_size(self):
         return self.size
     def draw(self, draw_event):
+        # skipped on lower quality tiers
+        if self.hidden is True:
+            return
         size = self.get_size()
-        # calc the center destination
-        delta = (self.timer.get_time() / 50) % size[0]
-        center_dest1 = (delta - size[0] / 2, size[1] / 2)
-        center_dest2 = (delta + size[0] / 2, size[1] / 2)
-        # draws the background into the canvas
-        self.image.draw_at(draw_event.canvas, center_dest1, size)
-        self.image.draw_at(draw_event.canvas, center_dest2, size)
+        draw_event.canvas.set_layer(LAYER_DEBRIS)
+        # the debris scrolls right, wrapping around: the screen shows the end
+        # of the image left of delta and its beginning right of it
+        delta = (draw_event.time * self.speed) % size[0]
+        image_size = self.image.get_size()
+        scale = image_size[0] / float(size[0])
+        # draws only the visible part of each copy (a single blit when aligned)
+        if delta >= 1:
+            source_width = delta * scale
+            center_source = (image_size[0] - source_width / 2, image_size[1] / 2)
+            draw_event.canvas.draw_image(self.image.get_image(), center_source, (source_width, image_size[1]), (delta / 2, size[1] / 2), (delta, size[1]))
+        if size[0] - delta >= 1:
+            source_width = (size[0] - delta) * scale
+            center_source = (source_width / 2, image_size[1] / 2)
+            draw_event.canvas.draw_image(self.image.get_image(), center_source, (source_width, image_size[1]), ((delta + size[0]) / 2, size[1] / 2), (size[0] - delta, size[1]))
 
 class Sprite:
     def __init__(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = 0, animated = False):
@@ -593,6 +2425,9 @@ class Sprite:
         self.set_initial_position(position)
         # sets the new position
         self.set_position(position)
+        # sets the position and rotation of the previous simulation step (for interpolation)
+        self.previous_position = position
+        self.previous_rotation = rotation
         # sets the initial velocity
         self.set_velocity(velocity)
         # set the rotation direction flag (enum: None, "left', or "right")
@@ -611,6 +2446,10 @@ class Sprite:
         self.animated = animated
         # sets the initial accelerating flag
         self.accelerating = False
+        # the shared resources of the sprite type (set by subclasses)
+        self.definition = None
+        # the AnimationClip played when animated (set by subclasses)
+        self.clip = None
     def set_size(self, size):
         self.size = size
     def get_size(self):
@@ -702,6 +2541,16 @@ class Sprite:
         return self.accelerating
     def is_expired(self):
         return self.lifetime > 0 and self.age > self.lifetime
+    def on_spawn(self):
+        """
+        Called when the game spawns the sprite (not when it is restored)
+        """
+        pass
+    def on_expire(self):
+        """
+        Called when the expired sprite is retired from its group
+        """
+        pass
     def get_distance(self, a, b):
         """
         Calculates the distance between 2 points
@@ -709,33 +2558,83 @@ class Sprite:
         dx = float(b[0]) - a[0]
         dy = float(b[1]) - a[1]
         return math.hypot(dx, dy)
-    def collide(self, object):
+    def collide(self, object, bounds = None):
+        """
+        Checks if the object overlaps this sprite. When the screen bounds are
+        given, distances are measured across the screen edges (the screen wraps).
+        """
         position = self.get_position()
-        radius = self.get_radius()
         obj_position = object.get_position()
-        obj_radius = object.get_radius()
         # calculate the distance between the 2 objects
-        dist = self.get_distance(position, obj_position)
-        radius_sum = radius + obj_radius
-        if dist <= radius_sum:
+        dx = obj_position[0] - position[0]
+        dy = obj_position[1] - position[1]
+        if bounds is not None:
+            dx = wrap_delta(dx, bounds[0])
+            dy = wrap_delta(dy, bounds[1])
+        # compares the squared distances (no sqrt needed)
+        radius_sum = self.get_radius() + object.get_radius()
+        if dx * dx + dy * dy <= radius_sum * radius_sum:
             return True
         return False
-    def collide_group(self, group):
+    def collide_group(self, group, bounds = None):
         # checks if the current object collides with the given group of objects
         # returns the first object it has collided with
         # otherwise, returns False
         for object in group.get_all():
-            if self.collide(object):
+            if self.collide(object, bounds):
                 return object
         return False
-    def update(self, draw_event):
+    def reinitialize(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = 0):
+        """
+        Resets the per-instance state so a pooled sprite can be reused
+        (same arguments as the constructor, the image and sound are kept)
+        """
+        self.size = size
+        self.position = position
+        self.previous_position = position
+        self.velocity = velocity
+        self.rotation = rotation
+        self.previous_rotation = rotation
+        self.rotation_velocity = rotation_velocity
+        self.rotation_dir = None
+        self.age = 0
+        self.lifetime = lifetime
+        self.accelerating = False
+    def get_interpolated_position(self, alpha):
+        """
+        Blends the previous and current positions by alpha (0 to 1).
+        Jumps larger than the sprite (wrapping around the screen) are not blended.
+        """
+        position = self.get_position()
+        if alpha >= 1:
+            return position
+        dx = position[0] - self.previous_position[0]
+        dy = position[1] - self.previous_position[1]
+        if abs(dx) > self.size[0] or abs(dy) > self.size[1]:
+            return position
+        return (self.previous_position[0] + dx * alpha, self.previous_position[1] + dy * alpha)
+    def get_interpolated_rotation(self, alpha):
+        """
+        Blends the previous and current rotations by alpha (0 to 1)
+        """
+        rotation = self.get_rotation()
+        if alpha >= 1:
+            return rotation
+        return self.previous_rotation + (rotation - self.previous_rotation) * alpha
+    def update(self, update_event):
         """
-        Updates the position of the current sprite based on the the velocity and rotation.
+        Advances the sprite by one simulation step. Updates the position of
+        the current sprite based on the the velocity and rotation.
         """
+        # increment age
+        self.age += 1
+        # keeps the previous state for interpolation
+        self.previous_position = self.get_position()
+        self.previous_rotation = self.get_rotation()
         # applies the rotation velocity to the rotation
         self.apply_rotation(self.get_rotation_velocity())
         # applies the current velocity vector
-        self.apply_velocity(self.get_velocity(), draw_event.frame.get_size())
+        self.apply_velocity(self.get_velocity(), update_event.size)
         # if currently accelerating
         if self.is_accelerating():
             # retrieve the forward vector
@@ -746,56 +2645,270 @@ class Sprite:
             self.apply_forward_vector(forward_vector, acceleration)
         # applies the friction constant
         self.apply_friction(self.get_friction())
+    def get_frame(self):
+        """
+        Returns the frame drawn when no clip is played (animated sprites play a frame per step)
+        """
+        if self.animated:
+            return self.age
+        return 0
+    def get_animation_time(self, draw_event):
+        """
+        Returns the time (in ms) the sprite has lived at the frame drawn
+        """
+        return max(self.age - 1 + draw_event.alpha, 0) * draw_event.step_size
     def draw(self, draw_event):
         """
-        Draws the spaceship into the canvas
+        Draws the sprite into the canvas (rendering only, the simulation runs in update)
         """
-        # increment age
-        self.age += 1
-        # flag to draw or not
-        should_draw = True
         # if expired, don't draw
-        if self.is_expired():
-            should_draw = False
-        if should_draw:
-            # updates the positions, and rotations
-            self.update(draw_event)
+        if not self.is_expired():
+            position = self.get_interpolated_position(draw_event.alpha)
+            rotation = self.get_interpolated_rotation(draw_event.alpha)
+            if self.animated and self.clip is not None:
+                frame = self.clip.get_frame(self.get_animation_time(draw_event))
+            else:
+                frame = self.get_frame()
             # draws the sprite into the canvas
-            if self.animated:
-                self.image.draw_animated_at(draw_event.canvas, self.get_position(), self.get_size(), self.get_rotation(), self.age)
+            self.definition.draw(draw_event.canvas, frame, position, self.get_size(), rotation)
+
+class SpatialHash:
+    def __init__(self, size, cell_size):
+        """
+        Creates a uniform grid over the (wrapping) screen for broad-phase
+        collision checks. Objects are stored in every cell their bounding
+        box overlaps, and cells wrap around the screen edges.
+
+        <tuple> size        The size of the screen
+        <int> cell_size     The preferred size of a cell
+        """
+        self.size = size
+        # fits a whole number of cells so the grid wraps like the screen
+        self.columns = max(1, int(size[0] // cell_size))
+        self.rows = max(1, int(size[1] // cell_size))
+        self.cell_width = float(size[0]) / self.columns
+        self.cell_height = float(size[1]) / self.rows
+        self.cells = {}
+        self.object_cells = {}
+    def get_cells(self, position, radius):
+        """
+        Returns the keys of every cell overlapped by the circle's bounding box
+        """
+        first_column = int(math.floor((position[0] - radius) / self.cell_width))
+        last_column = int(math.floor((position[0] + radius) / self.cell_width))
+        first_row = int(math.floor((position[1] - radius) / self.cell_height))
+        last_row = int(math.floor((position[1] + radius) / self.cell_height))
+        # objects larger than the screen cover every cell
+        if last_column - first_column >= self.columns:
+            first_column, last_column = 0, self.columns - 1
+        if last_row - first_row >= self.rows:
+            first_row, last_row = 0, self.rows - 1
+        keys = []
+        for row in range(first_row, last_row + 1):
+            offset = (row % self.rows) * self.columns
+            for column in range(first_column, last_column + 1):
+                keys.append(offset + (column % self.columns))
+        return keys
+    def clear(self):
+        self.cells = {}
+        self.object_cells = {}
+    def insert(self, object):
+        keys = self.get_cells(object.get_position(), object.get_radius())
+        for key in keys:
+            if key in self.cells:
+                self.cells[key].append(object)
             else:
-                self.image.draw_at(draw_event.canvas, self.get_position(), self.get_size(), self.get_rotation())
+                self.cells[key] = [object]
+        self.object_cells[object] = keys
+    def remove(self, object):
+        if object in self.object_cells:
+            for key in self.object_cells.pop(object):
+                self.cells[key].remove(object)
+    def query(self, position, radius):
+        """
+        Returns the objects sharing a cell with the circle, in insertion order
+        """
+        found = []
+        cells = self.cells
+        for key in self.get_cells(position, radius):
+            objects = cells.get(key)
+            if objects is not None:
+                for object in objects:
+                    # only a few objects share the cells of a circle
+                    if object not in found:
+                        found.append(object)
+        return found
+    def count(self):
+        return len(self.object_cells)
 
 class Group:
-    def __init__(self, objects = set(), max_count = None):
-        self.objects = objects
+    def __init__(self, objects = None, max_count = None, pool = None):
+        """
+        Creates a new container of objects. Each object is stored in a slot,
+        removed slots are reused by later adds.
+
+        Removing is constant time and safe while iterating: the object is
+        skipped right away, but its slot is only released by flush() (called
+        once at the end of each simulation step).
+
+        <iterable> objects      The initial objects
+        <int> max_count         The maximum number of objects (None for no limit)
+        <Pool> pool             The pool removed objects are released to
+        """
+        # objects by slot (None for an empty slot)
+        self.slots = []
+        # slot of each object
+        self.slot_index = {}
+        # empty slots ready for reuse
+        self.free_slots = []
+        # slots emptied since the last flush
+        self.pending_slots = []
+        # objects removed since the last flush (released to the pool)
+        self.pending_objects = []
+        self.pool = pool
+        # number of expired objects retired by reap()
+        self.reaped = 0
+        self.name = None
         self.set_max_count(max_count)
+        if objects is not None:
+            for object in objects:
+                self.add(object)
+    def set_name(self, name):
+        self.name = name
     def set_max_count(self, max_count):
         self.max_count = max_count
     def add(self, object):
+        """
+        Adds the object, returns False if the max count has been reached
+        """
+        if object in self.slot_index:
+            return True
         # add only if hasn't reached the max count
-        if self.max_count is not None:
-            if len(self.objects) < self.max_count:
-                self.objects.add(object)
+        if self.max_count is not None and len(self.slot_index) >= self.max_count:
+            return False
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+            self.slots[slot] = object
         else:
-            self.objects.add(object)
+            slot = len(self.slots)
+            self.slots.append(object)
+        self.slot_index[object] = slot
+        return True
     def remove(self, object):
-        # make a new set
-        new_set = set()
-        # iterate through current objects and add ones that are not removed
-        for o in self.objects:
-            if o != object:
-                new_set.add(o)
-        # override with the new set
-        self.objects = new_set
+        slot = self.slot_index.pop(object, None)
+        if slot is not None:
+            self.slots[slot] = None
+            # the slot is released at the end of the step
+            self.pending_slots.append(slot)
+            if self.pool is not None:
+                self.pending_objects.append(object)
+    def reap(self):
+        """
+        Removes the expired objects, calling their on_expire() hook
+        """
+        for object in self.get_all():
+            if object.is_expired():
+                self.remove(object)
+                object.on_expire()
+                self.reaped += 1
+    def flush(self):
+        """
+        Releases the slots (and pooled objects) removed since the last flush
+        """
+        if len(self.pending_slots) > 0:
+            self.free_slots.extend(self.pending_slots)
+            self.pending_slots = []
+        if len(self.pending_objects) > 0:
+            for object in self.pending_objects:
+                self.pool.release(object)
+            self.pending_objects = []
+    def has(self, object):
+        return object in self.slot_index
     def clear(self):
-        self.objects = set()
+        # returns every object to the pool
+        if self.pool is not None:
+            for object in self.pending_objects:
+                self.pool.release(object)
+            for object in self.slot_index:
+                self.pool.release(object)
+            self.pending_objects = []
+        # empties the slots in place so running iterations stop
+        del self.slots[:]
+        self.slot_index = {}
+        self.free_slots = []
+        self.pending_slots = []
     def exists(self):
-        return len(self.objects)
+        return len(self.slot_index)
     def count(self):
-        return len(self.objects)
+        return len(self.slot_index)
     def get_all(self):
-        return self.objects
+        """
+        Iterates the objects in slot order. Objects removed during the
+        iteration are skipped. Objects added during the iteration are not
+        visited when appended past the last slot, but are when they reuse a
+        free slot ahead of the iteration (so add between iterations, e.g.
+        through AsteroidsGame.queue_spawn).
+        """
+        slots = self.slots
+        size = len(slots)
+        i = 0
+        while i < size and i < len(slots):
+            object = slots[i]
+            if object is not None:
+                yield object
+            i += 1
+
+class Pool:
+    def __init__(self, factory, max_size = None):
+        """
+        Recycles short-lived objects. acquire() reinitializes a released
+        object when one is available, otherwise creates a new one.
+
+        <callable> factory      Creates a new object (called with the acquire arguments)
+        <int> max_size          The maximum number of released objects kept (None for no limit)
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.free = []
+        # stats
+        self.active = 0
+        self.high_water = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+    def set_max_size(self, max_size):
+        self.max_size = max_size
+        # drops the released objects over the new size
+        if max_size is not None and len(self.free) > max_size:
+            self.discarded += len(self.free) - max_size
+            del self.free[max_size:]
+    def acquire(self, *args):
+        if len(self.free) > 0:
+            object = self.free.pop()
+            object.reinitialize(*args)
+            self.reused += 1
+        else:
+            object = self.factory(*args)
+            self.created += 1
+        self.active += 1
+        if self.active > self.high_water:
+            self.high_water = self.active
+        return object
+    def release(self, object):
+        self.active -= 1
+        if self.max_size is None or len(self.free) < self.max_size:
+            self.free.append(object)
+        else:
+            self.discarded += 1
+    def get_stats(self):
+        return {
+            'active': self.active,
+            'free': len(self.free),
+            'high_water': self.high_water,
+            'created': self.created,
+            'reused': self.reused,
+            'discarded': self.discarded
+        }
 
 class Rock(Sprite):
     def __init__(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0):
@@ -804,10 +2917,31 @@ class Rock(Sprite):
         """
         # calls parent method
         Sprite.__init__(self, size, position, velocity, rotation, rotation_velocity)
+        # sets the level and radius from the size
+        self.set_size(size)
         # clears friction
         self.set_friction(0)
-        # loads the image
-        self.image = Image('https://www.dropbox.com/s/ackzcnknlaz56f0/asteroid_blue.png?dl=1', self.size, self.center)
+        # shares the rock resources
+        self.definition = get_sprite_definition('rock')
+    def set_size(self, size):
+        self.size = size
+        # the level in ROCK_TYPES (unlisted sizes don't split)
+        self.level = get_rock_level(size)
+        if self.level is None:
+            self.radius = size[0] / 2
+        else:
+            self.radius = ROCK_TYPES[self.level][1]
+    def get_level(self):
+        return self.level
+    def get_radius(self):
+        return self.radius
+    def get_fragment_count(self):
+        """
+        Returns the number of smaller rocks the rock splits into when shot
+        """
+        if self.level is None or self.level + 1 >= len(ROCK_TYPES):
+            return 0
+        return ROCK_TYPES[self.level][2]
 
 class Missle(Sprite):
     def __init__(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = 100):
@@ -816,41 +2950,68 @@ class Missle(Sprite):
         """
         # calls parent method
         Sprite.__init__(self, size, position, velocity, rotation, rotation_velocity, lifetime)
+        # the spaceship that shot the missle
+        self.owner = None
         # clears friction
         self.set_friction(0)
-        # loads the image
-        self.image = Image('https://www.dropbox.com/s/9fbouyq1q1j2gcj/shot2.png?dl=1', self.size, self.center)
-        # loads the sound
-        self.sound = Sound('https://www.dropbox.com/s/h0s1tbm70nd8gc1/missile.mp3?dl=1')
-        # plays the sound
-        self.sound.play()
+        # shares the missle resources
+        self.definition = get_sprite_definition('missle')
+    def reinitialize(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = 100):
+        # calls parent method
+        Sprite.reinitialize(self, size, position, velocity, rotation, rotation_velocity, lifetime)
+    def on_spawn(self):
+        # plays the sound from the start
+        self.definition.sound.rewind()
+        self.definition.sound.play()
 
 class Explosion(Sprite):
-    def __init__(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = 24, animated = True):
+    def __init__(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = None, animated = True):
+        clip = get_animation_clip('explosion')
+        # lives until its clip has played once
+        if lifetime is None:
+            lifetime = clip.get_lifetime()
         # calls parent method
         Sprite.__init__(self, size, position, velocity, rotation, rotation_velocity, lifetime, animated)
-        # loads the image
-        self.image = Image('https://www.dropbox.com/s/v3m6oa9u31pbujb/explosion_alpha.png?dl=1', self.size, self.center)
-        # loads the sound
-        self.sound = Sound('https://www.dropbox.com/s/um0ef23cormfr0w/explosion.mp3?dl=1')
-        self.sound.play()
+        # shares the explosion resources
+        self.definition = get_sprite_definition('explosion')
+        self.clip = clip
+    def reinitialize(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0, lifetime = None):
+        if lifetime is None:
+            lifetime = self.clip.get_lifetime()
+        # calls parent method
+        Sprite.reinitialize(self, size, position, velocity, rotation, rotation_velocity, lifetime)
+    def on_spawn(self):
+        # plays the sound from the start
+        self.definition.sound.rewind()
+        self.definition.sound.play()
 
 class Spaceship(Sprite):
     def __init__(self, size, position, velocity = (0, 0), rotation = 0, rotation_velocity = 0):
         # calls parent method
         Sprite.__init__(self, size, position, velocity, rotation, rotation_velocity)
-        # load the image
-        self.image = Image('https://www.dropbox.com/s/y2oopsybnllxl3c/double_ship.png?dl=1', self.get_size(), self.get_rest_center())
-        # load the sound
-        self.sound = Sound('https://www.dropbox.com/s/mmk6t1kzsbz4pju/thrust.mp3?dl=1')
-        # create a new group to hold missles
-        self.missles = Group()
-        # register events
-        dispatcher.add('draw', self.draw)
-    def get_rest_center(self):
-        return (45, 45)
-    def get_thrust_center(self):
-        return (135, 45)
+        # shares the spaceship resources
+        self.definition = get_sprite_definition('spaceship')
+        # create a new group to hold missles (expired ones are recycled)
+        self.missle_pool = Pool(Missle, MISSLE_POOL_SIZE)
+        self.missles = Group(None, None, self.missle_pool)
+        # the game whose entity budget the missles count against (None for no limit)
+        self.world = None
+    def get_key_map(self):
+        """
+        Returns the key codes of the world's backend (the current one outside a world)
+        """
+        if self.world is not None:
+            return self.world.backend.get_key_map()
+        return get_backend().get_key_map()
+    def get_frame(self):
+        # thrusting frame while accelerating
+        if self.accelerating:
+            return 1
+        return 0
+    def draw(self, draw_event):
+        # spaceships are drawn by their own draw handler
+        draw_event.canvas.set_layer(LAYER_SPRITES)
+        Sprite.draw(self, draw_event)
     def rotate(self, direction):
         self.set_rotation_dir(direction)
     def rotate_left(self):
@@ -861,17 +3022,18 @@ class Spaceship(Sprite):
         self.set_rotation_dir(None)
     def thrust_start(self):
         self.accelerating = True
-        self.image.set_center(self.get_thrust_center())
         # play sound
-        self.sound.rewind()
-        self.sound.play()
+        self.definition.sound.rewind()
+        self.definition.sound.play()
     def thrust_stop(self):
         self.accelerating = False
-        self.image.set_center(self.get_rest_center())
         # stop sound
-        if self.sound:
-            self.sound.pause()
+        self.definition.sound.pause()
     def shoot_start(self):
+        # shots past the entity budget are refused
+        if self.world is not None and not self.world.can_spawn():
+            self.world.director.record_drop()
+            return
         size = (10, 10)
         position = self.get_position()
         velocity = self.get_velocity()
@@ -884,99 +3046,138 @@ class Spaceship(Sprite):
         missle_acceleration = 5
         # calculate the missle velocity
         missle_velocity = (velocity[0] + missle_acceleration * forward_vector[0], velocity[1] + missle_acceleration * forward_vector[1])
-        # create a new missle
-        missle = Missle(size, missle_position, missle_velocity, rotation, 0)
+        # create a new missle (or reuse an expired one)
+        missle = self.missle_pool.acquire(size, missle_position, missle_velocity, rotation, 0)
+        missle.owner = self
+        missle.on_spawn()
         # add to missles group
         self.missles.add(missle)
     def get_missles(self):
         return self.missles
-    def update(self, draw_event):
+    def update(self, update_event):
         # if currently rotating
         if self.get_rotation_dir() is "left":
             self.rotate_left()
         elif self.get_rotation_dir() is "right":
             self.rotate_right()
         # calls the parent method
-        Sprite.update(self, draw_event)
+        Sprite.update(self, update_event)
 
 class PlayerSpaceship(Spaceship):
     def reset(self):
         self.set_position(self.get_initial_position())
+        self.previous_position = self.get_initial_position()
+        self.previous_rotation = 0
         self.set_velocity((0, 0))
         self.set_rotation(0)
         self.rotate_end()
         self.thrust_stop()
     def onkeyup(self, key_event):
-        if key_event.key is simplegui.KEY_MAP['left']: # left
+        key_map = self.get_key_map()
+        if key_event.key is key_map['left']: # left
             # stops rotating
             self.rotate_end()
-        elif key_event.key is simplegui.KEY_MAP['right']: # right
+        elif key_event.key is key_map['right']: # right
             # stops rotating
             self.rotate_end()
-        elif key_event.key is simplegui.KEY_MAP['up']: # up
+        elif key_event.key is key_map['up']: # up
             self.thrust_stop()
     def onkeydown(self, key_event):
-        if key_event.key is simplegui.KEY_MAP['left']: # left
+        key_map = self.get_key_map()
+        if key_event.key is key_map['left']: # left
             # begins rotating left
             self.rotate('left')
-        elif key_event.key is simplegui.KEY_MAP['right']: # right
+        elif key_event.key is key_map['right']: # right
             # begins rotating right
             self.rotate('right')
-        elif key_event.key is simplegui.KEY_MAP['up']: # up
+        elif key_event.key is key_map['up']: # up
             # begins thrusting
             self.thrust_start()
-        elif key_event.key is simplegui.KEY_MAP['space']: # space
+        elif key_event.key is key_map['space']: # space
             # begins shooting!
             self.shoot_start()
 
 
-# creates a new dispatcher instance
-dispatcher = Dispatcher()
-
-# creates a new game
-game = AsteroidsGame(WINDOW_SIZE, NUM_LIVES, MAX_ROCK_COUNT)
-game.start()
-
-
-
-
 # DEBUGGING
 class Debugger:
     def __init__(self, game):
         self.game = game
-        dispatcher.add('draw', self.draw)
+        # retained labels, from left to right
+        self.labels = [
+            HudLabel('Position: ', '%0.2f, %0.2f', 12),
+            HudLabel('Velocity: ', '%0.2f, %0.2f', 12),
+            HudLabel('Rotation: ', '%0.2f', 12),
+            HudLabel('Rotation Vector: ', '%0.2f, %0.2f', 12),
+            HudLabel('Missle Velocity: ', '%0.2f, %0.2f', 12)
+        ]
+        self.positions = None
+        self.layout_height = None
+        # frames between refreshes of the values (set by the quality tier)
+        self.refresh_interval = 1
+        self.frames_since_refresh = 0
+        game.dispatcher.add('draw', self.draw)
+        game.dispatcher.add('quality', self.apply_quality)
+    def apply_quality(self, quality_event):
+        self.refresh_interval = quality_event.settings['hud_interval']
+    def layout(self, draw_event):
+        """
+        Lays the labels out again if any of them changed, the labels are
+        50px apart on the bottom of the frame
+        """
+        changed = False
+        for label in self.labels:
+            if label.layout(draw_event.frame.get()):
+                changed = True
+        if changed or self.layout_height != draw_event.frame.get_height():
+            self.layout_height = draw_event.frame.get_height()
+            position = (15, self.layout_height - 15)
+            self.positions = []
+            for label in self.labels:
+                self.positions.append(position)
+                position = (position[0] + label.get_width() + 50, position[1])
     def draw(self, draw_event):
-        # position
-        pos = self.game.player.get_position()
-        pos_text = "Position: %0.2f, %0.2f" % (pos[0], pos[1])
-        pos_text_width = draw_event.frame.get().get_canvas_textwidth(pos_text, 12)
-        pos_position = (15, draw_event.frame.get_height() - 15)
-        draw_event.canvas.draw_text(pos_text, pos_position, 12, 'white')
-        # velocity
-        vel = self.game.player.get_velocity()
-        vel_text = 'Velocity: %0.2f, %0.2f' % (vel[0], vel[1])
-        vel_text_width = draw_event.frame.get().get_canvas_textwidth(vel_text, 12)
-        vel_position = (pos_position[0] + pos_text_width + 50, pos_position[1])
-        draw_event.canvas.draw_text(vel_text, vel_position, 12, 'white')
-        # rotation/angle
-        rotation = self.game.player.get_rotation()
-        rotation_text = 'Rotation: %0.2f' % rotation
-        rotation_text_width = draw_event.frame.get().get_canvas_textwidth(rotation_text, 12)
-        rotation_position = (vel_position[0] + vel_text_width + 50, pos_position[1])
-        draw_event.canvas.draw_text(rotation_text, rotation_position, 12, 'white')
-        # rotation/angle velocity
-        rotation_velocity = self.game.player.get_forward_vector()
-        rotation_velocity_text = 'Rotation Vector: %0.2f, %0.2f' % (rotation_velocity[0], rotation_velocity[1])
-        rotation_velocity_text_width = draw_event.frame.get().get_canvas_textwidth(rotation_velocity_text, 12)
-        rotation_velocity_position = (rotation_position[0] + rotation_text_width + 50, pos_position[1])
-        draw_event.canvas.draw_text(rotation_velocity_text, rotation_velocity_position, 12, 'white')
-        # missle velocity
-        forward_vector = self.game.player.get_forward_vector()
-        missle_vel = (vel[0] + 5 * forward_vector[0], vel[1] + 5 * forward_vector[1])
-        missle_vel_text = 'Missle Velocity: %0.2f, %0.2f' % (missle_vel[0], missle_vel[1])
-        missle_vel_text_width = draw_event.frame.get().get_canvas_textwidth(missle_vel_text, 12)
-        missle_vel_position = (rotation_velocity_position[0] + rotation_velocity_text_width + 50, pos_position[1])
-        draw_event.canvas.draw_text(missle_vel_text, missle_vel_position, 12, 'white')
-
-
-debugger = Debugger(game)
\ No newline at end of file
+        draw_event.canvas.set_layer(LAYER_HUD)
+        self.frames_since_refresh += 1
+        if self.positions is None or self.frames_since_refresh >= self.refresh_interval:
+            self.frames_since_refresh = 0
+            player = self.game.player
+            vel = player.get_velocity()
+            forward_vector = player.get_forward_vector()
+            # only changed values are formatted and measured again
+            self.labels[0].set_value(player.get_position())
+            self.labels[1].set_value(vel)
+            self.labels[2].set_value(player.get_rotation())
+            self.labels[3].set_value(forward_vector)
+            # missle velocity
+            self.labels[4].set_value((vel[0] + 5 * forward_vector[0], vel[1] + 5 * forward_vector[1]))
+            self.layout(draw_event)
+        for i in range(len(self.labels)):
+            self.labels[i].draw(draw_event.canvas, self.positions[i])
+        # profiler overlay
+        if self.game.profiler.enabled:
+            self.draw_profiler(draw_event)
+    def draw_profiler(self, draw_event):
+        profiler = self.game.profiler
+        line_position = (15, 60)
+        # stage timings
+        names = sorted(profiler.histograms.keys())
+        for name in names:
+            summary = profiler.histograms[name].get_summary()
+            stage_text = '%s: p50 %0.2f  p95 %0.2f  p99 %0.2f' % (name, summary['p50'], summary['p95'], summary['p99'])
+            draw_event.canvas.draw_text(stage_text, line_position, 12, 'white')
+            line_position = (line_position[0], line_position[1] + 14)
+        # entity counts
+        for name in sorted(profiler.gauges.keys()):
+            gauge_text = '%s: %d' % (name, profiler.gauges[name])
+            draw_event.canvas.draw_text(gauge_text, line_position, 12, 'white')
+            line_position = (line_position[0], line_position[1] + 14)
+
+
+# starts the game when ran as a script (importing only loads the classes)
+if __name__ == '__main__':
+    # creates a new game
+    game = AsteroidsGame(WINDOW_SIZE, NUM_LIVES, MAX_ROCK_COUNT)
+    # lowers the quality when frames go over budget
+    game.quality.enable()
+    game.start()
+    debugger = Debugger(game)
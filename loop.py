@@ -0,0 +1,211 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Drives a Game from an asyncio event loop instead of a SimpleGUI timer.
+
+Ticks are scheduled on the monotonic clock (every tick at start + n * delay),
+so lateness never accumulates, and the lateness of every tick is kept to
+report drift. A tick that wakes up late either catches up on the ticks it
+missed (up to max_late_ticks, the rest are dropped) or drops them and keeps
+the simulation running at the tick rate.
+
+Input, simulation, render and network stages run as cooperating tasks on the
+same event loop, so a server can run the game next to its own I/O.
+
+Usage:
+    python loop.py --seconds 10 --policy drop
+
+"""
+
+# import modules
+import argparse, asyncio, sys, time
+import game
+
+# tick policies
+CATCH_UP = 'catch_up'
+DROP = 'drop'
+# maximum missed ticks ran back to back when catching up
+MAX_LATE_TICKS = 5
+# number of lateness samples kept
+LATENESS_WINDOW = 400
+
+def get_clock_time():
+    """
+    Returns the monotonic clock time (in ms)
+    """
+    return time.monotonic() * 1000
+
+class AsyncLoop:
+    def __init__(self, target, policy = CATCH_UP, render_interval = 1000.0 / 60, max_late_ticks = MAX_LATE_TICKS):
+        """
+        Creates a loop driver
+
+        <Game> target               The driven game (its SimpleGUI timer is not used)
+        <str> policy                CATCH_UP or DROP, what to do with missed ticks
+        <float> render_interval     Time between rendered frames (in ms), None disables rendering
+        <int> max_late_ticks        Missed ticks caught up on in a row (CATCH_UP only)
+        """
+        if policy not in (CATCH_UP, DROP):
+            raise ValueError('unknown tick policy %s' % policy)
+        self.game = target
+        self.policy = policy
+        self.delay = target.get_timer().delay
+        self.render_interval = render_interval
+        self.max_late_ticks = max_late_ticks
+        self.inputs = asyncio.Queue()
+        self.tasks = []
+        self.stages = []
+        self.tick_waiters = []
+        self.running = False
+        self.start_time = None
+        # ticks ran, ticks ran late, missed ticks caught up on and dropped
+        self.ticks = 0
+        self.late_ticks = 0
+        self.caught_up_ticks = 0
+        self.dropped_ticks = 0
+        self.frames = 0
+        self.lateness = game.Histogram(LATENESS_WINDOW)
+    def get_sim_time(self):
+        """
+        Returns the time (in ms) simulated by the ticks ran so far
+        """
+        return self.ticks * self.delay
+    def get_drift(self):
+        """
+        Returns how far (in ms) the simulation is behind the monotonic clock
+        """
+        if self.start_time is None:
+            return 0
+        return get_clock_time() - self.start_time - self.get_sim_time()
+    def send(self, name, value):
+        """
+        Queues an input ('keydown', 'keyup' with a key, 'click' with a position)
+        """
+        self.inputs.put_nowait((name, value))
+    def add_stage(self, stage):
+        """
+        Runs a coroutine function next to the game (called with this loop), e.g. a network stage
+        """
+        self.stages.append(stage)
+        if self.running:
+            self.tasks.append(asyncio.ensure_future(stage(self)))
+    async def wait_tick(self):
+        """
+        Waits for the next simulation tick, returns the number of ticks ran
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.tick_waiters.append(future)
+        return await future
+    def run_tick(self):
+        self.ticks += 1
+        # feeds the timer tick through the game's dispatcher (Game.tick reads get_sim_time)
+        self.game.get_timer().count()
+        waiters = self.tick_waiters
+        self.tick_waiters = []
+        for future in waiters:
+            if not future.done():
+                future.set_result(self.ticks)
+    async def run_input(self):
+        while True:
+            name, value = await self.inputs.get()
+            if name == 'keydown':
+                self.game.onkeydown(value)
+            elif name == 'keyup':
+                self.game.onkeyup(value)
+            elif name == 'click':
+                self.game.onclick(value)
+    async def run_simulation(self):
+        next_time = self.start_time + self.delay
+        while True:
+            delay = next_time - get_clock_time()
+            if delay > 0:
+                await asyncio.sleep(delay / 1000.0)
+            lateness = get_clock_time() - next_time
+            self.lateness.add(max(lateness, 0))
+            missed = int(lateness // self.delay)
+            # stays on the tick grid, past every missed tick
+            next_time += (missed + 1) * self.delay
+            self.run_tick()
+            if missed > 0:
+                self.late_ticks += 1
+                if self.policy == CATCH_UP:
+                    caught_up = min(missed, self.max_late_ticks)
+                    for i in range(caught_up):
+                        self.run_tick()
+                    self.caught_up_ticks += caught_up
+                    missed -= caught_up
+                self.dropped_ticks += missed
+    async def run_render(self):
+        frame = self.game.get_frame().get()
+        while True:
+            await asyncio.sleep(self.render_interval / 1000.0)
+            # SimpleGUI frames render themselves
+            if hasattr(frame, 'draw'):
+                frame.draw()
+                self.frames += 1
+    async def run(self, duration = None):
+        """
+        Runs the game until stop() is called or for the given duration (in ms)
+        """
+        self.running = True
+        self.start_time = get_clock_time()
+        self.game.set_clock(self.get_sim_time)
+        self.game.get_frame().get().start()
+        self.tasks = [asyncio.ensure_future(self.run_input()), asyncio.ensure_future(self.run_simulation())]
+        if self.render_interval is not None:
+            self.tasks.append(asyncio.ensure_future(self.run_render()))
+        for stage in self.stages:
+            self.tasks.append(asyncio.ensure_future(stage(self)))
+        try:
+            if duration is None:
+                await asyncio.gather(*self.tasks)
+            else:
+                await asyncio.wait(self.tasks, timeout = duration / 1000.0, return_when = asyncio.FIRST_EXCEPTION)
+                for task in self.tasks:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.stop()
+            await asyncio.gather(*self.tasks, return_exceptions = True)
+            self.tasks = []
+            self.game.set_clock(None)
+            self.game.get_frame().get().stop()
+    def stop(self):
+        """
+        Cancels every task of the loop
+        """
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+    def get_stats(self):
+        stats = self.lateness.get_summary()
+        stats['ticks'] = self.ticks
+        stats['late_ticks'] = self.late_ticks
+        stats['caught_up_ticks'] = self.caught_up_ticks
+        stats['dropped_ticks'] = self.dropped_ticks
+        stats['frames'] = self.frames
+        stats['drift'] = self.get_drift()
+        return stats
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Runs Asteroids on an asyncio event loop')
+    parser.add_argument('--seconds', type = float, default = 5)
+    parser.add_argument('--policy', choices = [CATCH_UP, DROP], default = CATCH_UP)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+    game.set_backend(game.HeadlessBackend(None))
+    asteroids = game.AsteroidsGame(game.WINDOW_SIZE, game.NUM_LIVES, game.MAX_ROCK_COUNT, args.seed)
+    loop = AsyncLoop(asteroids, args.policy)
+    loop.send('click', asteroids.get_center())
+    asyncio.run(loop.run(args.seconds * 1000))
+    stats = loop.get_stats()
+    print('%d ticks (%d late, %d caught up, %d dropped), %d frames' % (stats['ticks'], stats['late_ticks'], stats['caught_up_ticks'], stats['dropped_ticks'], stats['frames']))
+    print('lateness: p50 %0.3f  p99 %0.3f  max %0.3f ms, drift %0.3f ms' % (stats['p50'], stats['p99'], stats['max'], stats['drift']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,804 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Networked multiplayer: an authoritative Server steps an AsteroidsGame with
+one spaceship per connected client and sends each client the world state
+after every tick. Clients send their input and acknowledge the states they
+received. The game's own player ship is taken out of the world, and the
+clients play cooperatively: they share the game's score and lives, and the
+game resets for everyone when the lives run out.
+
+A state only holds the entities that changed since the last state the client
+acknowledged (or every entity when there's none), plus the ids of the
+entities that are gone. Positions, velocities and rotations are quantized
+to fixed point integers, so an unchanged entity quantizes to the same record
+and isn't sent: bandwidth follows the activity, not the entity count.
+
+Messages (little endian, the first byte is the message type):
+    welcome     client -> ship entity id (I)
+    input       kind (B: 1 keydown, 2 keyup, 3 click), a (h), b (h), sequence number (I),
+                step (Q, the input is applied after that many steps, right away if already past)
+    ack         tick (Q)
+    state       tick (Q), baseline tick (Q, 0 for none), simulation steps (Q), last input
+                sequence number applied (I) and the step it was applied at (Q), score (i), lives (i), started (B),
+                changed count (H), removed count (H), entity records, removed ids (I...)
+
+An entity record is id (I), kind and flags (B), x, y (H), vx, vy (h), rotation (H),
+spawn step (H, the simulation step the entity was spawned at, wrapping). The
+client derives the age from the state's steps, so an entity at rest keeps
+the same record while it ages.
+
+Over UDP, a message larger than a datagram (a full state of thousands of
+entities) is split into fragments: message id (I), index (H), count (H),
+then a slice of the message. The receiving transport reassembles it, and
+drops it when a fragment is lost, like any lost datagram.
+
+PredictingClient moves its own spaceship (and its missles) as soon as the
+input is sent, then corrects the prediction when the authoritative state
+for the same step disagrees, replaying the input the server hasn't applied yet.
+Inputs are stamped with the predicted step, and the server applies them at
+that step, so the prediction holds as long as they arrive in time. The
+client's step counter moves ahead whenever the server applies an input late.
+
+Transports: InProcessTransport (create_pair) and UdpTransport (create_udp_pair, localhost).
+
+Usage:
+    python net.py --clients 4 --seconds 10
+    python net.py --clients 4 --seconds 10 --udp
+    python net.py --clients 4 --seconds 10 --latency 4
+
+"""
+
+# import modules
+import argparse, math, socket, struct, sys, time
+from collections import deque
+import game
+
+# message types
+WELCOME = 1
+INPUT = 2
+ACK = 3
+STATE = 4
+FRAGMENT = 5
+
+# input kinds
+KEYDOWN = 1
+KEYUP = 2
+CLICK = 3
+
+# entity kinds (low bits of the kind byte), flags (high bits)
+SHIP = 1
+ROCK = 2
+MISSLE = 3
+EXPLOSION = 4
+ROCK_MEDIUM = 5
+ROCK_SMALL = 6
+ACCELERATING = 16
+# rock kind of each level of game.ROCK_TYPES
+ROCK_KINDS = (ROCK, ROCK_MEDIUM, ROCK_SMALL)
+
+# fixed point scales: 1/32 px positions, 1/256 px per step velocities, 1/65536 turn rotations
+POSITION_SCALE = 32
+VELOCITY_SCALE = 256
+ROTATION_SCALE = 65536 / (2 * math.pi)
+# ticks of states kept to delta against (older acks get a full state)
+HISTORY_TICKS = 64
+# largest datagram sent over UDP
+MAX_DATAGRAM_SIZE = 65507
+# messages with missing fragments kept for reassembly
+FRAGMENT_WINDOW = 8
+# prediction errors tolerated before correcting (above the quantization error):
+# position (px), velocity (px per step) and rotation (radians)
+CORRECTION_THRESHOLD = (1.0, 0.05, 0.01)
+CORRECTION_ERRORS = ('position', 'velocity', 'rotation')
+# number of correction samples kept
+CORRECTION_WINDOW = 400
+# furthest step ahead an input can be scheduled at
+MAX_INPUT_LEAD = 120
+
+MESSAGE_TYPE = struct.Struct('<B')
+WELCOME_FORMAT = struct.Struct('<BI')
+INPUT_FORMAT = struct.Struct('<BBhhIQ')
+ACK_FORMAT = struct.Struct('<BQ')
+STATE_FORMAT = struct.Struct('<BQQQIQiiBHH')
+ENTITY_FORMAT = struct.Struct('<IBHHhhHH')
+REMOVED_FORMAT = struct.Struct('<I')
+FRAGMENT_FORMAT = struct.Struct('<BIHH')
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+def quantize(sprite, kind, steps):
+    """
+    Returns the fixed point record of a sprite at the given simulation step:
+    (kind, x, y, vx, vy, rotation, spawn step)
+    """
+    position = sprite.get_position()
+    velocity = sprite.get_velocity()
+    if sprite.is_accelerating():
+        kind |= ACCELERATING
+    return (
+        kind,
+        clamp(int(round(position[0] * POSITION_SCALE)), 0, 65535),
+        clamp(int(round(position[1] * POSITION_SCALE)), 0, 65535),
+        clamp(int(round(velocity[0] * VELOCITY_SCALE)), -32768, 32767),
+        clamp(int(round(velocity[1] * VELOCITY_SCALE)), -32768, 32767),
+        int(round(sprite.get_rotation() * ROTATION_SCALE)) % 65536,
+        (steps - sprite.age) % 65536
+    )
+
+def dequantize(record, steps):
+    """
+    Returns (kind, position, velocity, rotation, age, accelerating) from a fixed point record
+    of a state at the given simulation step
+    """
+    kind, x, y, vx, vy, rotation, spawn_step = record
+    age = (steps - spawn_step) % 65536
+    return (kind & (ACCELERATING - 1), (x / float(POSITION_SCALE), y / float(POSITION_SCALE)), (vx / float(VELOCITY_SCALE), vy / float(VELOCITY_SCALE)), rotation / ROTATION_SCALE, age, kind & ACCELERATING != 0)
+
+def encode_state(tick, baseline_tick, baseline, state, steps, input_seq, input_step, score, lives, started):
+    """
+    Encodes the entities of state that differ from baseline (None for all of them)
+    """
+    changed = []
+    removed = []
+    for entity_id in state:
+        record = state[entity_id]
+        if baseline is None or baseline.get(entity_id) != record:
+            changed.append(ENTITY_FORMAT.pack(entity_id, *record))
+    if baseline is not None:
+        for entity_id in baseline:
+            if entity_id not in state:
+                removed.append(REMOVED_FORMAT.pack(entity_id))
+    header = STATE_FORMAT.pack(STATE, tick, baseline_tick, steps, input_seq, input_step, score, lives, 1 if started else 0, len(changed), len(removed))
+    return header + b''.join(changed) + b''.join(removed)
+
+def decode_state(data, baseline):
+    """
+    Returns (tick, baseline tick, steps, input sequence number, input step, score, lives,
+    started, state) rebuilt on top of baseline
+    """
+    type, tick, baseline_tick, steps, input_seq, input_step, score, lives, started, changed_count, removed_count = STATE_FORMAT.unpack_from(data, 0)
+    if baseline is None:
+        state = {}
+    else:
+        state = dict(baseline)
+    offset = STATE_FORMAT.size
+    for i in range(changed_count):
+        values = ENTITY_FORMAT.unpack_from(data, offset)
+        offset += ENTITY_FORMAT.size
+        state[values[0]] = values[1:]
+    for i in range(removed_count):
+        state.pop(REMOVED_FORMAT.unpack_from(data, offset)[0], None)
+        offset += REMOVED_FORMAT.size
+    return tick, baseline_tick, steps, input_seq, input_step, score, lives, started == 1, state
+
+class InProcessTransport:
+    def __init__(self, latency = 0):
+        """
+        One end of an in-memory connection (see create_pair)
+
+        <int> latency       Number of receive() calls a message waits before delivery
+        """
+        self.inbox = deque()
+        self.latency = latency
+        self.receives = 0
+        self.peer = None
+        self.bytes_sent = 0
+    def send(self, data):
+        self.bytes_sent += len(data)
+        self.peer.inbox.append((self.peer.receives + self.peer.latency, data))
+    def receive(self):
+        self.receives += 1
+        messages = []
+        while len(self.inbox) > 0 and self.inbox[0][0] < self.receives:
+            messages.append(self.inbox.popleft()[1])
+        return messages
+    def close(self):
+        pass
+
+def create_pair(latency = 0):
+    """
+    Returns two connected in-process transports (server end, client end),
+    delivering after the given number of receive() calls in each direction
+    """
+    a = InProcessTransport(latency)
+    b = InProcessTransport(latency)
+    a.peer = b
+    b.peer = a
+    return a, b
+
+class UdpTransport:
+    def __init__(self, local_address, remote_address = None):
+        """
+        A non-blocking UDP socket sending to a single peer
+
+        <tuple> local_address       The bound (host, port), port 0 picks one
+        <tuple> remote_address      The peer's (host, port), set later with connect()
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(local_address)
+        self.socket.setblocking(False)
+        self.remote_address = remote_address
+        self.bytes_sent = 0
+        # messages split into fragments, and fragments received by message id
+        self.next_message_id = 1
+        self.fragments = {}
+    def get_address(self):
+        return self.socket.getsockname()
+    def connect(self, remote_address):
+        self.remote_address = remote_address
+    def send(self, data):
+        if len(data) <= MAX_DATAGRAM_SIZE:
+            self.bytes_sent += len(data)
+            self.socket.sendto(data, self.remote_address)
+            return
+        # splits the message into datagrams
+        size = MAX_DATAGRAM_SIZE - FRAGMENT_FORMAT.size
+        count = (len(data) + size - 1) // size
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        for i in range(count):
+            fragment = FRAGMENT_FORMAT.pack(FRAGMENT, message_id, i, count) + data[i * size:(i + 1) * size]
+            self.bytes_sent += len(fragment)
+            self.socket.sendto(fragment, self.remote_address)
+    def reassemble(self, data):
+        """
+        Keeps a fragment, returns the message once all its fragments arrived (None until then)
+        """
+        type, message_id, index, count = FRAGMENT_FORMAT.unpack_from(data, 0)
+        if message_id not in self.fragments:
+            self.fragments[message_id] = [None] * count
+            # gives up the oldest incomplete messages (a fragment was lost)
+            for old_id in sorted(self.fragments.keys())[:-FRAGMENT_WINDOW]:
+                del self.fragments[old_id]
+            if message_id not in self.fragments:
+                return None
+        parts = self.fragments[message_id]
+        parts[index] = data[FRAGMENT_FORMAT.size:]
+        if None in parts:
+            return None
+        del self.fragments[message_id]
+        return b''.join(parts)
+    def receive(self):
+        messages = []
+        while True:
+            try:
+                data, address = self.socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            if address != self.remote_address:
+                continue
+            if MESSAGE_TYPE.unpack_from(data, 0)[0] == FRAGMENT:
+                data = self.reassemble(data)
+                if data is None:
+                    continue
+            messages.append(data)
+        return messages
+    def close(self):
+        self.socket.close()
+
+def create_udp_pair(host = '127.0.0.1'):
+    """
+    Returns two UDP transports connected over localhost (server end, client end)
+    """
+    a = UdpTransport((host, 0))
+    b = UdpTransport((host, 0), a.get_address())
+    a.connect(b.get_address())
+    return a, b
+
+class Connection:
+    def __init__(self, client_id, transport, ship):
+        """
+        The server's side of a client
+        """
+        self.id = client_id
+        self.transport = transport
+        self.ship = ship
+        # last state tick acknowledged by the client (0 for none)
+        self.acked = 0
+        # inputs waiting for their step: (step, kind, a, b, sequence number)
+        self.inputs = []
+        # last input sequence number applied, and the step it was applied at
+        self.input_seq = 0
+        self.input_step = 0
+        self.states_sent = 0
+        self.full_states = 0
+        self.entities_sent = 0
+
+class Server:
+    def __init__(self, asteroids):
+        """
+        Runs the authoritative simulation
+
+        <AsteroidsGame> asteroids   The simulated world (its player ship is removed)
+        """
+        self.asteroids = asteroids
+        # a dedicated server has no local player, only the clients' ships are in the world
+        if asteroids.player in asteroids.ships:
+            asteroids.remove_ship(asteroids.player)
+        self.connections = {}
+        self.next_client_id = 1
+        # entity ids of the sprites (kept while the sprite stays in the world)
+        self.entity_ids = {}
+        self.next_entity_id = 1
+        self.ticks = 0
+        # sent states by tick
+        self.history = {}
+        # applies the scheduled input between steps
+        self.asteroids.dispatcher.add('update', self.apply_inputs)
+    def add_client(self, transport):
+        """
+        Adds a spaceship for a new client, returns its Connection
+        """
+        ship = self.asteroids.add_ship()
+        connection = Connection(self.next_client_id, transport, ship)
+        self.connections[connection.id] = connection
+        self.next_client_id += 1
+        transport.send(WELCOME_FORMAT.pack(WELCOME, self.get_entity_id(ship)))
+        return connection
+    def remove_client(self, connection):
+        del self.connections[connection.id]
+        self.asteroids.remove_ship(connection.ship)
+        connection.transport.close()
+    def get_entity_id(self, sprite):
+        if sprite not in self.entity_ids:
+            self.entity_ids[sprite] = self.next_entity_id
+            self.next_entity_id += 1
+        return self.entity_ids[sprite]
+    def handle(self, connection, data):
+        type = MESSAGE_TYPE.unpack_from(data, 0)[0]
+        if type == INPUT:
+            type, kind, a, b, seq, step = INPUT_FORMAT.unpack(data)
+            steps = self.asteroids.get_steps()
+            if step > steps and kind != CLICK:
+                connection.inputs.append((min(step, steps + MAX_INPUT_LEAD), kind, a, b, seq))
+            else:
+                self.apply_input(connection, kind, a, b, seq)
+        elif type == ACK:
+            connection.acked = max(connection.acked, ACK_FORMAT.unpack(data)[1])
+    def apply_input(self, connection, kind, a, b, seq):
+        if seq > connection.input_seq:
+            connection.input_seq = seq
+            connection.input_step = self.asteroids.get_steps()
+        if kind == CLICK:
+            self.asteroids.onclick((a, b))
+        elif self.asteroids.started:
+            if kind == KEYDOWN:
+                connection.ship.onkeydown(game.KeyEvent(a))
+            elif kind == KEYUP:
+                connection.ship.onkeyup(game.KeyEvent(a))
+    def apply_inputs(self, update_event):
+        """
+        Update handler, applies the input scheduled at the step that just ran
+        """
+        for connection in self.connections.values():
+            while len(connection.inputs) > 0 and connection.inputs[0][0] <= update_event.step:
+                step, kind, a, b, seq = connection.inputs.pop(0)
+                self.apply_input(connection, kind, a, b, seq)
+    def receive(self):
+        """
+        Applies (or schedules) the input and acks received from every client
+        """
+        for connection in list(self.connections.values()):
+            for data in connection.transport.receive():
+                self.handle(connection, data)
+    def capture(self):
+        """
+        Returns the quantized world state: entity id -> record
+        """
+        state = {}
+        steps = self.asteroids.get_steps()
+        sprites = [(ship, SHIP) for ship in self.asteroids.ships]
+        sprites.extend([(rock, ROCK_KINDS[rock.get_level() or 0]) for rock in self.asteroids.rocks.get_all()])
+        for ship in self.asteroids.ships:
+            sprites.extend([(missle, MISSLE) for missle in ship.get_missles().get_all()])
+        sprites.extend([(explosion, EXPLOSION) for explosion in self.asteroids.explosions.get_all()])
+        entity_ids = {}
+        for sprite, kind in sprites:
+            entity_id = self.get_entity_id(sprite)
+            entity_ids[sprite] = entity_id
+            state[entity_id] = quantize(sprite, kind, steps)
+        # sprites gone from the world get a new id if they come back (pooled)
+        self.entity_ids = entity_ids
+        return state
+    def broadcast(self):
+        """
+        Sends every client the changes since the state it acknowledged
+        """
+        state = self.capture()
+        self.history[self.ticks] = state
+        score = self.asteroids.score
+        for connection in self.connections.values():
+            baseline = self.history.get(connection.acked)
+            baseline_tick = connection.acked if baseline is not None else 0
+            data = encode_state(self.ticks, baseline_tick, baseline, state, self.asteroids.get_steps(), connection.input_seq, connection.input_step, score.get_score(), score.get_lives(), self.asteroids.started)
+            connection.transport.send(data)
+            connection.states_sent += 1
+            connection.entities_sent += STATE_FORMAT.unpack_from(data, 0)[9]
+            if baseline is None:
+                connection.full_states += 1
+        # keeps the states still usable as a baseline
+        oldest = self.ticks - HISTORY_TICKS
+        for tick in list(self.history.keys()):
+            if tick < oldest:
+                del self.history[tick]
+    def tick(self, elapsed):
+        """
+        Applies the received input, advances the world by the elapsed time (in ms)
+        and sends the new state
+        """
+        self.receive()
+        self.asteroids.advance(elapsed)
+        self.ticks += 1
+        self.broadcast()
+    def get_stats(self):
+        clients = {}
+        for connection in self.connections.values():
+            clients[connection.id] = {
+                'states': connection.states_sent,
+                'full_states': connection.full_states,
+                'entities': connection.entities_sent,
+                'bytes': connection.transport.bytes_sent
+            }
+        return {'ticks': self.ticks, 'clients': clients}
+
+class Client:
+    def __init__(self, transport):
+        """
+        Receives the world state from a server
+
+        <Transport> transport       The connection to the server
+        """
+        self.transport = transport
+        self.ship_id = None
+        # received states by tick (kept until a later one is used as baseline)
+        self.states = {}
+        self.tick = 0
+        self.state = {}
+        # server simulation steps and last input applied at the latest state
+        self.server_steps = 0
+        self.input_ack = 0
+        self.input_ack_step = 0
+        self.input_seq = 0
+        self.score = 0
+        self.lives = 0
+        self.started = False
+        self.bytes_received = 0
+    def send_input(self, name, value, step = 0):
+        """
+        Sends an input ('keydown', 'keyup' with a key, 'click' with a position)
+        applied at the given step (right away by default), returns its sequence number
+        """
+        self.input_seq += 1
+        if name == 'click':
+            data = INPUT_FORMAT.pack(INPUT, CLICK, int(value[0]), int(value[1]), self.input_seq, step)
+        elif name == 'keydown':
+            data = INPUT_FORMAT.pack(INPUT, KEYDOWN, value, 0, self.input_seq, step)
+        else:
+            data = INPUT_FORMAT.pack(INPUT, KEYUP, value, 0, self.input_seq, step)
+        self.transport.send(data)
+        return self.input_seq
+    def handle(self, data):
+        self.bytes_received += len(data)
+        type = MESSAGE_TYPE.unpack_from(data, 0)[0]
+        if type == WELCOME:
+            self.ship_id = WELCOME_FORMAT.unpack(data)[1]
+        elif type == STATE:
+            tick, baseline_tick = STATE_FORMAT.unpack_from(data, 0)[1:3]
+            # stale (reordered) states and unknown baselines are skipped
+            if tick <= self.tick or (baseline_tick != 0 and baseline_tick not in self.states):
+                return
+            tick, baseline_tick, self.server_steps, self.input_ack, self.input_ack_step, self.score, self.lives, self.started, self.state = decode_state(data, self.states.get(baseline_tick))
+            self.tick = tick
+            self.states[tick] = self.state
+            # the server only deltas against this tick or later ones from now on
+            for old_tick in list(self.states.keys()):
+                if old_tick < baseline_tick:
+                    del self.states[old_tick]
+            self.transport.send(ACK_FORMAT.pack(ACK, tick))
+            self.on_state()
+    def on_state(self):
+        """
+        Called after a new state is received
+        """
+        pass
+    def poll(self):
+        """
+        Handles every message received, returns the number of messages
+        """
+        messages = self.transport.receive()
+        for data in messages:
+            self.handle(data)
+        return len(messages)
+    def get_entities(self):
+        """
+        Returns the latest world state: entity id -> (kind, position, velocity, rotation, age, accelerating)
+        """
+        entities = {}
+        for entity_id in self.state:
+            entities[entity_id] = dequantize(self.state[entity_id], self.server_steps)
+        return entities
+    def get_ship(self):
+        """
+        Returns this client's spaceship entity (None until welcomed)
+        """
+        if self.ship_id not in self.state:
+            return None
+        return dequantize(self.state[self.ship_id], self.server_steps)
+
+def get_controls(controls, name, key, key_map):
+    """
+    Returns the (rotation direction, accelerating) controls after an input,
+    as PlayerSpaceship.onkeydown() and onkeyup() set them
+    """
+    rotation_dir, accelerating = controls
+    if name == 'keydown':
+        if key == key_map['left']:
+            rotation_dir = 'left'
+        elif key == key_map['right']:
+            rotation_dir = 'right'
+        elif key == key_map['up']:
+            accelerating = True
+    elif name == 'keyup':
+        if key == key_map['left'] or key == key_map['right']:
+            rotation_dir = None
+        elif key == key_map['up']:
+            accelerating = False
+    return (rotation_dir, accelerating)
+
+class PredictingClient(Client):
+    def __init__(self, transport, size = game.WINDOW_SIZE):
+        """
+        A client that moves its own spaceship and missles locally, without
+        waiting for the server
+
+        <Transport> transport       The connection to the server
+        <tuple> size                The size of the world
+        """
+        Client.__init__(self, transport)
+        self.size = size
+        self.step_rate = game.STEP_RATE
+        self.step_size = 1000.0 / self.step_rate
+        # the predicted spaceship, stepped with the same code as the server's
+        self.ship = game.PlayerSpaceship((90, 90), (size[0] / 2, size[1] / 2))
+        # predicted step (None until the first state) and unsimulated time (as in Game)
+        self.steps = None
+        self.accumulator = 0
+        # inputs not applied by the server yet: [sequence number, step, name, key, predicted missles]
+        self.pending = []
+        # controls of the spaceship after the inputs the server applied
+        self.acked_controls = (None, False)
+        # predicted spaceship state by step: (position, velocity, rotation)
+        self.history = {}
+        self.checks = 0
+        self.corrections = 0
+        # size of each error of the corrected predictions, and how often it was over its threshold
+        self.correction_sizes = [game.Histogram(CORRECTION_WINDOW) for name in CORRECTION_ERRORS]
+        self.correction_causes = [0] * len(CORRECTION_ERRORS)
+    def send_input(self, name, value):
+        """
+        Sends an input, and applies it to the predicted spaceship right away
+        """
+        seq = Client.send_input(self, name, value, self.steps or 0)
+        if name != 'click' and self.steps is not None and self.started:
+            missles = self.apply_input(name, value, True)
+            self.pending.append([seq, self.steps, name, value, missles])
+        return seq
+    def apply_input(self, name, key, shoot):
+        """
+        Feeds an input to the predicted spaceship, returns the missles it shot
+        """
+        key_event = game.KeyEvent(key)
+        if name == 'keyup':
+            self.ship.onkeyup(key_event)
+            return []
+        if key == self.ship.get_key_map()['space']:
+            # missles already predicted aren't shot again on replay
+            if not shoot:
+                return []
+            missles = self.ship.get_missles()
+            before = set(missles.get_all())
+            self.ship.onkeydown(key_event)
+            return [missle for missle in missles.get_all() if missle not in before]
+        self.ship.onkeydown(key_event)
+        return []
+    def get_ship_state(self):
+        return (self.ship.get_position(), self.ship.get_velocity(), self.ship.get_rotation())
+    def step_ship(self):
+        self.steps += 1
+        update_event = game.UpdateEvent(self.steps, self.steps * 1000 // self.step_rate, self.step_size, self.size)
+        self.ship.update(update_event)
+        self.history[self.steps] = self.get_ship_state()
+        return update_event
+    def step(self):
+        """
+        Runs a single predicted step (spaceship and missles)
+        """
+        update_event = self.step_ship()
+        missles = self.ship.get_missles()
+        for missle in missles.get_all():
+            missle.update(update_event)
+        missles.reap()
+        # expired missles may be reused by the next shot, so they're forgotten first
+        for pending in self.pending:
+            if len(pending[4]) > 0:
+                pending[4] = [missle for missle in pending[4] if missles.has(missle)]
+        missles.flush()
+    def advance(self, elapsed):
+        """
+        Runs the predicted steps that fit in the elapsed time (in ms), returns the number of steps
+        """
+        if self.steps is None:
+            return 0
+        self.accumulator += elapsed * self.step_rate
+        steps = 0
+        while self.accumulator >= 1000:
+            self.step()
+            self.accumulator -= 1000
+            steps += 1
+        return steps
+    def load(self, ship):
+        """
+        Moves the predicted spaceship to an authoritative state
+        """
+        kind, position, velocity, rotation, age, accelerating = ship
+        self.ship.set_position(position)
+        self.ship.previous_position = position
+        self.ship.set_velocity(velocity)
+        self.ship.set_rotation(rotation)
+        self.ship.previous_rotation = rotation
+        self.ship.set_rotation_dir(self.acked_controls[0])
+        self.ship.accelerating = accelerating
+    def get_error(self, predicted, ship):
+        """
+        Returns the position, velocity and rotation errors of a prediction
+        """
+        position, velocity, rotation = predicted
+        dx = game.wrap_delta(position[0] - ship[1][0], self.size[0])
+        dy = game.wrap_delta(position[1] - ship[1][1], self.size[1])
+        dvx = velocity[0] - ship[2][0]
+        dvy = velocity[1] - ship[2][1]
+        # rotations aren't bounded, quantized ones are within a turn
+        drotation = (rotation - ship[3]) % (2 * math.pi)
+        return (math.sqrt(dx * dx + dy * dy), math.sqrt(dvx * dvx + dvy * dvy), min(drotation, 2 * math.pi - drotation))
+    def on_state(self):
+        ship = self.get_ship()
+        if ship is None or not self.started:
+            return
+        # forgets the inputs the server applied (their missles are in the state now)
+        offset = 0
+        while len(self.pending) > 0 and self.pending[0][0] <= self.input_ack:
+            seq, step, name, key, missles = self.pending.pop(0)
+            self.acked_controls = get_controls(self.acked_controls, name, key, self.ship.get_key_map())
+            for missle in missles:
+                self.ship.get_missles().remove(missle)
+            if seq == self.input_ack:
+                offset = self.input_ack_step - step
+        self.ship.get_missles().flush()
+        # runs further ahead when an input reached the server too late for its step
+        if offset > 0 and self.steps is not None:
+            self.shift(offset)
+        # starts (or restarts, when fallen behind) the prediction from the server
+        if self.steps is None or self.server_steps > self.steps:
+            self.steps = self.server_steps
+            self.history = {}
+            self.load(ship)
+            for pending in self.pending:
+                self.apply_input(pending[2], pending[3], False)
+            return
+        predicted = self.history.get(self.server_steps)
+        for step in list(self.history.keys()):
+            if step < self.server_steps:
+                del self.history[step]
+        if predicted is None:
+            return
+        self.checks += 1
+        error = self.get_error(predicted, ship)
+        corrected = False
+        for i in range(len(CORRECTION_ERRORS)):
+            if error[i] > CORRECTION_THRESHOLD[i]:
+                self.correction_causes[i] += 1
+                corrected = True
+        if corrected:
+            self.corrections += 1
+            for i in range(len(CORRECTION_ERRORS)):
+                self.correction_sizes[i].add(error[i])
+            self.reconcile(ship)
+    def shift(self, offset):
+        """
+        Moves the predicted step counter (and the steps of the prediction history) by offset
+        """
+        self.steps += offset
+        history = {}
+        for step in self.history:
+            history[step + offset] = self.history[step]
+        self.history = history
+        for pending in self.pending:
+            pending[1] += offset
+    def reconcile(self, ship):
+        """
+        Rewinds the predicted spaceship to the authoritative state and replays
+        the inputs the server hasn't applied yet, up to the current step
+        """
+        current = self.steps
+        self.steps = self.server_steps
+        self.history = {}
+        self.load(ship)
+        index = 0
+        while True:
+            while index < len(self.pending) and self.pending[index][1] <= self.steps:
+                self.apply_input(self.pending[index][2], self.pending[index][3], False)
+                index += 1
+            if self.steps >= current:
+                break
+            self.step_ship()
+    def get_stats(self):
+        # position error summary, then per error: its summary and the corrections it caused
+        stats = self.correction_sizes[0].get_summary()
+        for i in range(len(CORRECTION_ERRORS)):
+            stats[CORRECTION_ERRORS[i]] = self.correction_sizes[i].get_summary()
+            stats[CORRECTION_ERRORS[i] + '_corrections'] = self.correction_causes[i]
+        stats['checks'] = self.checks
+        stats['corrections'] = self.corrections
+        stats['pending'] = len(self.pending)
+        return stats
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Runs an Asteroids server with simulated clients')
+    parser.add_argument('--clients', type = int, default = 4)
+    parser.add_argument('--seconds', type = float, default = 10)
+    parser.add_argument('--udp', action = 'store_true', help = 'connect the clients over localhost UDP')
+    parser.add_argument('--latency', type = int, default = 0, help = 'in-process delivery delay (in ticks, each way)')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+    game.set_backend(game.HeadlessBackend(None))
+    asteroids = game.AsteroidsGame(game.WINDOW_SIZE, game.NUM_LIVES, game.MAX_ROCK_COUNT, args.seed)
+    server = Server(asteroids)
+    clients = []
+    for i in range(args.clients):
+        if args.udp:
+            server_end, client_end = create_udp_pair()
+        else:
+            server_end, client_end = create_pair(args.latency)
+        server.add_client(server_end)
+        clients.append(PredictingClient(client_end))
+    key_map = game.KEY_MAP
+    clients[0].send_input('click', asteroids.get_center())
+    interval = asteroids.get_timer().delay
+    ticks = int(args.seconds * 1000 // interval)
+    start_time = time.time()
+    for tick in range(ticks):
+        # every client turns and shoots for a while, then idles
+        for i in range(len(clients)):
+            if tick == 10 + i:
+                clients[i].send_input('keydown', key_map['left'])
+                clients[i].send_input('keydown', key_map['space'])
+            elif tick == ticks // 2 + i:
+                clients[i].send_input('keyup', key_map['left'])
+        if args.udp:
+            # gives the datagrams time to arrive
+            time.sleep(0.001)
+        server.tick(interval)
+        if args.udp:
+            time.sleep(0.001)
+        for client in clients:
+            client.advance(interval)
+            client.poll()
+    elapsed = time.time() - start_time
+    stats = server.get_stats()
+    print('%d ticks, %d clients in %0.2fs' % (stats['ticks'], len(clients), elapsed))
+    for client_id in sorted(stats['clients']):
+        client_stats = stats['clients'][client_id]
+        prediction = clients[client_id - 1].get_stats()
+        print('client %d: %0.1f bytes/tick, %0.1f entities/tick, %d full states, %d/%d predictions corrected' % (client_id, client_stats['bytes'] / float(stats['ticks']), client_stats['entities'] / float(stats['ticks']), client_stats['full_states'], prediction['corrections'], prediction['checks']))
+        if prediction['corrections'] > 0:
+            print('    over threshold: position %d (max %0.2f px), velocity %d (max %0.3f px/step), rotation %d (max %0.3f rad)' % (prediction['position_corrections'], prediction['position']['max'], prediction['velocity_corrections'], prediction['velocity']['max'], prediction['rotation_corrections'], prediction['rotation']['max']))
+    for client in clients:
+        client.transport.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
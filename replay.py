@@ -0,0 +1,192 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Records the input of an AsteroidsGame session into a compact binary log
+and replays it headlessly, faster than real time.
+
+Inputs are stamped with the simulation step they arrived after, so the
+replay feeds them back through the Dispatcher between the same steps and
+reproduces the session bit for bit (the log also stores the game seed and
+a checksum of the final state to verify it). Clicks made while the assets
+are still loading are ignored by the game and aren't recorded: a headless
+replay has every asset ready from the start.
+
+Log format (little endian):
+    header      magic "ASTR", version (H), seed (I), width (H), height (H), lives (I), max rock count (I),
+                rock limit (B, 0 when there's no max rock count)
+    records     step (I), timer tick (I), type (B), a (h), b (h)
+                type 1 keydown (a = key), 2 keyup (a = key), 3 click (a, b = position)
+    trailer     a type 0 record (step = last step) followed by the state checksum (I)
+
+Usage:
+    python replay.py session.log
+
+"""
+
+# import modules
+import struct, sys, time, zlib
+import game
+
+LOG_MAGIC = b'ASTR'
+LOG_VERSION = 2
+HEADER_FORMAT = struct.Struct('<4sHIHHIIB')
+RECORD_FORMAT = struct.Struct('<IIBhh')
+CHECKSUM_FORMAT = struct.Struct('<I')
+
+# record types
+END = 0
+KEYDOWN = 1
+KEYUP = 2
+CLICK = 3
+
+def get_checksum(asteroids):
+    """
+    Returns a CRC32 of the simulation state (steps, score, player and sprites).
+    Values are hashed as doubles, so an int and an equal float hash the same.
+    """
+    player = asteroids.player
+    values = [
+        asteroids.get_steps(),
+        asteroids.score.get_score(),
+        asteroids.score.get_lives(),
+        player.get_position()[0],
+        player.get_position()[1],
+        player.get_velocity()[0],
+        player.get_velocity()[1],
+        player.get_rotation()
+    ]
+    for group in asteroids.groups:
+        for sprite in group.get_all():
+            position = sprite.get_position()
+            velocity = sprite.get_velocity()
+            values.extend((position[0], position[1], velocity[0], velocity[1], sprite.get_rotation(), sprite.age))
+    return zlib.crc32(struct.pack('<%dd' % len(values), *values)) & 0xffffffff
+
+class InputRecorder:
+    def __init__(self, asteroids, output):
+        """
+        Starts recording the key and click events of the game
+
+        <AsteroidsGame> asteroids   The recorded game (before any input)
+        <file> output               A binary file object
+        """
+        self.asteroids = asteroids
+        self.output = output
+        self.count = 0
+        self.closed = False
+        width, height = asteroids.get_size()
+        max_rock_count = asteroids.max_rock_count
+        limited = 1 if max_rock_count is not None else 0
+        self.output.write(HEADER_FORMAT.pack(LOG_MAGIC, LOG_VERSION, asteroids.seed, width, height, asteroids.score.initial_lives, max_rock_count or 0, limited))
+        # records before any other handler sees the event
+        self.asteroids.dispatcher.add('keydown', self.on_keydown, -1000)
+        self.asteroids.dispatcher.add('keyup', self.on_keyup, -1000)
+        self.asteroids.dispatcher.add('click', self.on_click, -1000)
+    def record(self, type, a = 0, b = 0):
+        timer = self.asteroids.get_timer()
+        tick = timer.get_time() // timer.delay
+        self.output.write(RECORD_FORMAT.pack(self.asteroids.get_steps(), tick, type, a, b))
+        self.count += 1
+    def on_keydown(self, key_event):
+        self.record(KEYDOWN, key_event.key)
+    def on_keyup(self, key_event):
+        self.record(KEYUP, key_event.key)
+    def on_click(self, click_event):
+        # the game ignores clicks until its assets are ready
+        if not self.asteroids.assets.poll():
+            return
+        self.record(CLICK, int(click_event.position[0]), int(click_event.position[1]))
+    def close(self):
+        """
+        Writes the trailer and stops recording
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.record(END)
+        self.output.write(CHECKSUM_FORMAT.pack(get_checksum(self.asteroids)))
+        self.asteroids.dispatcher.remove('keydown', self.on_keydown)
+        self.asteroids.dispatcher.remove('keyup', self.on_keyup)
+        self.asteroids.dispatcher.remove('click', self.on_click)
+
+class InputReplay:
+    def __init__(self, data):
+        """
+        Parses a recorded log
+
+        <bytes> data        The log contents
+        """
+        magic, version = HEADER_FORMAT.unpack_from(data, 0)[:2]
+        if magic != LOG_MAGIC:
+            raise ValueError('not an input log')
+        if version != LOG_VERSION:
+            raise ValueError('unsupported input log version %d' % version)
+        magic, version, self.seed, width, height, self.lives, self.max_rock_count, limited = HEADER_FORMAT.unpack_from(data, 0)
+        if not limited:
+            self.max_rock_count = None
+        self.size = (width, height)
+        self.records = []
+        self.last_step = None
+        self.checksum = None
+        offset = HEADER_FORMAT.size
+        while offset + RECORD_FORMAT.size <= len(data):
+            record = RECORD_FORMAT.unpack_from(data, offset)
+            offset += RECORD_FORMAT.size
+            if record[2] == END:
+                self.last_step = record[0]
+                self.checksum = CHECKSUM_FORMAT.unpack_from(data, offset)[0]
+                break
+            self.records.append(record)
+        if self.last_step is None:
+            raise ValueError('truncated input log')
+    def create_game(self):
+        """
+        Creates a game matching the recorded one (on the current backend)
+        """
+        return game.AsteroidsGame(self.size, self.lives, self.max_rock_count, self.seed)
+    def run(self, asteroids):
+        """
+        Feeds the recorded input through the Dispatcher between the recorded
+        steps, as fast as possible. Returns True if the final state matches.
+        """
+        index = 0
+        while True:
+            # dispatches the input that arrived after the current step
+            while index < len(self.records) and self.records[index][0] <= asteroids.get_steps():
+                step, tick, type, a, b = self.records[index]
+                if type == KEYDOWN:
+                    asteroids.onkeydown(a)
+                elif type == KEYUP:
+                    asteroids.onkeyup(a)
+                elif type == CLICK:
+                    asteroids.onclick((a, b))
+                index += 1
+            if asteroids.get_steps() >= self.last_step:
+                break
+            asteroids.step()
+        return get_checksum(asteroids) == self.checksum
+
+def main(argv = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) != 1:
+        print('usage: python replay.py session.log')
+        return 2
+    with open(argv[0], 'rb') as log_file:
+        replay = InputReplay(log_file.read())
+    game.set_backend(game.HeadlessBackend(None))
+    asteroids = replay.create_game()
+    start_time = time.time()
+    matched = replay.run(asteroids)
+    elapsed = time.time() - start_time
+    print('%d steps, %d inputs in %0.3fs (%0.0f steps/sec)' % (replay.last_step, len(replay.records), elapsed, replay.last_step / max(elapsed, 1e-9)))
+    if matched:
+        print('final state matches the recording')
+        return 0
+    print('final state differs from the recording')
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
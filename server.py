@@ -0,0 +1,216 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Hosts many AsteroidsGame sessions in one process.
+
+Every session is a separate game with its own Dispatcher (the asset cache
+is shared). The Scheduler steps every session's fixed timestep loop from a
+single loop and keeps the tick latency of each session. Each game has its
+own profiler; once profiling is enabled the Scheduler combines them into
+one summary.
+
+Usage:
+    python server.py --sessions 200 --seconds 10
+    python server.py --sessions 200 --seconds 10 --fast     (no sleeping, as fast as possible)
+    python server.py --sessions 200 --seconds 10 --profile  (stage timings of all sessions)
+
+"""
+
+# import modules
+import argparse, sys, time
+import game
+
+# timer tick of the scheduler (in ms)
+TICK_INTERVAL = 25
+# number of latency samples kept per session
+LATENCY_WINDOW = 400
+
+def get_clock_time():
+    """
+    Returns the monotonic clock time (in ms)
+    """
+    return time.perf_counter() * 1000
+
+class Session:
+    def __init__(self, session_id, asteroids):
+        """
+        Creates a new session
+
+        <int> session_id                The session id
+        <AsteroidsGame> asteroids       The session's game
+        """
+        self.id = session_id
+        self.asteroids = asteroids
+        # input received since the last tick: (event name, value)
+        self.inputs = []
+        self.ticks = 0
+        self.latency = game.Histogram(LATENCY_WINDOW)
+    def send(self, name, value):
+        """
+        Queues an input ('keydown', 'keyup' with a key, 'click' with a position)
+        applied at the start of the next tick
+        """
+        self.inputs.append((name, value))
+    def apply_inputs(self):
+        inputs = self.inputs
+        self.inputs = []
+        for name, value in inputs:
+            if name == 'keydown':
+                self.asteroids.onkeydown(value)
+            elif name == 'keyup':
+                self.asteroids.onkeyup(value)
+            elif name == 'click':
+                self.asteroids.onclick(value)
+    def tick(self, elapsed):
+        """
+        Applies the queued input then advances the game by the elapsed time (in ms)
+        """
+        start_time = time.perf_counter()
+        self.apply_inputs()
+        steps = self.asteroids.advance(elapsed)
+        self.latency.add((time.perf_counter() - start_time) * 1000)
+        self.ticks += 1
+        return steps
+    def get_stats(self):
+        stats = self.latency.get_summary()
+        stats['ticks'] = self.ticks
+        stats['steps'] = self.asteroids.get_steps()
+        stats['dropped_steps'] = self.asteroids.dropped_steps
+        return stats
+
+class Scheduler:
+    def __init__(self, tick_interval = TICK_INTERVAL, backend = None):
+        """
+        Creates a scheduler. Sessions are created on a headless backend,
+        their timers are never started (the scheduler drives them).
+
+        <int> tick_interval     Time between ticks (in ms)
+        <Backend> backend       The backend of the sessions (a headless one by default)
+        """
+        if backend is None:
+            backend = game.HeadlessBackend(None)
+        self.backend = backend
+        self.tick_interval = tick_interval
+        self.sessions = {}
+        self.next_id = 1
+        self.ticks = 0
+        self.tick_latency = game.Histogram(LATENCY_WINDOW)
+        # profiles every session (see enable_profiling)
+        self.profiling = False
+    def enable_profiling(self):
+        """
+        Enables the profiler of every session, current and future
+        """
+        self.profiling = True
+        for session in self.sessions.values():
+            session.asteroids.profiler.enable(session.asteroids.dispatcher)
+    def get_profile(self):
+        """
+        Returns the summary of every session's profiler combined
+        """
+        profilers = [session.asteroids.profiler for session in self.sessions.values()]
+        return game.combine_profilers(profilers).get_summary()
+    def create_session(self, seed = None, lives = game.NUM_LIVES, max_rock_count = game.MAX_ROCK_COUNT, start = True):
+        """
+        Creates a new session and returns it
+        """
+        asteroids = game.AsteroidsGame(game.WINDOW_SIZE, lives, max_rock_count, seed, backend = self.backend)
+        if self.profiling:
+            asteroids.profiler.enable(asteroids.dispatcher)
+        # clicks the splash screen
+        if start:
+            asteroids.onclick(asteroids.get_center())
+        session = Session(self.next_id, asteroids)
+        self.sessions[session.id] = session
+        self.next_id += 1
+        return session
+    def close_session(self, session_id):
+        session = self.sessions.pop(session_id)
+        session.asteroids.stop()
+        if isinstance(self.backend, game.HeadlessBackend):
+            self.backend.release(session.asteroids.get_frame().get())
+            self.backend.release(session.asteroids.get_timer().get_timer())
+    def get_session(self, session_id):
+        return self.sessions.get(session_id)
+    def tick(self, elapsed = None):
+        """
+        Advances every session by the elapsed time (one tick interval by default)
+        """
+        if elapsed is None:
+            elapsed = self.tick_interval
+        start_time = time.perf_counter()
+        for session in list(self.sessions.values()):
+            session.tick(elapsed)
+        self.tick_latency.add((time.perf_counter() - start_time) * 1000)
+        self.ticks += 1
+    def run(self, duration, realtime = True):
+        """
+        Ticks every session for the given duration (in ms of game time).
+        In realtime, ticks are paced by the monotonic clock and late ticks
+        pass the actual elapsed time (the sessions catch up). Otherwise
+        ticks run back to back.
+        """
+        if not realtime:
+            for i in range(int(duration // self.tick_interval)):
+                self.tick()
+            return
+        start_time = get_clock_time()
+        last_time = start_time
+        next_time = start_time + self.tick_interval
+        while last_time - start_time < duration:
+            delay = next_time - get_clock_time()
+            if delay > 0:
+                time.sleep(delay / 1000.0)
+            now = get_clock_time()
+            self.tick(now - last_time)
+            last_time = now
+            next_time += self.tick_interval
+            # skip the ticks already missed
+            if next_time < now:
+                next_time = now + self.tick_interval
+    def get_stats(self):
+        """
+        Returns the tick latency of the scheduler and of each session
+        """
+        sessions = {}
+        for session_id in self.sessions:
+            sessions[session_id] = self.sessions[session_id].get_stats()
+        return {
+            'ticks': self.ticks,
+            'tick': self.tick_latency.get_summary(),
+            'sessions': sessions
+        }
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Hosts many Asteroids sessions in one process')
+    parser.add_argument('--sessions', type = int, default = 100)
+    parser.add_argument('--seconds', type = float, default = 10)
+    parser.add_argument('--fast', action = 'store_true', help = 'tick back to back instead of in real time')
+    parser.add_argument('--profile', action = 'store_true', help = 'print the stage timings of all sessions')
+    args = parser.parse_args(argv)
+    scheduler = Scheduler()
+    if args.profile:
+        scheduler.enable_profiling()
+    for i in range(args.sessions):
+        session = scheduler.create_session(seed = i)
+        # keeps every session busy
+        session.send('keydown', scheduler.backend.get_key_map()['left'])
+        session.send('keydown', scheduler.backend.get_key_map()['space'])
+    start_time = time.time()
+    scheduler.run(args.seconds * 1000, not args.fast)
+    elapsed = time.time() - start_time
+    stats = scheduler.get_stats()
+    worst = max(stats['sessions'].values(), key = lambda s: s['p99'])
+    print('%d sessions, %d ticks in %0.2fs' % (len(scheduler.sessions), stats['ticks'], elapsed))
+    print('tick (all sessions): p50 %0.3f  p95 %0.3f  p99 %0.3f ms' % (stats['tick']['p50'], stats['tick']['p95'], stats['tick']['p99']))
+    print('worst session p99: %0.3f ms' % worst['p99'])
+    if args.profile:
+        stages = scheduler.get_profile()['stages']
+        for name in sorted(stages):
+            print('%s: p50 %0.3f  p95 %0.3f  p99 %0.3f ms' % (name, stages[name]['p50'], stages[name]['p95'], stages[name]['p99']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
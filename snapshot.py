@@ -0,0 +1,304 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Packs the full state of an AsteroidsGame (simulation clock, random
+generator, score, player, rocks, missles and explosions) into a compact
+binary snapshot, and restores it into the same or another game.
+
+Snapshots are taken between steps (after the groups are flushed) and are
+cheap enough to take on every tick into a SnapshotRing, to rewind,
+checkpoint long runs, or fork a simulation from a saved state. The first
+snapshot swaps the game's random generator for a TrackedRandom (same state,
+same sequence), so later snapshots only repack the generator state after
+it was drawn from. Restored missles and explosions don't replay their sounds.
+
+Snapshot format (little endian):
+    header      magic "ASNP", version (H), steps (Q), accumulator (d), dropped steps (Q),
+                timer time (q), score (i), lives (i), started (B), rotation dir (B),
+                wave director time played (d), spawn credit (d)
+    random      has state (B), gauss next flag (B), gauss next (d), state length (H), state (I...)
+    player      one sprite record
+    groups      rocks, missles, explosions: object count (I), slot count (I), free slot count (I),
+                sprite records, free slots (i...)
+
+A sprite record is SPRITE_DOUBLES doubles followed by SPRITE_INTS ints.
+
+"""
+
+# import modules
+import struct
+import random
+from array import array
+import game
+
+SNAPSHOT_MAGIC = b'ASNP'
+SNAPSHOT_VERSION = 2
+HEADER_FORMAT = struct.Struct('<4sHQdQqiiBBdd')
+RANDOM_FORMAT = struct.Struct('<BBdH')
+GROUP_FORMAT = struct.Struct('<III')
+# position, previous position, velocity, rotation, previous rotation, rotation velocity, acceleration, friction
+SPRITE_DOUBLES = 11
+# slot, width, height, age, lifetime, accelerating
+SPRITE_INTS = 6
+# number of snapshots kept by a SnapshotRing
+RING_CAPACITY = 600
+
+ROTATION_DIRS = [None, 'left', 'right']
+
+def pack_sprites(sprites, slots):
+    """
+    Packs the sprites into a doubles block and an ints block
+    """
+    doubles = []
+    ints = []
+    for i in range(len(sprites)):
+        sprite = sprites[i]
+        size = sprite.size
+        doubles += sprite.position
+        doubles += sprite.previous_position
+        doubles += sprite.velocity
+        doubles += (sprite.rotation, sprite.previous_rotation, sprite.rotation_velocity, sprite.acceleration, sprite.friction)
+        ints += (slots[i], size[0], size[1], sprite.age, sprite.lifetime, 1 if sprite.accelerating else 0)
+    return array('d', doubles).tobytes() + array('i', ints).tobytes()
+
+def unpack_sprites(data, offset, count):
+    """
+    Returns the doubles, the ints and the offset after the sprite records
+    """
+    doubles = array('d')
+    doubles.frombytes(data[offset:offset + count * SPRITE_DOUBLES * 8])
+    offset += count * SPRITE_DOUBLES * 8
+    ints = array('i')
+    ints.frombytes(data[offset:offset + count * SPRITE_INTS * ints.itemsize])
+    offset += count * SPRITE_INTS * ints.itemsize
+    return doubles, ints, offset
+
+def load_sprite(sprite, doubles, ints, i):
+    """
+    Writes the i-th record into the sprite
+    """
+    d = i * SPRITE_DOUBLES
+    n = i * SPRITE_INTS
+    sprite.position = (doubles[d], doubles[d + 1])
+    sprite.previous_position = (doubles[d + 2], doubles[d + 3])
+    sprite.velocity = (doubles[d + 4], doubles[d + 5])
+    sprite.rotation = doubles[d + 6]
+    sprite.previous_rotation = doubles[d + 7]
+    sprite.rotation_velocity = doubles[d + 8]
+    sprite.acceleration = doubles[d + 9]
+    sprite.friction = doubles[d + 10]
+    # rocks pick their level from the size
+    sprite.set_size((ints[n + 1], ints[n + 2]))
+    sprite.age = ints[n + 3]
+    sprite.lifetime = ints[n + 4]
+    sprite.accelerating = ints[n + 5] == 1
+
+class TrackedRandom(random.Random):
+    """
+    A random generator counting its state changes
+
+    Overrides both random() and getrandbits(), so it draws the same sequence
+    as random.Random from the same state.
+    """
+    def __init__(self, x = None):
+        self.changes = 0
+        self.packed = None
+        self.packed_changes = -1
+        random.Random.__init__(self, x)
+    def seed(self, *args, **kwargs):
+        self.changes += 1
+        random.Random.seed(self, *args, **kwargs)
+    def setstate(self, state):
+        self.changes += 1
+        random.Random.setstate(self, state)
+    def random(self):
+        self.changes += 1
+        return random.Random.random(self)
+    def getrandbits(self, k):
+        self.changes += 1
+        return random.Random.getrandbits(self, k)
+    def randbytes(self, n):
+        self.changes += 1
+        return random.Random.randbytes(self, n)
+    def gauss(self, mu = 0.0, sigma = 1.0):
+        # may only use the kept gauss_next
+        self.changes += 1
+        return random.Random.gauss(self, mu, sigma)
+
+def track_random(asteroids):
+    """
+    Swaps the game's random generator for a TrackedRandom in the same state
+    """
+    generator = asteroids.random
+    if isinstance(generator, TrackedRandom) or not hasattr(generator, 'getstate'):
+        return
+    tracked = TrackedRandom()
+    tracked.setstate(generator.getstate())
+    asteroids.random = tracked
+
+def pack_random(generator):
+    """
+    Returns the packed state of the random generator
+    """
+    if not hasattr(generator, 'getstate'):
+        return RANDOM_FORMAT.pack(0, 0, 0, 0)
+    # unchanged since the last snapshot
+    if isinstance(generator, TrackedRandom) and generator.packed_changes == generator.changes:
+        return generator.packed
+    version, state, gauss_next = generator.getstate()
+    packed = RANDOM_FORMAT.pack(1, 0 if gauss_next is None else 1, gauss_next or 0, len(state)) + array('I', state).tobytes()
+    if isinstance(generator, TrackedRandom):
+        generator.packed = packed
+        generator.packed_changes = generator.changes
+    return packed
+
+def acquire_missle(ship):
+    missle = ship.missle_pool.acquire((10, 10), (0, 0))
+    missle.owner = ship
+    return missle
+
+def get_groups(asteroids):
+    return [asteroids.rocks, asteroids.player.get_missles(), asteroids.explosions]
+
+def take(asteroids):
+    """
+    Returns a snapshot of the game (bytes)
+    """
+    if len(asteroids.ships) > 1:
+        raise ValueError('snapshots only hold the local player\'s spaceship')
+    track_random(asteroids)
+    player = asteroids.player
+    timer = asteroids.get_timer()
+    score = asteroids.score
+    chunks = [HEADER_FORMAT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, asteroids.steps, asteroids.accumulator, asteroids.dropped_steps, timer.time, score.score, score.lives, 1 if asteroids.started else 0, ROTATION_DIRS.index(player.rotation_dir), asteroids.director.elapsed, asteroids.director.credit)]
+    # random generator
+    chunks.append(pack_random(asteroids.random))
+    # player
+    chunks.append(pack_sprites([player], [0]))
+    # groups (with their slot layout, so later adds land in the same slots)
+    for group in get_groups(asteroids):
+        sprites = list(group.get_all())
+        slot_index = group.slot_index
+        slots = [slot_index[sprite] for sprite in sprites]
+        chunks.append(GROUP_FORMAT.pack(len(sprites), len(group.slots), len(group.free_slots)))
+        chunks.append(pack_sprites(sprites, slots))
+        chunks.append(array('i', group.free_slots).tobytes())
+    return b''.join(chunks)
+
+def restore(asteroids, data):
+    """
+    Restores a snapshot into the game (the game must have the same size)
+    """
+    magic, version, steps, accumulator, dropped_steps, timer_time, score, lives, started, rotation_dir, director_elapsed, director_credit = HEADER_FORMAT.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('not a snapshot')
+    if version != SNAPSHOT_VERSION:
+        raise ValueError('unsupported snapshot version %d' % version)
+    offset = HEADER_FORMAT.size
+    asteroids.steps = steps
+    asteroids.accumulator = accumulator
+    asteroids.dropped_steps = dropped_steps
+    asteroids.get_timer().time = timer_time
+    asteroids.score.set_score(score)
+    asteroids.score.set_lives(lives)
+    asteroids.started = started == 1
+    asteroids.splash.hidden = asteroids.started
+    asteroids.spawn_queue = []
+    asteroids.director.elapsed = director_elapsed
+    asteroids.director.credit = director_credit
+    asteroids.director.reset_rates()
+    # random generator
+    has_state, has_gauss, gauss_next, state_length = RANDOM_FORMAT.unpack_from(data, offset)
+    offset += RANDOM_FORMAT.size
+    if has_state == 1:
+        state = array('I')
+        state.frombytes(data[offset:offset + state_length * state.itemsize])
+        offset += state_length * state.itemsize
+        asteroids.random.setstate((3, tuple(state), gauss_next if has_gauss == 1 else None))
+    # player
+    player = asteroids.player
+    doubles, ints, offset = unpack_sprites(data, offset, 1)
+    load_sprite(player, doubles, ints, 0)
+    player.rotation_dir = ROTATION_DIRS[rotation_dir]
+    # groups
+    rocks = list(asteroids.rocks.get_all())
+    factories = [
+        lambda: rocks.pop() if len(rocks) > 0 else game.Rock((90, 90), (0, 0)),
+        lambda: acquire_missle(player),
+        lambda: asteroids.explosion_pool.acquire((128, 128), (0, 0))
+    ]
+    groups = get_groups(asteroids)
+    for i in range(len(groups)):
+        group = groups[i]
+        count, slot_count, free_count = GROUP_FORMAT.unpack_from(data, offset)
+        offset += GROUP_FORMAT.size
+        doubles, ints, offset = unpack_sprites(data, offset, count)
+        free_slots = array('i')
+        free_slots.frombytes(data[offset:offset + free_count * free_slots.itemsize])
+        offset += free_count * free_slots.itemsize
+        # rebuilds the slot layout
+        group.clear()
+        group.slots.extend([None] * slot_count)
+        for j in range(count):
+            sprite = factories[i]()
+            load_sprite(sprite, doubles, ints, j)
+            slot = ints[j * SPRITE_INTS]
+            group.slots[slot] = sprite
+            group.slot_index[sprite] = slot
+        group.free_slots = list(free_slots)
+
+class SnapshotRing:
+    def __init__(self, capacity = RING_CAPACITY):
+        """
+        Keeps the latest snapshots of a game
+
+        <int> capacity      The number of snapshots kept
+        """
+        self.capacity = capacity
+        self.snapshots = [None] * capacity
+        self.steps = [None] * capacity
+        self.index = 0
+        self.count = 0
+        self.asteroids = None
+    def attach(self, asteroids):
+        """
+        Takes a snapshot after every timer tick of the game
+        """
+        self.asteroids = asteroids
+        # runs after the game's own tick handler
+        self.asteroids.dispatcher.add('count', self.capture, 1000)
+    def detach(self):
+        self.asteroids.dispatcher.remove('count', self.capture)
+        self.asteroids = None
+    def capture(self, timer_event = None):
+        self.push(self.asteroids.get_steps(), take(self.asteroids))
+    def push(self, step, snapshot):
+        self.snapshots[self.index] = snapshot
+        self.steps[self.index] = step
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+    def __len__(self):
+        return self.count
+    def get(self, back = 0):
+        """
+        Returns the snapshot taken back captures ago (0 for the latest)
+        """
+        if back >= self.count:
+            raise IndexError('only %d snapshots kept' % self.count)
+        return self.snapshots[(self.index - 1 - back) % self.capacity]
+    def find(self, step):
+        """
+        Returns the latest snapshot taken at or before the given step (None if none)
+        """
+        for back in range(self.count):
+            index = (self.index - 1 - back) % self.capacity
+            if self.steps[index] <= step:
+                return self.snapshots[index]
+        return None
+    def rewind(self, back):
+        """
+        Restores the game to the snapshot taken back captures ago
+        """
+        restore(self.asteroids, self.get(back))
@@ -0,0 +1,66 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Tests of the game engine (python -m unittest).
+
+"""
+
+# import modules
+import unittest
+import game
+
+class Handler:
+    def __init__(self):
+        self.calls = 0
+    def handle(self, event):
+        self.calls += 1
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = game.Dispatcher()
+        self.dispatcher.set_timed(True)
+        self.handler = Handler()
+    def test_remove_forgets_the_handler(self):
+        self.dispatcher.add('update', self.handler.handle)
+        self.dispatcher.run('update', None)
+        self.assertTrue(self.dispatcher.remove('update', self.handler.handle))
+        self.assertEqual(self.dispatcher.handler_names, {})
+        self.assertEqual(self.dispatcher.handler_times, {})
+        self.dispatcher.run('update', None)
+        self.assertEqual(self.handler.calls, 1)
+    def test_remove_keeps_the_other_registrations(self):
+        self.dispatcher.add('update', self.handler.handle)
+        self.dispatcher.add('draw', self.handler.handle)
+        self.dispatcher.remove('update', self.handler.handle)
+        self.assertEqual(list(self.dispatcher.handler_names.values()), ['draw:Handler.handle'])
+        self.dispatcher.run('draw', None)
+        self.assertEqual(self.handler.calls, 1)
+    def test_remove_unknown_handler(self):
+        self.assertFalse(self.dispatcher.remove('update', self.handler.handle))
+
+class GroupTest(unittest.TestCase):
+    def setUp(self):
+        self.group = game.Group()
+        self.objects = [object() for i in range(5)]
+        for object_ in self.objects:
+            self.group.add(object_)
+    def iterate_adding(self, added):
+        visited = []
+        for object_ in self.group.get_all():
+            visited.append(object_)
+            if object_ is self.objects[0]:
+                self.group.add(added)
+        return visited
+    def test_appended_object_is_not_visited(self):
+        added = object()
+        self.assertTrue(added not in self.iterate_adding(added))
+    def test_object_in_a_free_slot_ahead_is_visited(self):
+        self.group.remove(self.objects[3])
+        self.group.flush()
+        added = object()
+        self.assertTrue(added in self.iterate_adding(added))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Project: Asteroids
+Author: Vu Tran
+Website: http://vu-tran.com/
+
+Tests of the networked multiplayer (python -m unittest).
+
+"""
+
+# import modules
+import unittest
+import game, net
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        game.set_backend(game.HeadlessBackend(None))
+        self.asteroids = game.AsteroidsGame(game.WINDOW_SIZE, game.NUM_LIVES, 0, 1)
+        self.server = net.Server(self.asteroids)
+        self.clients = []
+        for i in range(2):
+            server_end, client_end = net.create_pair()
+            self.server.add_client(server_end)
+            self.clients.append(net.Client(client_end))
+        self.asteroids.onclick(self.asteroids.get_center())
+    def test_only_client_ships_are_in_the_world(self):
+        ships = [connection.ship for connection in self.server.connections.values()]
+        self.assertEqual(self.asteroids.ships, ships)
+        self.assertTrue(self.asteroids.player not in self.asteroids.ships)
+    def tick(self):
+        self.server.tick(self.asteroids.get_timer().delay)
+        for client in self.clients:
+            client.poll()
+    def test_idle_world_sends_no_entities(self):
+        # the first state is a full one, then the client acknowledges it
+        self.tick()
+        self.assertTrue(self.asteroids.started)
+        sent = [connection.entities_sent for connection in self.server.connections.values()]
+        self.assertTrue(min(sent) > 0)
+        for i in range(50):
+            self.tick()
+        # the ships age, but their records don't change
+        self.assertEqual([connection.entities_sent for connection in self.server.connections.values()], sent)
+    def test_age_is_derived_from_the_spawn_step(self):
+        for i in range(10):
+            self.tick()
+        ship = self.server.connections[1].ship
+        self.assertTrue(ship.age > 0)
+        self.assertEqual(self.clients[0].get_ship()[4], ship.age)
+
+if __name__ == '__main__':
+    unittest.main()